@@ -8,6 +8,7 @@ import pdb
 from matplotlib import cm
 
 from .color_bar import ColorBar
+from helpers.vtk import stored_value, stored_value_transfer_function
 
 colors = vtk.vtkNamedColors()
 
@@ -163,7 +164,7 @@ class IsoSurfaceWindow(CustomVolumeQVTKRenderWindowInteractor):
     def setup_contour(self):
         contour = vtk.vtkContourFilter()
         contour.SetInputData(self.volume)
-        contour.SetValue(0, self.filter_value)
+        contour.SetValue(0, stored_value(self.filter_value, self.volume))
         return contour
     
     def setup_poly_mapper(self):
@@ -220,14 +221,14 @@ class UncertaintyVolWindow(CustomVolumeQVTKRenderWindowInteractor):
 
     def setup_density_volume(self):
         opacity_tf, color_tf = self.setup_density_tfs()
-        volume_property = self.setup_volume_property(opacity_tf, color_tf)
+        volume_property = self.setup_volume_property(opacity_tf, color_tf, self.density_reader)
 
         self.density_mapper = self.setup_mapper(self.density_reader)
         self.density_volume = self.setup_volume(volume_property, self.density_mapper)
 
     def setup_uncertainty_volume(self):
         opacity_tf, color_tf = self.setup_uncertainty_tfs()
-        volume_property = self.setup_volume_property(opacity_tf, color_tf)
+        volume_property = self.setup_volume_property(opacity_tf, color_tf, self.uncertainty_reader)
         self.uncertainty_mapper = self.setup_mapper(self.uncertainty_reader)
         self.uncertainty_volume = self.setup_volume(volume_property, self.uncertainty_mapper)
 
@@ -278,10 +279,11 @@ class UncertaintyVolWindow(CustomVolumeQVTKRenderWindowInteractor):
 
         return opacity_tf, color_tf
 
-    def setup_volume_property(self, opacity_tf, color_tf):
+    def setup_volume_property(self, opacity_tf, color_tf, data_reader):
+        # the transfer functions are defined over values in [0, 1]; quantized volumes get them over their stored scalars
         volume_property = vtk.vtkVolumeProperty()
-        volume_property.SetColor(color_tf)
-        volume_property.SetScalarOpacity(opacity_tf)
+        volume_property.SetColor(stored_value_transfer_function(color_tf, data_reader.GetOutput()))
+        volume_property.SetScalarOpacity(stored_value_transfer_function(opacity_tf, data_reader.GetOutput()))
         volume_property.ShadeOn()
         
         # no specular lightning
@@ -314,8 +316,7 @@ class UncertaintyVolWindow(CustomVolumeQVTKRenderWindowInteractor):
         self.GetRenderWindow().AddRenderer(renderer)
 
     def update_tf(self):
-        self.density_volume.GetProperty().SetScalarOpacity(self.density_opacity_tf)
-        self.uncertainty_volume.GetProperty().SetScalarOpacity(self.uncertainty_opacity_tf)
+        # the volume properties hold the edited transfer functions, or copies that follow them
         self.GetRenderWindow().Render()
 
     def set_selected_alpha(self, selected_inds):
@@ -330,7 +331,11 @@ class UncertaintyVolWindow(CustomVolumeQVTKRenderWindowInteractor):
 
         new_scalars_vtk = numpy_support.numpy_to_vtk(num_array=new_scalars, deep=True)
         uncertainty_reader_data.GetPointData().SetScalars(new_scalars_vtk)
-        self.uncertainty_reader.SetOutput(uncertainty_reader_data)
+        self.update_z_buffer()
+
+    def refresh_scalars(self):
+        # the reader output was replaced by another volume level
+        self.uncertainty_scalars = self.uncertainty_reader.GetOutput().GetPointData().GetScalars()
         self.update_z_buffer()
 
     def reset_alphas(self):
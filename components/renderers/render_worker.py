@@ -0,0 +1,79 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+
+import threading
+import traceback
+import eval_nerf
+from helpers.vtk import snapshot_volume
+
+class RenderWorker(QThread):
+    r"""Renders views of the NeRF on a background thread, pass by pass (see `eval_nerf.render_passes`, or the
+    `render` function given).
+
+    Requests are queued, but only the newest one counts: it replaces a request that is still waiting and
+    cancels the render in progress at its next ray chunk. Every pass is sent with `image_rendered`, the last one
+    again with `render_finished` (None if the render failed).
+    """
+    image_rendered = pyqtSignal(object)
+    render_finished = pyqtSignal(object)
+
+    def __init__(self, data, render=None):
+        super().__init__()
+
+        self.data = data
+        # called like eval_nerf.render_passes, e.g. eval_nerf.render_baked_passes
+        self.render = render if render is not None else eval_nerf.render_passes
+
+        self.condition = threading.Condition()
+        self.request = None
+        self.request_id = 0
+        self.rendering = False
+        self.stopped = False
+
+    def request_render(self, view, uncertainty=False):
+        # view: the vector magnitude, rotation matrix and focal length of the camera, see eval_nerf.render_passes;
+        # with `uncertainty` the ensemble's per-pixel uncertainty is rendered instead of the image. The opacity
+        # volume is snapshotted here, on the GUI thread, which may swap another volume into it during the render
+        opacity_volume = snapshot_volume(self.data.opacity_volume)
+        with self.condition:
+            self.request = (view, uncertainty, opacity_volume)
+            self.request_id += 1
+            self.condition.notify()
+
+    def is_busy(self):
+        with self.condition:
+            return self.rendering or self.request is not None
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.request_id += 1
+            self.condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.request is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                (view, uncertainty, opacity_volume), request_id = self.request, self.request_id
+                self.request = None
+                self.rendering = True
+
+            def cancelled():
+                return self.request_id != request_id
+
+            image = None
+            try:
+                for image in self.render(*view, self.data, cancelled=cancelled, uncertainty=uncertainty, opacity_volume=opacity_volume):
+                    self.image_rendered.emit(image)
+                self.render_finished.emit(image)
+            except eval_nerf.RenderCancelled:
+                pass
+            except Exception:
+                traceback.print_exc()
+                self.render_finished.emit(None)
+            finally:
+                with self.condition:
+                    self.rendering = False
@@ -0,0 +1,41 @@
+from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import (
+    QVBoxLayout,
+    QLabel,
+    QSlider,
+)
+
+class SeriesSlider(QVBoxLayout):
+    def __init__(self, parent, data):
+        super().__init__()
+
+        self.parent = parent
+        self.data = data
+
+        self.setup_slider()
+
+        if parent:
+            parent.addLayout(self)
+
+    def setup_slider(self):
+        label = QLabel()
+        label.setStyleSheet("QLabel { font-family: Inter; font-size: 14px }")
+
+        slider = QSlider(Qt.Orientation.Horizontal)
+        slider.setRange(0, len(self.data.series_iterations) - 1)
+        slider.setValue(self.data.series_step)
+        slider.valueChanged.connect(self.on_change)
+
+        self.label = label
+        self.slider = slider
+        self.update_label()
+
+        self.addWidget(label)
+        self.addWidget(slider)
+
+    def update_label(self):
+        self.label.setText(f'Iteration {self.data.series_iterations[self.slider.value()]}')
+
+    def on_change(self):
+        self.update_label()
+        self.data.show_series_step(self.slider.value())
@@ -1,12 +1,17 @@
 from PyQt6.QtWidgets import (
+    QApplication,
+    QCheckBox,
     QPushButton,
 )
 
 import numpy as np
 import pdb
 import eval_nerf
+import imageio
 import matplotlib.pyplot as plt
 
+from .render_worker import RenderWorker
+
 class SynthesisButton(QPushButton):
     def __init__(self, text, parent=None, camera=None, synthesis_view=None, data=None):
         super(QPushButton, self).__init__(text)
@@ -22,19 +27,61 @@ class SynthesisButton(QPushButton):
         if parent:
             parent.addWidget(self)
 
+        # an ensemble can render the disagreement of its members instead of the image
+        self.uncertainty_button = None
+        if data.model_type == 'ensemble':
+            self.uncertainty_button = QCheckBox("Render uncertainty")
+            self.uncertainty_button.setStyleSheet("QCheckBox { font-family: Inter; font-size: 14px }")
+            self.uncertainty_button.toggled.connect(self.on_uncertainty_toggled)
+            if parent:
+                parent.addWidget(self.uncertainty_button)
+
+        # renders in the background; every pass replaces the image, from a quick preview up to the full render
+        self.requested_view = None
+        self.render_worker = RenderWorker(data)
+        self.render_worker.image_rendered.connect(synthesis_view.update_image_array)
+        self.render_worker.render_finished.connect(self.on_render_finished)
+        self.render_worker.start()
+        QApplication.instance().aboutToQuit.connect(self.render_worker.stop)
+
+        if camera:
+            camera.AddObserver('ModifiedEvent', self.on_camera_modified)
+
         self.clicked.connect(self.update_view_synthesis_view)
 
+    def render_uncertainty(self):
+        return self.uncertainty_button is not None and self.uncertainty_button.isChecked()
+
     def update_view_synthesis_view(self):
         self.setText('Rendering...')
+        self.requested_view = camera_view(self.camera, original_distance=5.0)
+        self.render_worker.request_render(self.requested_view, uncertainty=self.render_uncertainty())
+
+    def on_camera_modified(self, obj=None, event=None):
+        # a render in progress is replaced by one of the new camera pose
+        if not self.render_worker.is_busy():
+            return
+        view = camera_view(self.camera, original_distance=5.0)
+        if not all(np.allclose(value, requested_value) for value, requested_value in zip(view, self.requested_view)):
+            self.requested_view = view
+            self.render_worker.request_render(view, uncertainty=self.render_uncertainty())
 
-        camera = self.camera
-        synthesis_view = self.synthesis_view
+    def on_uncertainty_toggled(self):
+        self.synthesis_view.uncertainty = self.render_uncertainty()
+        if self.render_worker.is_busy():
+            self.render_worker.request_render(self.requested_view, uncertainty=self.render_uncertainty())
+
+    def on_render_finished(self, image):
         save_file_name = '0001.png'
-        infer_nerf(save_file_name, camera, self.data, original_distance=5.0)
-        synthesis_view.update_image(save_file_name)
+        if image is not None:
+            imageio.imwrite(save_file_name, image)
         self.setText(self.text)
 
 def infer_nerf(save_file_name, camera, data, original_distance=3.0):
+    eval_nerf.get_render_image(*camera_view(camera, original_distance), data, save_file_name)
+
+def camera_view(camera, original_distance=3.0):
+    # distance to the focal point, rotation and focal length of the vtk camera, as eval_nerf renders views
     mvt_matrix = camera.GetModelViewTransformMatrix()
 
     rotation_matrix = np.eye(4)
@@ -52,5 +99,5 @@ def infer_nerf(save_file_name, camera, data, original_distance=3.0):
 
     focal_length = original_distance / camera.GetDistance() * (1200)
 
-    eval_nerf.get_render_image(vector_magnitude, rotation_matrix, focal_length, data, save_file_name)
+    return vector_magnitude, rotation_matrix, focal_length
 
@@ -1,14 +1,21 @@
+import os
 import numpy as np
 
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import (
+    QApplication,
     QLabel,
     QVBoxLayout
 )
 from PyQt6.QtGui import (
+    QImage,
     QPixmap,
 )
 
+import eval_nerf
+from .render_worker import RenderWorker
+from .synthesis_button import camera_view
+
 title_style = """
     QLabel {
         font-family: Inter;
@@ -18,13 +25,25 @@ title_style = """
 """
 
 class SynthesisView():
-    def __init__(self, frame, data):
+    def __init__(self, frame, data, camera=None):
         self.frame = frame
 
         self.data = data
+        self.camera = camera
         self.drawn_angles = data.drawn_angles
         self.images_path = f'{data.data_path}/precomputed_views/'
 
+        # with a baked grid the hovered views are rendered from it on a background worker (see
+        # eval_nerf.render_baked_passes), of the image or of the ensemble's uncertainty as the synthesis button
+        # renders them; a hover replaces the view that is still waiting
+        self.uncertainty = False
+        self.baked_worker = None
+        if data.baked_grid and camera is not None:
+            self.baked_worker = RenderWorker(data, render=eval_nerf.render_baked_passes)
+            self.baked_worker.image_rendered.connect(self.update_image_array)
+            self.baked_worker.start()
+            QApplication.instance().aboutToQuit.connect(self.baked_worker.stop)
+
         self.setup_image_layout(f"{self.images_path}/0313.png")
 
     def setup_image_layout(self, image_path="0001.png"):
@@ -49,6 +68,11 @@ class SynthesisView():
         frame.setLayout(self.layout)
 
     def show_image_by_angle(self, azimuth, elevation):
+        # the iteration shown can change with the time series, and not every iteration has to be baked
+        if self.baked_worker is not None and os.path.exists(self.data.baked_grid_file_name()):
+            self.baked_worker.request_render(camera_view(self.camera, original_distance=5.0), uncertainty=self.uncertainty)
+            return
+
         closest_angle_index = self.find_closest_drawn_angle(azimuth, elevation)
         image_file_name = str(int(closest_angle_index)).zfill(4) + '.png'
         image_path = self.images_path + image_file_name
@@ -59,6 +83,14 @@ class SynthesisView():
         pixmap = pixmap.scaled(self.width, self.height)
         self.label.setPixmap(pixmap)
 
+    def update_image_array(self, image):
+        # a rendered uint8 image (height, width, 3), scaled up to the view like the image files
+        image = np.ascontiguousarray(image)
+        height, width, _ = image.shape
+        qimage = QImage(image.data, width, height, 3 * width, QImage.Format.Format_RGB888)
+        pixmap = QPixmap.fromImage(qimage).scaled(self.width, self.height)
+        self.label.setPixmap(pixmap)
+
     def find_closest_drawn_angle(self, azimuth, elevation):
         min_distance = np.inf
         closest_angle = None
@@ -58,7 +58,10 @@ class DensityScatterPlot(QWidget):
         
         self.ax = self.fig.subplots()
         self.fig.subplots_adjust(left=0.2, bottom=0.15, right=0.95, top=0.95)
-        
+
+        self.setup_axes()
+
+    def setup_axes(self):
         self.ax.set_xlabel("Color uncertainty value")
         self.ax.set_xlim(0, 1)
         # self.ax.set_xbound(lower=np.min(self.color_data), upper=1)
@@ -70,6 +73,18 @@ class DensityScatterPlot(QWidget):
         # self.ax.set_ybound(lower=np.min(self.density_data), upper=1)
         self.ax.set_yticks([0, 0.2, 0.4, 0.6, 0.8, 1])
 
+    def update_data(self, data):
+        # rebuild the plot for new volume data, e.g. after a finer volume level was streamed in
+        self.data = data
+        self.selector.lasso.disconnect_events()
+        self.ax.clear()
+
+        self.setup_data()
+        self.setup_axes()
+        self.setup_scatter_plot_interaction()
+
+        self.canvas.draw_idle()
+
     def setup_data(self):
         data = self.data
 
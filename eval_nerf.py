@@ -2,9 +2,11 @@
 
 import os
 import time
+import collections
 import pdb
 
 import imageio
+import matplotlib
 import numpy as np
 import torch
 import torchvision
@@ -16,7 +18,15 @@ from nerf import (
     models,
     get_embedding_function,
     run_one_iter_of_nerf,
+    run_poses_of_nerf,
+    inference_autocast,
+    inference_graph,
+    OccupancyGrid,
+    BakedGrid,
 )
+from nerf.metrics import ensemble_disagreement
+from helpers.vtk import volume_values
+from helpers.render_cache import RenderCache, render_cache_key
 
 def cast_to_image(tensor, dataset_type):
     tensor = tensor.permute(2, 0, 1)
@@ -28,144 +38,541 @@ def cast_to_disparity_image(tensor):
     img = img.clamp(0, 1) * 255
     return img.detach().cpu().numpy().astype(np.uint8)
 
-def get_render_image(vector_magnitude, rotation_matrix, focal_length, data, file_name):
-    config_file_path = f'{data.data_path}/config.yml'
-    checkpoint_file_path = f'{data.data_path}/checkpoint{data.iterations-1}.ckpt'
+# passes of a progressive render (see render_passes): the image size as a fraction of the full image and the
+# coarse and fine samples per ray, None for the config's validation settings; 0 fine samples renders the coarse
+# network only
+RENDER_PASSES = [
+    {'scale': 1 / 8, 'num_coarse': 32, 'num_fine': 0},
+    {'scale': 1 / 4, 'num_coarse': 64, 'num_fine': 0},
+    {'scale': 1 / 2, 'num_coarse': None, 'num_fine': None},
+    {'scale': 1, 'num_coarse': None, 'num_fine': None},
+]
 
-    cfg = None
-    with open(config_file_path, "r") as f:
-        cfg_dict = yaml.load(f, Loader=yaml.FullLoader)
-        cfg = CfgNode(cfg_dict)
-    checkpoint = torch.load(checkpoint_file_path, weights_only=True)
-
-    # Device on which to run.
-    device = "cpu"
-    if torch.cuda.is_available():
-        device = "cuda"
-
-    encode_position_fn = get_embedding_function(
-        num_encoding_functions=cfg.models.coarse.num_encoding_fn_xyz,
-        include_input=cfg.models.coarse.include_input_xyz,
-        log_sampling=cfg.models.coarse.log_sampling_xyz,
-    )
-
-    encode_direction_fn = None
-    if cfg.models.coarse.use_viewdirs:
-        encode_direction_fn = get_embedding_function(
-            num_encoding_functions=cfg.models.coarse.num_encoding_fn_dir,
-            include_input=cfg.models.coarse.include_input_dir,
-            log_sampling=cfg.models.coarse.log_sampling_dir,
+class RenderCancelled(Exception):
+    # raised between ray chunks when a render is no longer needed, see render_passes
+    pass
+
+# render sessions of the most recently used scenes, by data path; see render_session
+MAX_RENDER_SESSIONS = 2
+render_sessions = collections.OrderedDict()
+
+# rendered views of every scene, by data path; see render_cache
+render_caches = {}
+
+# the baked grid rendered last, by file name; see baked_grid
+baked_grids = {}
+
+class RenderSession():
+    r"""Everything needed to render a scene that does not depend on the view: the parsed config, the models on
+    the device and the embedding functions. They are set up once per scene; `load_checkpoint` only reloads the
+    weights when another (or a newer) checkpoint is asked for, e.g. another step of a series.
+    """
+    def __init__(self, data_path, model_type):
+        self.data_path = data_path
+        self.model_type = model_type
+
+        config_file_path = f'{data_path}/config.yml'
+        with open(config_file_path, "r") as f:
+            cfg_dict = yaml.load(f, Loader=yaml.FullLoader)
+            self.cfg = CfgNode(cfg_dict)
+        cfg = self.cfg
+
+        # Device on which to run.
+        self.device = "cpu"
+        if torch.cuda.is_available():
+            self.device = "cuda"
+
+        self.encode_position_fn = get_embedding_function(
+            num_encoding_functions=cfg.models.coarse.num_encoding_fn_xyz,
+            include_input=cfg.models.coarse.include_input_xyz,
+            log_sampling=cfg.models.coarse.log_sampling_xyz,
         )
 
-    # Initialize a coarse resolution model.
-    model_type = data.model_type
-    model_coarse = getattr(models, cfg.models.coarse.type)(
-        num_layers=cfg.models.coarse.num_layers,
-        hidden_size=cfg.models.coarse.hidden_size,
-        skip_connect_every=cfg.models.coarse.skip_connect_every,
-        num_encoding_fn_xyz=cfg.models.coarse.num_encoding_fn_xyz,
-        num_encoding_fn_dir=cfg.models.coarse.num_encoding_fn_dir,
-        include_input_xyz=cfg.models.coarse.include_input_xyz,
-        include_input_dir=cfg.models.coarse.include_input_dir,
-        use_viewdirs=cfg.models.coarse.use_viewdirs,
-        model_type=model_type,
-    )
-    model_coarse.to(device)
-
-    # If a fine-resolution model is specified, initialize it.
-    model_fine = None
-    if hasattr(cfg.models, "fine"):
-        model_fine = getattr(models, cfg.models.fine.type)(
-            num_layers=cfg.models.fine.num_layers,
-            hidden_size=cfg.models.fine.hidden_size,
-            skip_connect_every=cfg.models.fine.skip_connect_every,
-            num_encoding_fn_xyz=cfg.models.fine.num_encoding_fn_xyz,
-            num_encoding_fn_dir=cfg.models.fine.num_encoding_fn_dir,
-            include_input_xyz=cfg.models.fine.include_input_xyz,
-            include_input_dir=cfg.models.fine.include_input_dir,
-            use_viewdirs=cfg.models.fine.use_viewdirs,
+        self.encode_direction_fn = None
+        if cfg.models.coarse.use_viewdirs:
+            self.encode_direction_fn = get_embedding_function(
+                num_encoding_functions=cfg.models.coarse.num_encoding_fn_dir,
+                include_input=cfg.models.coarse.include_input_dir,
+                log_sampling=cfg.models.coarse.log_sampling_dir,
+            )
+
+        # Initialize a coarse resolution model.
+        self.model_coarse = getattr(models, cfg.models.coarse.type)(
+            num_layers=cfg.models.coarse.num_layers,
+            hidden_size=cfg.models.coarse.hidden_size,
+            skip_connect_every=cfg.models.coarse.skip_connect_every,
+            num_encoding_fn_xyz=cfg.models.coarse.num_encoding_fn_xyz,
+            num_encoding_fn_dir=cfg.models.coarse.num_encoding_fn_dir,
+            include_input_xyz=cfg.models.coarse.include_input_xyz,
+            include_input_dir=cfg.models.coarse.include_input_dir,
+            use_viewdirs=cfg.models.coarse.use_viewdirs,
             model_type=model_type,
         )
-        model_fine.to(device)
-
-    coarse_model_secondary_list = []
-    fine_model_secondary_list = []
-
-    model_coarse.load_state_dict(checkpoint["model_coarse_state_dict"])
-    if checkpoint["model_fine_state_dict"]:
-        try:
-            model_fine.load_state_dict(checkpoint["model_fine_state_dict"])
-        except:
-            print(
-                "The checkpoint has a fine-level model, but it could "
-                "not be loaded (possibly due to a mismatched config file."
+        self.model_coarse.to(self.device)
+
+        # If a fine-resolution model is specified, initialize it.
+        self.model_fine = None
+        if hasattr(cfg.models, "fine"):
+            self.model_fine = getattr(models, cfg.models.fine.type)(
+                num_layers=cfg.models.fine.num_layers,
+                hidden_size=cfg.models.fine.hidden_size,
+                skip_connect_every=cfg.models.fine.skip_connect_every,
+                num_encoding_fn_xyz=cfg.models.fine.num_encoding_fn_xyz,
+                num_encoding_fn_dir=cfg.models.fine.num_encoding_fn_dir,
+                include_input_xyz=cfg.models.fine.include_input_xyz,
+                include_input_dir=cfg.models.fine.include_input_dir,
+                use_viewdirs=cfg.models.fine.use_viewdirs,
+                model_type=model_type,
             )
+            self.model_fine.to(self.device)
 
-    hwf = [800, 800, focal_length]
+        # see load_secondary_models
+        self.coarse_model_secondary_list = []
+        self.fine_model_secondary_list = []
 
-    model_coarse.eval()
-    if model_fine:
-        model_fine.eval()
+        # empty-space skipping, see update_occupancy_grid
+        self.occupancy_grid = None
+        self.occupancy_grid_key = None
+        # transmittance below which rays stop, 0 to composite all samples (see run_network_terminated)
+        self.early_termination = 0.0
+        # precision the networks run in, see inference_autocast
+        self.precision = 'fp32'
+        # 'None' to render with the models, else how they are exported, see inference_models
+        self.inference_graph = 'None'
+        self.graphs = {}
+        self.graphs_key = None
 
-    def rotate_by_phi_along_x(phi):
-        tform = np.eye(4).astype(np.float32)
-        tform[1, 1] = tform[2, 2] = np.cos(phi)
-        tform[1, 2] = -np.sin(phi)
-        tform[2, 1] = -tform[1, 2]
-        return tform
+        self.checkpoint_file_path = None
+        self.checkpoint_mtime = None
 
-    translationMatrix = np.eye(4).astype(np.float32)
-    translationMatrix[2, 3] = 4.0 if vector_magnitude >= 4.0 else vector_magnitude
-    rotationMatrix = np.linalg.inv(rotation_matrix)
-    tranformationMatrix = rotate_by_phi_along_x(-90 / 180.0 * np.pi) @ np.array([[1, 0, 0, 0], [0, 0, -1, 0], [0, 1, 0, 0], [0, 0, 0, 1]]) @ rotationMatrix @ translationMatrix
+    def load_checkpoint(self, checkpoint_file_path):
+        checkpoint_mtime = os.path.getmtime(checkpoint_file_path)
+        if checkpoint_file_path == self.checkpoint_file_path and checkpoint_mtime == self.checkpoint_mtime:
+            return
 
-    render_poses = torch.stack(
-        [
-            torch.from_numpy(tranformationMatrix)
-        ],
-        0,
-    )
+        checkpoint = torch.load(checkpoint_file_path, weights_only=True, map_location=self.device)
+        self.model_coarse.load_state_dict(checkpoint["model_coarse_state_dict"])
+        if checkpoint["model_fine_state_dict"]:
+            try:
+                self.model_fine.load_state_dict(checkpoint["model_fine_state_dict"])
+            except:
+                print(
+                    "The checkpoint has a fine-level model, but it could "
+                    "not be loaded (possibly due to a mismatched config file."
+                )
+        if len(self.fine_model_secondary_list) > 0:
+            self.coarse_model_secondary_list.load_state_dict_list(checkpoint["model_coarse_secondary_state_dict"], name="model_coarse_secondary_state_dict")
+            self.fine_model_secondary_list.load_state_dict_list(checkpoint["model_fine_secondary_state_dict"], name="model_fine_secondary_state_dict")
 
-    render_poses = render_poses.float().to(device)
+        self.model_coarse.eval()
+        if self.model_fine:
+            self.model_fine.eval()
+        if len(self.fine_model_secondary_list) > 0:
+            self.coarse_model_secondary_list.eval()
+            self.fine_model_secondary_list.eval()
 
-    save_dir = '.'
+        self.checkpoint_file_path = checkpoint_file_path
+        self.checkpoint_mtime = checkpoint_mtime
 
-    # Evaluation loop
-    times_per_image = []
-    for i, pose in enumerate(render_poses):
-        start = time.time()
-        rgb = None, None
-        disp = None, None
-        with torch.no_grad():
-            pose = pose[:3, :4]
-            ray_origins, ray_directions = get_ray_bundle(hwf[0], hwf[1], hwf[2], pose)
+    def load_secondary_models(self):
+        # the secondary members of an ensemble, built and loaded the first time an uncertainty image is rendered
+        if len(self.fine_model_secondary_list) > 0:
+            return
+        cfg = self.cfg
+        for level in ('coarse', 'fine'):
+            cfg_model = getattr(cfg.models_secondary, level)
+            model_secondary_list = models.EnsembleFlexibleNeRFModel(
+                cfg.experiment.num_models_secondary,
+                num_layers=cfg_model.num_layers,
+                hidden_size=cfg_model.hidden_size,
+                skip_connect_every=cfg_model.skip_connect_every,
+                num_encoding_fn_xyz=cfg_model.num_encoding_fn_xyz,
+                num_encoding_fn_dir=cfg_model.num_encoding_fn_dir,
+                include_input_xyz=cfg_model.include_input_xyz,
+                include_input_dir=cfg_model.include_input_dir,
+                use_viewdirs=cfg_model.use_viewdirs,
+                model_type=self.model_type,
+            )
+            model_secondary_list.to(self.device)
+            setattr(self, f'{level}_model_secondary_list', model_secondary_list)
+
+        # reload the checkpoint, now with the secondary models
+        checkpoint_file_path = self.checkpoint_file_path
+        self.checkpoint_file_path = None
+        self.load_checkpoint(checkpoint_file_path)
+
+    def density(self, pts):
+        # density of the fine model (or the coarse one) at points (N, 3); it does not depend on the view direction
+        model = self.model_fine if self.model_fine else self.model_coarse
+        pts = pts.to(self.device)
+        embedded = self.encode_position_fn(pts)
+        if self.encode_direction_fn is not None:
+            viewdirs = torch.zeros_like(pts)
+            viewdirs[:, 2] = 1.0
+            embedded = torch.cat((embedded, self.encode_direction_fn(viewdirs)), dim=-1)
+        with torch.no_grad(), inference_autocast(self.precision, self.device):
+            return torch.nn.functional.relu(model(embedded)[:, 3].float())
+
+    def update_occupancy_grid(self, source, volume=None, threshold=0.01, dilation=1, probe_resolution=64):
+        r"""Skip empty space from now on, with an occupancy grid of the opacity `volume` (`source` 'volume', e.g.
+        the volume shown in the viewer) or of a density probe of the loaded checkpoint on the volume generator's
+        grid (`source` 'probe'). The grid is only rebuilt when the volume or the checkpoint changed. Returns the
+        fraction of the grid that is occupied.
+        """
+        if source == 'volume':
+            # keyed on the scalars rather than the volume: a swap copies other scalars into the same volume, and a
+            # snapshot of the volume (see helpers.vtk.snapshot_volume) shares them
+            scalars = volume.GetPointData().GetScalars()
+            key = (source, scalars.GetAddressAsString('vtkDataArray'), scalars.GetMTime())
+        elif source == 'probe':
+            key = (source, self.checkpoint_file_path, self.checkpoint_mtime, probe_resolution)
+        else:
+            raise ValueError(f'Unknown occupancy grid source {source}; valid sources: volume, probe')
+        if key == self.occupancy_grid_key:
+            return self.occupancy_grid.fraction_occupied()
+
+        if source == 'volume':
+            occupancy_grid = OccupancyGrid.from_values(volume_values(volume), volume.GetDimensions(), volume.GetOrigin(), volume.GetSpacing(), threshold=threshold, dilation=dilation)
+        else:
+            dims = (probe_resolution, probe_resolution, probe_resolution)
+            spacing = [3.0 / (probe_resolution - 1)] * 3
+            occupancy_grid = OccupancyGrid.from_density_fn(self.density, dims, (-1.5, -1.5, -1.5), spacing, threshold=threshold, dilation=dilation)
+        self.occupancy_grid = occupancy_grid.to(self.device)
+        self.occupancy_grid_key = key
+        return self.occupancy_grid.fraction_occupied()
+
+    def inference_models(self, coarse_model_secondary_list, fine_model_secondary_list):
+        r"""The coarse, fine and secondary models and the position and direction encoding functions to render
+        with. Those are the models themselves, or with an `inference_graph` mode their graphs (see
+        `nerf.inference_graph`), which encode the inputs themselves. Graphs are exported on first use and again
+        once another checkpoint is loaded.
+        """
+        models = [self.model_coarse, self.model_fine, coarse_model_secondary_list, fine_model_secondary_list]
+        if self.inference_graph == 'None':
+            return models + [self.encode_position_fn, self.encode_direction_fn]
+
+        key = (self.inference_graph, self.checkpoint_file_path, self.checkpoint_mtime)
+        if key != self.graphs_key:
+            self.graphs, self.graphs_key = {}, key
+        graphs = []
+        for model in models:
+            # no fine model, or no secondary models to render with
+            if model is None or isinstance(model, list):
+                graphs.append(model)
+                continue
+            if id(model) not in self.graphs:
+                # the models are encoded with the encoding of the coarse model, as by the encoding functions
+                self.graphs[id(model)] = inference_graph(model, self.cfg.models.coarse, mode=self.inference_graph)
+            graphs.append(self.graphs[id(model)])
+
+        def identity(x):
+            return x
+        return graphs + [identity, identity if self.encode_direction_fn is not None else None]
+
+    def render_outputs(self, pose, height, width, focal_length, num_coarse=None, num_fine=None, cancelled=None, secondary=False):
+        # outputs of run_one_iter_of_nerf for a camera-to-world pose, optionally with fewer samples per ray and
+        # with the secondary models; stops with RenderCancelled as soon as `cancelled()` is true
+        def check_cancelled():
+            if cancelled():
+                raise RenderCancelled()
+
+        cfg = self.cfg
+        if num_coarse is not None or num_fine is not None:
+            cfg = cfg.clone()
+            if num_coarse is not None:
+                cfg.nerf.validation.num_coarse = num_coarse
+            if num_fine is not None:
+                cfg.nerf.validation.num_fine = num_fine
+
+        # the secondary models are evaluated on the samples of the main models; only those of the last level
+        # (fine, or coarse without fine samples) are needed
+        coarse_model_secondary_list, fine_model_secondary_list = [], []
+        if secondary and cfg.nerf.validation.num_fine > 0:
+            fine_model_secondary_list = self.fine_model_secondary_list
+        elif secondary:
+            coarse_model_secondary_list = self.coarse_model_secondary_list
+
+        model_coarse, model_fine, coarse_model_secondary_list, fine_model_secondary_list, encode_position_fn, encode_direction_fn \
+            = self.inference_models(coarse_model_secondary_list, fine_model_secondary_list)
+
+        with torch.no_grad(), inference_autocast(self.precision, self.device):
+            pose = pose[:3, :4].float().to(self.device)
+            ray_origins, ray_directions = get_ray_bundle(height, width, focal_length, pose)
             outputs \
                 = run_one_iter_of_nerf(
-                    hwf[0],
-                    hwf[1],
-                    hwf[2],
+                    height,
+                    width,
+                    focal_length,
                     model_coarse,
                     model_fine,
-                    [],
-                    [],
+                    coarse_model_secondary_list,
+                    fine_model_secondary_list,
                     ray_origins,
                     ray_directions,
                     cfg,
                     mode="validation",
                     encode_position_fn=encode_position_fn,
                     encode_direction_fn=encode_direction_fn,
-                    model_type=model_type,
+                    model_type=self.model_type,
+                    chunk_callback=check_cancelled if cancelled is not None else None,
+                    occupancy_grid=self.occupancy_grid,
+                    early_termination=self.early_termination,
                 )
-            
-            rgb_coarse = outputs[0]
-            rgb_fine = outputs[3]
-
-            rgb = rgb_fine if rgb_fine is not None else rgb_coarse
-            # if configargs.save_disparity_image:
-            #     disp = disp_fine if disp_fine is not None else disp_coarse
-        times_per_image.append(time.time() - start)
-        if save_dir:
-            savefile = f"{file_name}"
-            imageio.imwrite(
-                savefile, cast_to_image(rgb[..., :3], cfg.dataset.type.lower())
-            )
\ No newline at end of file
+        return outputs
+
+    def render(self, pose, height, width, focal_length, num_coarse=None, num_fine=None, cancelled=None, depth=False):
+        # rgb image of a camera-to-world pose, (height, width, 3), and with `depth` its expected depth (height, width)
+        outputs = self.render_outputs(pose, height, width, focal_length, num_coarse=num_coarse, num_fine=num_fine, cancelled=cancelled)
+
+        rgb_coarse, disp_coarse, acc_coarse, rgb_fine, disp_fine, acc_fine = outputs[:6]
+
+        rgb = rgb_fine if rgb_fine is not None else rgb_coarse
+        if not depth:
+            return rgb
+        disp, acc = (disp_fine, acc_fine) if rgb_fine is not None else (disp_coarse, acc_coarse)
+        return rgb, torch.nan_to_num(acc / disp)
+
+    def render_poses(self, poses, height, width, focal_lengths, cancelled=None, out=None):
+        # rgb images of camera-to-world poses (N, 4, 4), (N, height, width, 3), with the rays of all poses packed
+        # into full chunks; see run_poses_of_nerf
+        def check_cancelled():
+            if cancelled():
+                raise RenderCancelled()
+
+        model_coarse, model_fine, _, _, encode_position_fn, encode_direction_fn = self.inference_models([], [])
+
+        with torch.no_grad(), inference_autocast(self.precision, self.device):
+            return run_poses_of_nerf(
+                height,
+                width,
+                focal_lengths,
+                poses[:, :4, :4].float().to(self.device),
+                model_coarse,
+                model_fine,
+                self.cfg,
+                mode="validation",
+                encode_position_fn=encode_position_fn,
+                encode_direction_fn=encode_direction_fn,
+                chunk_callback=check_cancelled if cancelled is not None else None,
+                occupancy_grid=self.occupancy_grid,
+                early_termination=self.early_termination,
+                out=out,
+            )
+
+    def render_uncertainty(self, pose, height, width, focal_length, metric='pairwise', num_coarse=None, num_fine=None, cancelled=None):
+        r"""Render the view with all members of the ensemble in one pass, on the rays and samples of the main models.
+
+        Args:
+            metric (str): Per-pixel disagreement of the member colors, see `nerf.metrics.ensemble_disagreement`.
+
+        Returns:
+        rgb (torch.Tensor): Mean image of the members, :math:`(height, width, 3)`.
+        uncertainty (torch.Tensor): Disagreement of the members per pixel, :math:`(height, width)`.
+        depth (torch.Tensor): Expected depth along the rays of the main model, :math:`(height, width)`.
+        """
+        self.load_secondary_models()
+        outputs = self.render_outputs(pose, height, width, focal_length, num_coarse=num_coarse, num_fine=num_fine, cancelled=cancelled, secondary=True)
+
+        rgb_coarse, disp_coarse, acc_coarse, rgb_fine, disp_fine, acc_fine = outputs[:6]
+        if rgb_fine is not None:
+            rgb, disp, acc, rgb_secondary = rgb_fine, disp_fine, acc_fine, outputs[7]
+        else:
+            rgb, disp, acc, rgb_secondary = rgb_coarse, disp_coarse, acc_coarse, outputs[6]
+
+        members = torch.stack([rgb] + list(rgb_secondary), dim=0)[..., :3]    # [M, H, W, 3]
+        uncertainty = ensemble_disagreement(members.reshape(members.shape[0], -1, 3), metric).reshape(height, width)
+        # the disparity is the inverse of the depth divided by the accumulated opacity
+        depth = torch.nan_to_num(acc / disp)
+        return members.mean(dim=0), uncertainty, depth
+
+def render_session(data, opacity_volume=None):
+    r"""The render session of `data`'s scene with the checkpoint of its iteration loaded. Sessions are kept for
+    the `MAX_RENDER_SESSIONS` most recently rendered scenes. The occupancy grid of empty-space skipping is that of
+    `opacity_volume`, by default `data.opacity_volume`; off the GUI thread pass a snapshot of it instead (see
+    `helpers.vtk.snapshot_volume`), since the GUI thread swaps other volumes into it.
+    """
+    session = render_sessions.pop(data.data_path, None)
+    if session is None:
+        session = RenderSession(data.data_path, data.model_type)
+    render_sessions[data.data_path] = session
+
+    while len(render_sessions) > MAX_RENDER_SESSIONS:
+        render_sessions.popitem(last=False)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    session.load_checkpoint(f'{data.data_path}/checkpoint{data.iterations-1}.ckpt')
+    session.early_termination = data.early_termination
+    session.precision = data.precision
+    session.inference_graph = data.inference_graph
+    if data.empty_space_skipping != 'None':
+        volume = opacity_volume if opacity_volume is not None else data.opacity_volume
+        session.update_occupancy_grid(data.empty_space_skipping, volume=volume)
+    else:
+        session.occupancy_grid = None
+        session.occupancy_grid_key = None
+    return session
+
+def rotate_by_phi_along_x(phi):
+    tform = np.eye(4).astype(np.float32)
+    tform[1, 1] = tform[2, 2] = np.cos(phi)
+    tform[1, 2] = -np.sin(phi)
+    tform[2, 1] = -tform[1, 2]
+    return tform
+
+def render_pose(vector_magnitude, rotation_matrix):
+    # camera-to-world pose of the viewer camera, from its distance to the focal point and its rotation
+    translationMatrix = np.eye(4).astype(np.float32)
+    translationMatrix[2, 3] = 4.0 if vector_magnitude >= 4.0 else vector_magnitude
+    rotationMatrix = np.linalg.inv(rotation_matrix)
+    tranformationMatrix = rotate_by_phi_along_x(-90 / 180.0 * np.pi) @ np.array([[1, 0, 0, 0], [0, 0, -1, 0], [0, 1, 0, 0], [0, 0, 0, 1]]) @ rotationMatrix @ translationMatrix
+    return torch.from_numpy(tranformationMatrix).float()
+
+def cast_to_uncertainty_image(tensor, colormap='Purples'):
+    # per-pixel uncertainty as a color image, scaled to the maximum of the image
+    values = tensor.detach().cpu().numpy()
+    values = values / values.max() if values.max() > 0 else values
+    img = matplotlib.colormaps[colormap](values)[..., :3]
+    return (img * 255).astype(np.uint8)
+
+def render_cache(data):
+    # the RenderCache of `data`'s scene, None if the config turns it off
+    if not data.render_cache:
+        return None
+    if data.data_path not in render_caches:
+        render_caches[data.data_path] = RenderCache(
+            max_entries=data.render_cache_entries,
+            cache_dir=f'{data.data_path}/render_cache',
+            max_disk_bytes=int(data.render_cache_disk_mb * 2 ** 20),
+        )
+    return render_caches[data.data_path]
+
+def render_cache_settings(session, data, render_pass, image_size, uncertainty, uncertainty_metric):
+    # everything a rendered view depends on besides the pose and focal length, see render_cache_key
+    cfg = session.cfg.nerf.validation
+    return {
+        'checkpoint': session.checkpoint_file_path,
+        'checkpoint_mtime': session.checkpoint_mtime,
+        'image_size': image_size,
+        'scale': render_pass['scale'],
+        'num_coarse': render_pass['num_coarse'] if render_pass['num_coarse'] is not None else cfg.num_coarse,
+        'num_fine': render_pass['num_fine'] if render_pass['num_fine'] is not None else cfg.num_fine,
+        'uncertainty': uncertainty_metric if uncertainty else None,
+        'precision': session.precision,
+        'early_termination': session.early_termination,
+        'empty_space_skipping': data.empty_space_skipping,
+        'inference_graph': session.inference_graph,
+    }
+
+def render_passes(vector_magnitude, rotation_matrix, focal_length, data, passes=RENDER_PASSES, image_size=800, cancelled=None, uncertainty=False, uncertainty_metric='pairwise', opacity_volume=None):
+    r"""Render a view progressively, from a fast low-resolution preview up to the full image.
+
+    Yields the image of every pass in `passes` (see `RENDER_PASSES`) as soon as it is rendered, as a uint8 array
+    (height, width, 3). `focal_length` is that of the full `image_size` x `image_size` image. `cancelled` is
+    checked between ray chunks; once it returns True the render stops with `RenderCancelled`. With `uncertainty`
+    the images show the per-pixel disagreement of the ensemble members instead (see
+    `RenderSession.render_uncertainty`). `opacity_volume` is passed on to `render_session`.
+
+    The last pass is kept in the scene's render cache (see `render_cache`) with its depth; a view that is already
+    cached, or one of a pose close enough to it, only yields the cached image.
+    """
+    session = render_session(data, opacity_volume=opacity_volume)
+    pose = render_pose(vector_magnitude, rotation_matrix)
+
+    cache, cache_key = render_cache(data), None
+    if cache is not None:
+        settings = render_cache_settings(session, data, passes[-1], image_size, uncertainty, uncertainty_metric)
+        cache_key = render_cache_key(pose.numpy(), focal_length, settings, angle_step=data.render_cache_angle, distance_step=data.render_cache_distance)
+        view = cache.get(cache_key)
+        if view is not None:
+            yield view['image']
+            return
+
+    for index, render_pass in enumerate(passes):
+        start = time.time()
+        size = max(1, int(round(image_size * render_pass['scale'])))
+        render_args = {'num_coarse': render_pass['num_coarse'], 'num_fine': render_pass['num_fine'], 'cancelled': cancelled}
+        if uncertainty:
+            _, pixel_uncertainty, depth = session.render_uncertainty(pose, size, size, focal_length * size / image_size, metric=uncertainty_metric, **render_args)
+            image = cast_to_uncertainty_image(pixel_uncertainty)
+        else:
+            rgb, depth = session.render(pose, size, size, focal_length * size / image_size, depth=True, **render_args)
+            image = cast_to_image(rgb[..., :3], session.cfg.dataset.type.lower())
+        print(f'Render time ({size}x{size}):', time.time() - start)
+
+        # a pass that finished after it was cancelled is outdated
+        if cancelled is not None and cancelled():
+            raise RenderCancelled()
+        if cache is not None and index == len(passes) - 1:
+            cache.put(cache_key, {'image': image, 'depth': depth.detach().cpu().numpy().astype(np.float32)})
+        yield image
+
+def render_baked(vector_magnitude, rotation_matrix, focal_length, baked_grid, dataset_type, image_size=800, render_size=128, num_samples=64, uncertainty=False):
+    r"""Render a view from a `nerf.BakedGrid` instead of the networks, as a uint8 array
+    (render_size, render_size, 3). `focal_length` is that of the full `image_size` x `image_size` image, and
+    `dataset_type` that of the scene's config (see `scene_dataset_type`). With `uncertainty` (and a grid baked
+    with its ensemble members) the image shows the per-pixel uncertainty.
+    """
+    pose = render_pose(vector_magnitude, rotation_matrix)
+    focal_length = focal_length * render_size / image_size
+    if uncertainty and baked_grid.has_members():
+        _, _, pixel_uncertainty = baked_grid.render(pose, render_size, render_size, focal_length, num_samples=num_samples, members=True)
+        image = cast_to_uncertainty_image(pixel_uncertainty)
+    else:
+        rgb = baked_grid.render(pose, render_size, render_size, focal_length, num_samples=num_samples)
+        image = cast_to_image(rgb.clamp(0, 1), dataset_type)
+    return image
+
+def scene_dataset_type(data):
+    # the dataset type of the config of `data`'s scene, as the render session has it, without loading the models
+    with open(f'{data.data_path}/config.yml', "r") as f:
+        cfg_dict = yaml.load(f, Loader=yaml.FullLoader)
+    return cfg_dict['dataset']['type'].lower()
+
+def baked_grid(data):
+    # the BakedGrid of `data`'s iteration (see volume_generator.bake_grid), None if it is not baked
+    file_name = data.baked_grid_file_name()
+    if file_name not in baked_grids:
+        if not os.path.exists(file_name):
+            return None
+        baked_grids.clear()
+        baked_grids[file_name] = BakedGrid.load(file_name)
+    return baked_grids[file_name]
+
+def render_baked_passes(vector_magnitude, rotation_matrix, focal_length, data, cancelled=None, uncertainty=False, opacity_volume=None):
+    r"""`render_passes` for views rendered from the baked grid of `data` (see `render_baked`): a single pass of
+    `data.baked_image_size` pixels and `data.baked_num_samples` samples per ray, which bound its cost. Yields
+    nothing if the iteration is not baked. The image is yielded even if a newer view was asked for meanwhile, so
+    the view keeps following a camera that does not stop moving.
+    """
+    grid = baked_grid(data)
+    if grid is None:
+        return
+    yield render_baked(vector_magnitude, rotation_matrix, focal_length, grid, scene_dataset_type(data), render_size=data.baked_image_size, num_samples=data.baked_num_samples, uncertainty=uncertainty)
+
+def get_render_image(vector_magnitude, rotation_matrix, focal_length, data, file_name):
+    # only the full render, e.g. to precompute views
+    image = next(render_passes(vector_magnitude, rotation_matrix, focal_length, data, passes=RENDER_PASSES[-1:]))
+    imageio.imwrite(file_name, image)
+
+def get_render_images(views, data, file_names, image_size=800, poses_per_batch=4):
+    r"""Render several views at full resolution and write them to `file_names`, e.g. to precompute views.
+
+    `views` are (vector magnitude, rotation matrix, focal length) tuples as for `get_render_image`. The views are
+    rendered `poses_per_batch` at a time, with the rays of a batch packed into full chunks (see
+    `RenderSession.render_poses`); the batch output is reused.
+    """
+    session = render_session(data)
+    out = None
+    for start in range(0, len(views), poses_per_batch):
+        batch_views = views[start:start + poses_per_batch]
+        poses = torch.stack([render_pose(vector_magnitude, rotation_matrix) for vector_magnitude, rotation_matrix, _ in batch_views])
+        focal_lengths = [focal_length for _, _, focal_length in batch_views]
+        if out is None or out.shape[0] != len(batch_views):
+            out = torch.empty((len(batch_views), image_size, image_size, 3), device=session.device)
+
+        begin = time.time()
+        session.render_poses(poses, image_size, image_size, focal_lengths, out=out)
+        print(f'Render time ({len(batch_views)} views):', time.time() - begin)
+        for image, file_name in zip(out, file_names[start:start + poses_per_batch]):
+            imageio.imwrite(file_name, cast_to_image(image, session.cfg.dataset.type.lower()))
@@ -1,7 +1,10 @@
-from .vtk import read_volume_from_vtk_file
+from .vtk import read_volume, read_volume_fields, read_volume_series_file, volume_values
 import vtk.util.numpy_support as numpy_support
 
+import os
 import pdb
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 
@@ -19,10 +22,54 @@ class Data():
         self.vmin_std_color = config_args['vmin_std_color'] if 'vmin_std_color' in config_args else 'None'
         self.vmax_std_density = config_args['vmax_std_density'] if 'vmax_std_density' in config_args else 'None'
         self.vmax_std_color = config_args['vmax_std_color'] if 'vmax_std_color' in config_args else 'None'
+        # resolution of the volume pyramid level to show ('None' is the full resolution), and an optional
+        # coarser level that is shown first while the volume level is streamed in
+        self.volume_level = config_args['volume_level'] if 'volume_level' in config_args else 'None'
+        self.preview_level = config_args['preview_level'] if 'preview_level' in config_args else 'None'
+        # show the time series of training iterations written by volume_generator.volume_series instead, starting
+        # at `iterations`, with the given number of neighbouring time steps read ahead in the background
+        self.series = config_args['series'] if 'series' in config_args else False
+        self.series_prefetch = config_args['series_prefetch'] if 'series_prefetch' in config_args else 1
+        # skip empty space when rendering views, with an occupancy grid of the opacity volume ('volume') or of a
+        # density probe of the checkpoint ('probe')
+        self.empty_space_skipping = config_args['empty_space_skipping'] if 'empty_space_skipping' in config_args else 'None'
+        # stop the rays of rendered views once their transmittance is below this threshold, 0 to disable
+        self.early_termination = config_args['early_termination'] if 'early_termination' in config_args else 0.0
+        # precision the networks of rendered views run in: 'fp32' or 'bf16' (see nerf.inference_autocast)
+        self.precision = config_args['precision'] if 'precision' in config_args else 'fp32'
+        # render views with the networks exported as one graph with their encoding: 'trace' or 'compile' (see
+        # nerf.inference_graph)
+        self.inference_graph = config_args['inference_graph'] if 'inference_graph' in config_args else 'None'
+        # render the hovered views from the grid baked by volume_generator.bake_grid instead of showing the closest
+        # precomputed view, on a background worker, at this image size and number of samples per ray (about 0.1s at
+        # 128px and 64 samples for a sparse 128^3 grid on one CPU core; the cost grows with both)
+        self.baked_grid = config_args['baked_grid'] if 'baked_grid' in config_args else False
+        self.baked_image_size = config_args['baked_image_size'] if 'baked_image_size' in config_args else 128
+        self.baked_num_samples = config_args['baked_num_samples'] if 'baked_num_samples' in config_args else 64
+        # keep rendered views for poses within `render_cache_angle` degrees and `render_cache_distance` of each
+        # other (see helpers.render_cache): the last `render_cache_entries` in memory and up to
+        # `render_cache_disk_mb` on disk, 0 for memory only
+        self.render_cache = config_args['render_cache'] if 'render_cache' in config_args else True
+        self.render_cache_entries = config_args['render_cache_entries'] if 'render_cache_entries' in config_args else 32
+        self.render_cache_disk_mb = config_args['render_cache_disk_mb'] if 'render_cache_disk_mb' in config_args else 256
+        self.render_cache_angle = config_args['render_cache_angle'] if 'render_cache_angle' in config_args else 1.0
+        self.render_cache_distance = config_args['render_cache_distance'] if 'render_cache_distance' in config_args else 0.05
 
         self.data_path = f'datasets/{self.data_name}/{self.model_type}/{self.dataset_config}'
-        
-        self.load_volumes()
+
+        self.volume_listeners = []
+        self.streaming_thread = None
+        self.streamed_readers = None
+
+        startup_level = self.preview_level if not prepare_data and self.preview_level != 'None' else self.volume_level
+        if self.series:
+            # the time steps have no pyramid levels
+            self.load_series()
+            startup_level = self.volume_level = 'None'
+        self.load_volumes(startup_level)
+
+        if self.series:
+            self.prefetch_series_steps()
 
         if not prepare_data:
             self.load_uncertainty_stats()
@@ -31,23 +78,149 @@ class Data():
         if self.model_type == 'ensemble':
             self.prepare_2d_plot()
     
-    def load_volumes(self):
-        opacity_file_name = f'{self.data_path}/{self.data_name}_{self.dataset_config}_{self.iterations}_opacity.vtk'
-        self.opacity_volume, self.opacity_reader = read_volume_from_vtk_file(opacity_file_name)
+    def volume_names(self):
+        if self.model_type == 'nn':
+            return ['opacity', 'uncertainty']
+        return ['opacity', 'uncertainty_density', 'uncertainty_color']
+
+    def volume_file_name(self, level='None'):
+        # the .vti file with all volumes of a level as fields
+        suffix = '' if level == 'None' else f'_{level}'
+        return f'{self.data_path}/{self.data_name}_{self.dataset_config}_{self.iterations}{suffix}.vti'
+
+    def volume_field_file_name(self, name, level='None'):
+        # a file per volume, binary .vti or legacy .vtk
+        suffix = '' if level == 'None' else f'_{level}'
+        file_name = f'{self.data_path}/{self.data_name}_{self.dataset_config}_{self.iterations}_{name}{suffix}'
+        if os.path.exists(file_name + '.vti'):
+            return file_name + '.vti'
+        return file_name + '.vtk'
+
+    def baked_grid_file_name(self):
+        # written by volume_generator.bake_grid
+        return f'{self.data_path}/{self.data_name}_{self.dataset_config}_{self.iterations}_baked.npz'
+
+    def series_file_name(self):
+        return f'{self.data_path}/{self.data_name}_{self.dataset_config}_series.pvd'
+
+    def load_series(self):
+        steps = read_volume_series_file(self.series_file_name())
+        self.series_iterations = [int(iteration) for iteration, _ in steps]
+        self.series_files = [file_name for _, file_name in steps]
+        self.series_step = self.series_iterations.index(self.iterations) if self.iterations in self.series_iterations else len(steps) - 1
+        self.iterations = self.series_iterations[self.series_step]
+
+        # time step to the future of its readers, read by one background thread
+        self.series_reader = ThreadPoolExecutor(max_workers=1)
+        self.prefetched_steps = {}
+
+    def read_series_step(self, step):
+        fields = read_volume_fields(self.series_files[step])
+        return {name: fields[name] for name in self.volume_names()}
+
+    def read_series_step_readers(self, step):
+        return {name: reader for name, (_, reader) in self.read_series_step(step).items()}
+
+    def prefetch_series_steps(self):
+        # keep the neighbouring time steps read ahead and forget the ones that are further away
+        steps = range(max(0, self.series_step - self.series_prefetch), min(len(self.series_files), self.series_step + self.series_prefetch + 1))
+        for step in list(self.prefetched_steps):
+            if step not in steps:
+                self.prefetched_steps.pop(step).cancel()
+        for step in steps:
+            if step != self.series_step and step not in self.prefetched_steps:
+                self.prefetched_steps[step] = self.series_reader.submit(self.read_series_step_readers, step)
+
+    def show_series_step(self, step):
+        # swap in a time step of the series; it is read now unless it was prefetched
+        if step == self.series_step:
+            return
+        future = self.prefetched_steps.pop(step, None)
+        readers = future.result() if future is not None else self.read_series_step_readers(step)
+
+        self.series_step = step
+        self.iterations = self.series_iterations[step]
+        self.swap_volumes(readers)
+        self.prefetch_series_steps()
+
+    def read_volumes(self, level='None'):
+        # volume name to (volume, reader), from one multi-field file or a file per volume, whichever was written
+        # last (the same iteration can be regenerated in the other format)
+        if self.series:
+            return self.read_series_step(self.series_step)
+
+        file_name = self.volume_file_name(level)
+        field_file_names = {name: self.volume_field_file_name(name, level) for name in self.volume_names()}
+        fields_exist = all(os.path.exists(field_file_name) for field_file_name in field_file_names.values())
+        if os.path.exists(file_name) and (not fields_exist or os.path.getmtime(file_name) >= max(os.path.getmtime(field_file_name) for field_file_name in field_file_names.values())):
+            fields = read_volume_fields(file_name)
+            return {name: fields[name] for name in self.volume_names()}
+        return {name: read_volume(field_file_name) for name, field_file_name in field_file_names.items()}
+
+    def volume_readers(self):
+        readers = {'opacity': self.opacity_reader}
+        if self.model_type == 'nn':
+            readers['uncertainty'] = self.uncertainty_reader
+        elif self.model_type == 'ensemble':
+            readers['uncertainty_density'] = self.uncertainty_reader
+            readers['uncertainty_color'] = self.uncertainty_reader_color
+        return readers
+
+    def load_volumes(self, level='None'):
+        self.level = level
+        volumes = self.read_volumes(level)
+
+        self.opacity_volume, self.opacity_reader = volumes['opacity']
 
         if self.model_type == 'nn':
-            uncertainty_file_name = f'{self.data_path}/{self.data_name}_{self.dataset_config}_{self.iterations}_uncertainty.vtk'
-            self.uncertainty_volume, self.uncertainty_reader = read_volume_from_vtk_file(uncertainty_file_name)
+            self.uncertainty_volume, self.uncertainty_reader = volumes['uncertainty']
 
             self.filter_nn_uncertainty_volume()
         elif self.model_type == 'ensemble':
-            uncertainty_file_name = f'{self.data_path}/{self.data_name}_{self.dataset_config}_{self.iterations}_uncertainty_density.vtk'
-            self.uncertainty_volume, self.uncertainty_reader = read_volume_from_vtk_file(uncertainty_file_name)
+            self.uncertainty_volume, self.uncertainty_reader = volumes['uncertainty_density']
+            self.uncertainty_volume_color, self.uncertainty_reader_color = volumes['uncertainty_color']
+
+            self.filter_color_uncertainty_volume()
+
+    def stream_volumes(self, level='None'):
+        # read another pyramid level in a background thread; swap_streamed_volumes puts it in place
+        def read_level():
+            self.streamed_readers = {name: reader for name, (_, reader) in self.read_volumes(level).items()}
 
-            uncertainty_file_name = f'{self.data_path}/{self.data_name}_{self.dataset_config}_{self.iterations}_uncertainty_color.vtk'
-            self.uncertainty_volume_color, self.uncertainty_reader_color = read_volume_from_vtk_file(uncertainty_file_name)
+        self.streamed_level = level
+        self.streamed_readers = None
+        self.streaming_thread = threading.Thread(target=read_level, daemon=True)
+        self.streaming_thread.start()
 
+    def streamed_volumes_ready(self):
+        return self.streaming_thread is not None and not self.streaming_thread.is_alive() and self.streamed_readers is not None
+
+    def swap_streamed_volumes(self):
+        streamed_readers = self.streamed_readers
+        self.level = self.streamed_level
+        self.streaming_thread = None
+        self.streamed_readers = None
+
+        self.swap_volumes(streamed_readers)
+
+    def swap_volumes(self, readers):
+        # the volume objects stay the same, so mappers and filters connected to them pick up the new volumes
+        for name, reader in self.volume_readers().items():
+            reader.GetOutput().ShallowCopy(readers[name].GetOutput())
+            reader.Modified()
+
+        if self.model_type == 'nn':
+            self.filter_nn_uncertainty_volume()
+        elif self.model_type == 'ensemble':
             self.filter_color_uncertainty_volume()
+            self.prepare_2d_plot()
+
+        for listener in self.volume_listeners:
+            listener()
+
+    def add_volume_listener(self, listener):
+        # called after a streamed level or another time step has been swapped in
+        self.volume_listeners.append(listener)
     
     def filter_color_uncertainty_volume(self):
         # filter out the values lower than the threshold for the color uncertainty volume
@@ -64,7 +237,6 @@ class Data():
 
         uncertainty_color_scalars = numpy_support.numpy_to_vtk(uncertainty_color_scalars, deep=True)
         uncertainty_color_data.GetPointData().SetScalars(uncertainty_color_scalars)
-        self.uncertainty_reader_color.SetOutput(uncertainty_color_data)
 
     def filter_nn_uncertainty_volume(self):
         # filter out the values lower than the threshold for the nn uncertainty volume
@@ -80,7 +252,6 @@ class Data():
 
         uncertainty_scalars = numpy_support.numpy_to_vtk(uncertainty_scalars, deep=True)
         uncertainty_data.GetPointData().SetScalars(uncertainty_scalars)
-        self.uncertainty_reader.SetOutput(uncertainty_data)
 
     def load_uncertainty_stats(self):
         angles_file_name = f'{self.data_path}/heatmap_angles.csv'
@@ -161,16 +332,10 @@ class Data():
         reader_output = reader.GetOutput()
         dims = reader_output.GetDimensions()
 
-        array_values = []
-
-        # Print the values for all structured points
-        for z in range(dims[2]):
-            for y in range(dims[1]):
-                for x in range(dims[0]):
-                    idx = x + dims[0] * (y + dims[1] * z)
-                    value = reader_output.GetScalarComponentAsFloat(x, y, z, 0)
-                    array_values.append(value)
-        arr_value = np.array(array_values)
+        # point ids run x fastest, then y, then z; quantized volumes are converted back to their values
+        arr_value = volume_values(reader_output).astype(float)
+        if arr_value.ndim > 1:
+            arr_value = arr_value[:, 0]
 
         return arr_value, dims
     
@@ -204,8 +369,8 @@ class Data():
         return angles
 
     def prepare_2d_plot(self):
-        self.point_colors = numpy_support.vtk_to_numpy(self.uncertainty_volume_color.GetPointData().GetScalars())
-        self.point_densities = numpy_support.vtk_to_numpy(self.uncertainty_volume.GetPointData().GetScalars())
+        self.point_colors = volume_values(self.uncertainty_volume_color)
+        self.point_densities = volume_values(self.uncertainty_volume)
         self.point_indices = np.arange(self.point_colors.shape[0]).astype('int')
 
         filtered_color_ind = np.argwhere(self.point_colors > self.histogram_uncertainty_filter).flatten()
@@ -0,0 +1,271 @@
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+
+from nerf import helpers
+
+"""
+Geometry of the regular grids the volumes are sampled on.
+
+Point ids follow the vtkImageData / vtkStructuredPoints layout: x varies fastest, then y, then z.
+"""
+
+def grid_spacing(xyz_min, xyz_max, dims):
+    return tuple(abs(xyz_max[axis] - xyz_min[axis]) / (dims[axis] - 1) for axis in range(3))
+
+def grid_num_points(dims):
+    return int(dims[0]) * int(dims[1]) * int(dims[2])
+
+def fit_grid_bounds(probe_sigma, probe_dims, origin, spacing, threshold=0.01, margin=0.05):
+    r"""Tight axis-aligned box around the occupied points of a probe grid.
+
+    Args:
+        probe_sigma (np.ndarray): Density on the probe grid, flat in vtk point order.
+        probe_dims (tuple): Number of probe points along x, y and z.
+        origin (tuple): World position of probe point 0.
+        spacing (tuple): Distance between neighbouring probe points along x, y and z.
+        threshold (float): Opacity `1 - exp(-sigma)` above which a probe point counts as occupied.
+        margin (float): Distance the box is grown by, on top of one probe spacing for geometry between probe points.
+
+    Returns:
+    (tuple): Minimum and maximum corner of the box, clipped to the probe grid, or None if nothing is occupied.
+    """
+    occupied = (1.0 - np.exp(-probe_sigma)) > threshold
+    if not occupied.any():
+        return None
+
+    k, j, i = np.nonzero(occupied.reshape(probe_dims[2], probe_dims[1], probe_dims[0]))
+    lower = np.array([i.min(), j.min(), k.min()])
+    upper = np.array([i.max(), j.max(), k.max()])
+
+    origin, spacing = np.array(origin), np.array(spacing)
+    grid_max = origin + (np.array(probe_dims) - 1) * spacing
+    xyz_min = np.maximum(origin + (lower - 1) * spacing - margin, origin)
+    xyz_max = np.minimum(origin + (upper + 1) * spacing + margin, grid_max)
+    return tuple(float(x) for x in xyz_min), tuple(float(x) for x in xyz_max)
+
+def isotropic_grid(xyz_min, xyz_max, num_points):
+    r"""Grid with at most `num_points` points and the same spacing along every axis, centered on a box it covers.
+
+    Returns:
+    (tuple): Dims, origin and spacing of the grid.
+    """
+    extent = np.array(xyz_max) - np.array(xyz_min)
+    spacing = float(np.cbrt(np.prod(extent) / num_points))
+    dims = np.ceil(extent / spacing).astype(int) + 1
+    while np.prod(dims) > num_points:
+        spacing *= 1.001
+        dims = np.ceil(extent / spacing).astype(int) + 1
+
+    center = (np.array(xyz_min) + np.array(xyz_max)) / 2
+    origin = center - (dims - 1) * spacing / 2
+    return tuple(int(n) for n in dims), tuple(float(x) for x in origin), (spacing, spacing, spacing)
+
+def grid_points(indices, dims, origin, spacing):
+    r"""Coordinates of a batch of grid points, computed with array ops instead of vtkImageData.GetPoint.
+
+    Args:
+        indices (torch.Tensor): Flat point ids (int64).
+        dims (tuple): Number of points along x, y and z.
+        origin (tuple): World position of point 0.
+        spacing (tuple): Distance between neighbouring points along x, y and z.
+
+    Returns:
+    (torch.Tensor): Point coordinates of shape :math:`(len(indices), 3)`.
+    """
+    i = indices % dims[0]
+    j = (indices // dims[0]) % dims[1]
+    k = indices // (dims[0] * dims[1])
+    ijk = torch.stack((i, j, k), dim=-1).float()
+    origin = torch.tensor(origin, dtype=torch.float32)
+    spacing = torch.tensor(spacing, dtype=torch.float32)
+    return origin + ijk * spacing
+
+def encode_grid_points(xyz, cfg_model):
+    r"""Network input for grid points: encoded positions followed by zeroed view directions.
+    """
+    encode_pos = helpers.embedding_encoding(
+        xyz,
+        num_encoding_functions=cfg_model.num_encoding_fn_xyz,
+        include_input=cfg_model.include_input_xyz,
+        log_sampling=cfg_model.log_sampling_xyz,
+    )
+    if not cfg_model.use_viewdirs:
+        return encode_pos
+
+    include_input_dir = 3 if cfg_model.include_input_dir else 0
+    dim_dir = include_input_dir + 2 * 3 * cfg_model.num_encoding_fn_dir
+    encode_dir_zeros = torch.zeros(xyz.shape[0], dim_dir, dtype=encode_pos.dtype)
+    return torch.cat((encode_pos, encode_dir_zeros), dim=-1)
+
+# the last grid encoding kept in memory, so jobs on the same grid share it
+encoded_grids = {}
+
+class EncodedGrid():
+    r"""Network inputs (see `encode_grid_points`) of every point of a grid, encoded once and read back per batch.
+
+    The inputs only depend on the grid and the encoding settings of the model config, so every checkpoint and
+    ensemble member with the same settings can share them. They are kept in memory, or with `cache_dir` in a
+    memory-mapped .npy file there, which later runs and other processes open instead of encoding the grid again.
+    """
+    def __init__(self, dims, origin, spacing, cfg_model, cache_dir=None, batch_size=2048):
+        self.dims = tuple(int(n) for n in dims)
+        self.origin = tuple(float(x) for x in origin)
+        self.spacing = tuple(float(x) for x in spacing)
+        self.key = encoded_grid_key(self.dims, self.origin, self.spacing, cfg_model)
+
+        npoints = grid_num_points(self.dims)
+        num_inputs = encode_grid_points(torch.zeros(1, 3), cfg_model).shape[-1]
+
+        if cache_dir is None:
+            self.inputs = np.empty((npoints, num_inputs), dtype=np.float32)
+            self.encode(cfg_model, batch_size)
+            return
+
+        file_name = os.path.join(cache_dir, f'grid_encoding_{self.key}.npy')
+        if not os.path.exists(file_name):
+            # encode into a temporary file first, so an interrupted run never leaves a partial cache behind
+            os.makedirs(cache_dir, exist_ok=True)
+            self.inputs = np.lib.format.open_memmap(file_name + '.tmp', mode='w+', dtype=np.float32, shape=(npoints, num_inputs))
+            self.encode(cfg_model, batch_size)
+            self.inputs.flush()
+            del self.inputs
+            os.replace(file_name + '.tmp', file_name)
+        self.inputs = np.load(file_name, mmap_mode='r')
+
+    def encode(self, cfg_model, batch_size):
+        for indices in grid_batches(self.inputs.shape[0], batch_size):
+            xyz_tensor = grid_points(indices, self.dims, self.origin, self.spacing)
+            start = int(indices[0])
+            self.inputs[start : start + indices.shape[0]] = encode_grid_points(xyz_tensor, cfg_model).numpy()
+
+    def batch(self, indices):
+        # network inputs of a batch of point ids
+        return torch.from_numpy(self.inputs[indices.numpy()])
+
+def encoded_grid_key(dims, origin, spacing, cfg_model):
+    settings = {
+        'dims': list(dims),
+        'origin': list(origin),
+        'spacing': list(spacing),
+        'num_encoding_fn_xyz': cfg_model.num_encoding_fn_xyz,
+        'include_input_xyz': cfg_model.include_input_xyz,
+        'log_sampling_xyz': cfg_model.log_sampling_xyz,
+        'use_viewdirs': cfg_model.use_viewdirs,
+        'num_encoding_fn_dir': cfg_model.num_encoding_fn_dir,
+        'include_input_dir': cfg_model.include_input_dir,
+    }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+def encoded_grid(dims, origin, spacing, cfg_model, cache_dir=None, batch_size=2048):
+    # the EncodedGrid of a grid and encoding, reused if it is the one used last
+    key = (encoded_grid_key(dims, origin, spacing, cfg_model), cache_dir)
+    if key not in encoded_grids:
+        encoded_grids.clear()
+        encoded_grids[key] = EncodedGrid(dims, origin, spacing, cfg_model, cache_dir=cache_dir, batch_size=batch_size)
+    return encoded_grids[key]
+
+def grid_batches(npoints, batch_size, start=0):
+    # fixed-size batches of consecutive point ids in [start, npoints)
+    for batch_start in range(start, npoints, batch_size):
+        yield torch.arange(batch_start, min(batch_start + batch_size, npoints))
+
+def normalize_min_max(array, array_min=None, array_max=None):
+    # in-place min-max normalization to [0, 1]; pass the range of the whole volume to normalize a chunk of it
+    if array_min is None:
+        array_min = np.min(array)
+    if array_max is None:
+        array_max = np.max(array)
+    array -= array_min
+    if array_max > array_min:
+        array /= (array_max - array_min)
+    return array
+
+def quantize_unit_interval(array, dtype, chunk_size=1 << 22):
+    r"""Quantize values in [0, 1] to the full range of an unsigned integer type, chunk by chunk so only the
+    quantized array is allocated. Values above zero never round to zero, so empty space stays exactly the
+    points that are zero.
+
+    Returns:
+    (np.ndarray, float): Quantized values and the scale back to values, `value = quantized * scale`.
+    """
+    max_value = np.iinfo(dtype).max
+    quantized = np.empty(array.shape, dtype=dtype)
+    for start in range(0, array.shape[0], chunk_size):
+        chunk = np.clip(array[start : start + chunk_size], 0.0, 1.0) * max_value
+        quantized_chunk = np.rint(chunk)
+        quantized_chunk[(quantized_chunk == 0) & (chunk > 0)] = 1
+        quantized[start : start + chunk_size] = quantized_chunk
+    return quantized, 1.0 / max_value
+
+def occupied_blocks(probe_sigma, num_blocks, threshold=0.01, dilation=1):
+    r"""Mark the blocks of a grid that contain geometry.
+
+    Args:
+        probe_sigma (np.ndarray): Density at the block corners, flat in vtk point order for a probe grid
+            with `num_blocks + 1` points per axis.
+        num_blocks (tuple): Number of blocks along x, y and z.
+        threshold (float): Opacity `1 - exp(-sigma)` above which a corner counts as occupied.
+        dilation (int): Number of blocks the occupied region is grown by, to catch geometry between corners.
+
+    Returns:
+    (torch.Tensor): Boolean block mask of shape :math:`(z, y, x)`.
+    """
+    probe_dims = [n + 1 for n in num_blocks]
+    probe_alpha = 1.0 - np.exp(-probe_sigma)
+    occupied = torch.from_numpy(probe_alpha > threshold).float()
+    occupied = occupied.reshape(1, 1, probe_dims[2], probe_dims[1], probe_dims[0])
+
+    # a block is occupied if any of its 8 corners is
+    blocks = torch.nn.functional.max_pool3d(occupied, kernel_size=2, stride=1)
+    if dilation > 0:
+        blocks = torch.nn.functional.max_pool3d(blocks, kernel_size=2 * dilation + 1, stride=1, padding=dilation)
+    return blocks[0, 0] > 0
+
+def block_batches(block_mask, dims, block_size, batch_size, block_rows=None):
+    r"""Point ids inside the occupied blocks, in fixed-size batches, one z-slab of blocks at a time.
+
+    `block_rows` restricts the batches to some z-slabs of blocks (default: all of them).
+    """
+    nx, ny, nz = dims
+    if block_rows is None:
+        block_rows = range(block_mask.shape[0])
+    remainder = torch.zeros(0, dtype=torch.int64)
+    for kb in block_rows:
+        if not block_mask[kb].any():
+            continue
+        z_start, z_stop = kb * block_size, min((kb + 1) * block_size, nz)
+
+        slab_mask = block_mask[kb].repeat_interleave(block_size, dim=0).repeat_interleave(block_size, dim=1)
+        slab_mask = slab_mask[:ny, :nx].expand(z_stop - z_start, ny, nx)
+        k, j, i = torch.nonzero(slab_mask, as_tuple=True)
+        slab_indices = torch.cat((remainder, (k + z_start) * (nx * ny) + j * nx + i))
+
+        num_full = slab_indices.shape[0] - slab_indices.shape[0] % batch_size
+        for start in range(0, num_full, batch_size):
+            yield slab_indices[start : start + batch_size]
+        remainder = slab_indices[num_full:]
+    if remainder.shape[0] > 0:
+        yield remainder
+
+def downsample_grid(dims, origin, spacing):
+    # grid of the next coarser pyramid level: every point is the center of a 2x2x2 cell of the finer grid
+    coarse_dims = tuple(n // 2 for n in dims)
+    coarse_origin = tuple(o + 0.5 * d for o, d in zip(origin, spacing))
+    coarse_spacing = tuple(2 * d for d in spacing)
+    return coarse_dims, coarse_origin, coarse_spacing
+
+def downsample_volume(array, dims, reduction='max'):
+    r"""Halve the resolution of a flat volume (vtk point order) by reducing every 2x2x2 cell with `reduction`
+    ('max' or 'mean').
+    """
+    volume = torch.from_numpy(array).reshape(1, 1, dims[2], dims[1], dims[0])
+    if reduction == 'max':
+        volume = torch.nn.functional.max_pool3d(volume, kernel_size=2, stride=2)
+    elif reduction == 'mean':
+        volume = torch.nn.functional.avg_pool3d(volume, kernel_size=2, stride=2)
+    else:
+        raise ValueError(f'Unknown reduction {reduction}; valid reductions: max, mean')
+    return volume.reshape(-1).numpy()
@@ -6,7 +6,7 @@ import vtk.util.numpy_support as numpy_support
 
 import torch
 
-from helpers.vtk import range_lower_than_90
+from helpers.vtk import range_lower_than_90, stored_value, stored_value_transfer_function, volume_values
 from nerf import (
     get_ray_bundle,
 )
@@ -14,7 +14,7 @@ from nerf import (
 def setup_isosurface(data):
     contour = vtk.vtkContourFilter()
     contour.SetInputData(data.opacity_volume)
-    contour.SetValue(0, data.isosurface_filter_value)
+    contour.SetValue(0, stored_value(data.isosurface_filter_value, data.opacity_volume))
 
     mapper = vtk.vtkPolyDataMapper()
     mapper.SetInputConnection(contour.GetOutputPort())
@@ -32,8 +32,8 @@ def setup_uncertainty_volume(data_reader):
     opacity_tf, color_tf = setup_density_tfs()
 
     volume_property = vtk.vtkVolumeProperty()
-    volume_property.SetColor(color_tf)
-    volume_property.SetScalarOpacity(opacity_tf)
+    volume_property.SetColor(stored_value_transfer_function(color_tf, data_reader.GetOutput()))
+    volume_property.SetScalarOpacity(stored_value_transfer_function(opacity_tf, data_reader.GetOutput()))
     volume_property.ShadeOn()
     volume_property.SetInterpolationTypeToLinear()
 
@@ -164,15 +164,16 @@ def convert_angle_to_range(angle):
         angle = -(360 - angle)
     return angle
 
-def compute_custom_maximums(camera, data, num_x, num_y, type='color', original_distance=3.0, step_size=0.01, dimension=128):
+def compute_custom_maximums(camera, data, num_x, num_y, type='color', original_distance=3.0, step_size=0.01):
     if type == 'color':
-        volume_array = data.uncertainty_volume_color.GetPointData().GetScalars()
+        volume_array = volume_values(data.uncertainty_volume_color)
     else:
-        volume_array = data.uncertainty_volume.GetPointData().GetScalars()
-    volume_array = numpy_support.vtk_to_numpy(volume_array).reshape((dimension, dimension, dimension))
+        volume_array = volume_values(data.uncertainty_volume)
+    # the grid need not be cubic; point ids run x fastest, so the arrays are indexed [z, y, x]
+    nx, ny, nz = data.opacity_volume.GetDimensions()
+    volume_array = volume_array.reshape((nz, ny, nx))
 
-    density_array = data.opacity_volume.GetPointData().GetScalars()
-    density_array = numpy_support.vtk_to_numpy(density_array).reshape((dimension, dimension, dimension))
+    density_array = volume_values(data.opacity_volume).reshape((nz, ny, nx))
 
     mvt_matrix = camera.GetModelViewTransformMatrix()
 
@@ -0,0 +1,116 @@
+import os
+import json
+import glob
+import hashlib
+import threading
+import collections
+import numpy as np
+
+"""
+Rendered views kept for camera poses that are asked for again, e.g. when the same heatmap sectors are visited or
+"Render image" is clicked again from about the same orientation.
+"""
+
+def quantize(values, step):
+    # nearest multiples of `step`, as plain ints for the cache key
+    return [int(value) for value in np.round(np.asarray(values, dtype=np.float64).flatten() / step)]
+
+def render_cache_key(pose, focal_length, settings, angle_step=1.0, distance_step=0.05):
+    r"""Cache key of a view: its camera-to-world `pose` (4, 4) and `focal_length` quantized, and the `settings`
+    the image depends on (a dict of json values, e.g. the checkpoint, the image size and the samples per ray).
+
+    The rotation entries are rounded to `angle_step` degrees (the entries of a rotation matrix change by at most
+    the angle of a rotation, in radians), the position to `distance_step` and the focal length to a pixel, so
+    poses closer than that share their views.
+    """
+    pose = np.asarray(pose, dtype=np.float64)
+    key = {
+        'rotation': quantize(pose[:3, :3], np.radians(angle_step)),
+        'position': quantize(pose[:3, 3], distance_step),
+        'focal_length': quantize(focal_length, 1.0),
+        'settings': settings,
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+class RenderCache():
+    r"""Least recently used views, by `render_cache_key`: the last `max_entries` in memory, and with `cache_dir`
+    up to `max_disk_bytes` of .npz files there, which later sessions find again. A view is a dict of arrays, e.g.
+    the image and its depth.
+
+    The file times of the disk tier are its use order: a hit touches its file, and the files used longest ago
+    are removed once the files are larger than `max_disk_bytes`. Views found on disk move back into memory.
+    """
+    def __init__(self, max_entries=32, cache_dir=None, max_disk_bytes=256 * 2 ** 20):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self.entries = collections.OrderedDict()
+        # the render worker reads and writes while the main thread may clear
+        self.lock = threading.Lock()
+
+    def file_name(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def get(self, key):
+        # the view of `key`, None if it is not cached
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        if self.cache_dir is None or not os.path.exists(self.file_name(key)):
+            return None
+        try:
+            with np.load(self.file_name(key)) as cached:
+                view = {name: cached[name] for name in cached.files}
+            os.utime(self.file_name(key))
+        except (OSError, ValueError):
+            # removed by another session meanwhile, or unreadable
+            return None
+        self.put_memory(key, view)
+        return view
+
+    def put(self, key, view):
+        self.put_memory(key, view)
+        if self.cache_dir is None or self.max_disk_bytes <= 0:
+            return
+
+        # written to a temporary file first, so a reader never opens a partial view
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_file_name = self.file_name(key) + '.tmp'
+        with open(temp_file_name, 'wb') as f:
+            np.savez(f, **view)
+        os.replace(temp_file_name, self.file_name(key))
+        self.evict_disk()
+
+    def put_memory(self, key, view):
+        with self.lock:
+            self.entries[key] = view
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def evict_disk(self):
+        files = []
+        for file_name in glob.glob(os.path.join(self.cache_dir, '*.npz')):
+            try:
+                stat = os.stat(file_name)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, file_name))
+
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, file_name in sorted(files):
+            if total_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        # only the memory tier; the files stay for later sessions
+        with self.lock:
+            self.entries.clear()
@@ -1,5 +1,14 @@
 import vtk
+import vtk.util.numpy_support as numpy_support
 import numpy as np
+import os
+import xml.etree.ElementTree as ElementTree
+
+VOLUME_COMPRESSORS = {
+    'zlib': vtk.vtkZLibDataCompressor,
+    'lz4': vtk.vtkLZ4DataCompressor,
+    'lzma': vtk.vtkLZMADataCompressor,
+}
 
 def read_volume_from_vtk_file(file_name):
     reader = vtk.vtkStructuredPointsReader()
@@ -8,6 +17,221 @@ def read_volume_from_vtk_file(file_name):
     volume = reader.GetOutput()
     return volume, reader
 
+def volume_from_numpy(scalars, dims, origin, spacing):
+    # wraps the numpy array without copying it; vtk keeps a reference to the array
+    volume = vtk.vtkStructuredPoints()
+    volume.SetDimensions(dims)
+    volume.SetOrigin(origin)
+    volume.SetSpacing(spacing)
+    volume.GetPointData().SetScalars(numpy_support.numpy_to_vtk(num_array=scalars, deep=False))
+    return volume
+
+def volume_from_fields(fields, dims, origin, spacing):
+    # one grid with a named point data array per field, wrapped without copying like volume_from_numpy
+    volume = vtk.vtkImageData()
+    volume.SetDimensions(dims)
+    volume.SetOrigin(origin)
+    volume.SetSpacing(spacing)
+    for name, scalars in fields.items():
+        array = numpy_support.numpy_to_vtk(num_array=scalars, deep=False)
+        array.SetName(name)
+        volume.GetPointData().AddArray(array)
+    return volume
+
+def write_volume_to_vtk_file(volume, file_name):
+    writer = vtk.vtkStructuredPointsWriter()
+    writer.WriteExtentOn()
+    writer.SetFileName(file_name)
+    writer.SetInputData(volume)
+    writer.Write()
+
+def read_volume_from_vti_file(file_name):
+    # binary VTK XML image data, the scalars are read straight into memory
+    reader = vtk.vtkXMLImageDataReader()
+    reader.SetFileName(file_name)
+    reader.Update()
+    volume = reader.GetOutput()
+    return volume, reader
+
+def write_volume_to_vti_file(volume, file_name, compression='zlib', metadata=None):
+    r"""Write a volume as binary VTK XML image data (.vti).
+
+    Args:
+        volume (vtkImageData): Volume to write.
+        file_name (str): Path of the .vti file.
+        compression (str): 'zlib', 'lz4', 'lzma' or None for uncompressed data.
+        metadata (dict): Numbers stored with the volume, e.g. the range used to normalize it; read them back
+            with `volume_metadata`.
+    """
+    if metadata:
+        # the metadata goes into the field data of a shallow copy, the volume that was passed in is left alone
+        volume_copy = volume.NewInstance()
+        volume_copy.ShallowCopy(volume)
+        field_data = vtk.vtkFieldData()
+        field_data.ShallowCopy(volume.GetFieldData())
+        for key, value in metadata.items():
+            array = numpy_support.numpy_to_vtk(np.atleast_1d(np.asarray(value, dtype=np.float64)), deep=True)
+            array.SetName(key)
+            field_data.AddArray(array)
+        volume_copy.SetFieldData(field_data)
+        volume = volume_copy
+
+    writer = vtk.vtkXMLImageDataWriter()
+    writer.SetFileName(file_name)
+    writer.SetInputData(volume)
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    if compression is None:
+        writer.SetCompressorTypeToNone()
+    elif compression in VOLUME_COMPRESSORS:
+        writer.SetCompressor(VOLUME_COMPRESSORS[compression]())
+    else:
+        raise ValueError(f'Unknown compression {compression}; valid compressions: {", ".join(VOLUME_COMPRESSORS)}, None')
+    writer.Write()
+
+class VolumeSource(vtk.vtkTrivialProducer):
+    r"""Pipeline source for a volume in memory, with the `GetOutput` of a reader.
+
+    Unlike a file reader it never executes again, so changes to its output (filtered scalars, another volume
+    shallow copied into it followed by `Modified`) are what the pipeline sees.
+    """
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+def read_volume(file_name):
+    # .vti files with the XML reader, anything else as legacy .vtk; the volume is handed out by a VolumeSource
+    if file_name.endswith('.vti'):
+        volume, _ = read_volume_from_vti_file(file_name)
+    else:
+        volume, _ = read_volume_from_vtk_file(file_name)
+    source = VolumeSource()
+    source.SetOutput(volume)
+    return volume, source
+
+def read_volume_fields(file_name):
+    r"""Read a multi-field .vti file (see `volume_from_fields`) once and split it into a volume per field.
+
+    The volumes share the grid, and each has its field as scalars without copying it. Metadata of the file named
+    `{field}:{key}` becomes metadata `key` of that field's volume; metadata without a field goes to every volume.
+
+    Returns:
+    (dict): Field name to `(volume, source)`, as returned by `read_volume`.
+    """
+    volume, _ = read_volume_from_vti_file(file_name)
+    point_data = volume.GetPointData()
+    file_field_data = volume.GetFieldData()
+    fields = {}
+    for i in range(point_data.GetNumberOfArrays()):
+        name = point_data.GetArrayName(i)
+        field_data = vtk.vtkFieldData()
+        for j in range(file_field_data.GetNumberOfArrays()):
+            field, _, key = file_field_data.GetArrayName(j).rpartition(':')
+            if field in (name, ''):
+                array = file_field_data.GetArray(j).NewInstance()
+                array.DeepCopy(file_field_data.GetArray(j))
+                array.SetName(key)
+                field_data.AddArray(array)
+
+        field_volume = vtk.vtkImageData()
+        field_volume.CopyStructure(volume)
+        field_volume.SetFieldData(field_data)
+        field_volume.GetPointData().SetScalars(point_data.GetArray(i))
+        source = VolumeSource()
+        source.SetOutput(field_volume)
+        fields[name] = (field_volume, source)
+    return fields
+
+def write_volume_series_file(file_name, steps):
+    r"""Write the index of a time series of volumes as a ParaView collection (.pvd).
+
+    Args:
+        file_name (str): Path of the .pvd file.
+        steps (list): `(time, file_name)` per time step, e.g. the training iteration and its .vti file; the file
+            names are stored relative to the .pvd file.
+    """
+    root = ElementTree.Element('VTKFile', type='Collection', version='0.1')
+    collection = ElementTree.SubElement(root, 'Collection')
+    for time, step_file_name in steps:
+        relative_file_name = os.path.relpath(step_file_name, os.path.dirname(file_name) or '.')
+        ElementTree.SubElement(collection, 'DataSet', timestep=str(time), part='0', file=relative_file_name.replace(os.sep, '/'))
+
+    tmp_file_name = file_name + '.tmp'
+    ElementTree.ElementTree(root).write(tmp_file_name, xml_declaration=True)
+    os.replace(tmp_file_name, file_name)
+
+def read_volume_series_file(file_name):
+    # (time, file_name) per time step of a .pvd index, in time order and with paths relative to the working dir
+    collection = ElementTree.parse(file_name).getroot().find('Collection')
+    steps = [(float(dataset.get('timestep')), os.path.join(os.path.dirname(file_name), dataset.get('file'))) for dataset in collection.iter('DataSet')]
+    return sorted(steps)
+
+def volume_to_numpy(volume):
+    # the scalars as a flat numpy array in vtk point order, without copying them
+    return numpy_support.vtk_to_numpy(volume.GetPointData().GetScalars())
+
+def snapshot_volume(volume):
+    # a new volume sharing the arrays of `volume`, so it keeps them when other volumes are swapped into `volume`
+    # (see Data.swap_volumes), e.g. to read it on another thread
+    snapshot = vtk.vtkImageData()
+    snapshot.ShallowCopy(volume)
+    return snapshot
+
+def volume_metadata(volume):
+    # numbers written with write_volume_to_vti_file(metadata=...), single values as floats
+    metadata = {}
+    field_data = volume.GetFieldData()
+    for i in range(field_data.GetNumberOfArrays()):
+        values = numpy_support.vtk_to_numpy(field_data.GetArray(i))
+        metadata[field_data.GetArrayName(i)] = float(values[0]) if values.size == 1 else values.copy()
+    return metadata
+
+def volume_quantization(volume):
+    # scale and offset from the stored scalars of a quantized volume to its values: value = stored * scale + offset
+    metadata = volume_metadata(volume)
+    return metadata.get('quantization_scale', 1.0), metadata.get('quantization_offset', 0.0)
+
+def volume_values(volume):
+    # the values of a volume as numpy array, dequantized if it is stored quantized (without copying otherwise)
+    scalars = volume_to_numpy(volume)
+    scale, offset = volume_quantization(volume)
+    if scale == 1.0 and offset == 0.0:
+        return scalars
+    return scalars.astype(np.float32) * np.float32(scale) + np.float32(offset)
+
+def stored_value(value, volume):
+    # the stored scalar of a value, e.g. for contour values on a quantized volume
+    scale, offset = volume_quantization(volume)
+    return (value - offset) / scale
+
+def stored_value_transfer_function(transfer_function, volume):
+    r"""Transfer function over the stored scalars of `volume`, for a `transfer_function` over its values.
+
+    For a quantized volume this is a copy with the points moved to the stored scalars, which follows later
+    changes to `transfer_function`; for any other volume it is `transfer_function` itself.
+    """
+    scale, offset = volume_quantization(volume)
+    if scale == 1.0 and offset == 0.0:
+        return transfer_function
+
+    stored_transfer_function = transfer_function.NewInstance()
+    node_size = 6 if isinstance(transfer_function, vtk.vtkColorTransferFunction) else 4
+
+    def update(obj=None, event=None):
+        stored_transfer_function.RemoveAllPoints()
+        stored_transfer_function.SetClamping(transfer_function.GetClamping())
+        for i in range(transfer_function.GetSize()):
+            node = [0.0] * node_size
+            transfer_function.GetNodeValue(i, node)
+            node[0] = (node[0] - offset) / scale
+            if node_size == 6:
+                stored_transfer_function.AddRGBPoint(*node)
+            else:
+                stored_transfer_function.AddPoint(*node)
+
+    update()
+    transfer_function.AddObserver('ModifiedEvent', update)
+    return stored_transfer_function
+
 def resize_vtk_render_window(frame, interactor):
     size = frame.size()
     interactor.resize(size.width(), size.height())
@@ -3,6 +3,7 @@ from components.main_layout import MainLayout
 from components.renderers.plane_widget import CustomPlaneWidget
 from components.renderers.synthesis_view import SynthesisView
 from components.renderers.synthesis_button import SynthesisButton
+from components.renderers.series_slider import SeriesSlider
 from components.transfervis.transfer_function import TransferFunction
 from components.transfervis.surface_histogram import SurfaceHistogram
 from components.transfervis.surface_radio_button import SurfaceRadioButton
@@ -22,6 +23,7 @@ import yaml
 import sys
 import numpy as np
 
+from PyQt6.QtCore import QTimer
 from PyQt6.QtWidgets import (
     QApplication,
     QWidget,
@@ -40,7 +42,7 @@ def main(config_args):
     camera = CustomCamera()
     z_buffer = ZBuffer()
 
-    synthesis_view = SynthesisView(main_layout.synthesis_image_frame, data=data)
+    synthesis_view = SynthesisView(main_layout.synthesis_image_frame, data=data, camera=camera)
     synthesis_button = SynthesisButton('Render image', main_layout.synthesis_layout, camera, synthesis_view, data)
 
     # renderers
@@ -153,6 +155,30 @@ def main(config_args):
     # initial render
     z_buffer.update_buffer()
 
+    # the renderers follow when other volumes are swapped in
+    data.add_volume_listener(uncertainty_window.refresh_scalars)
+    if data.model_type == 'ensemble':
+        data.add_volume_listener(color_uncertainty_window.refresh_scalars)
+        data.add_volume_listener(lambda: density_scatter_plot.update_data(data.scatter_plot_data))
+    data.add_volume_listener(z_buffer.update_buffer)
+
+    # step through the training iterations of a series
+    if data.series:
+        series_slider = SeriesSlider(main_layout.synthesis_layout, data)
+
+    # a coarse preview level was loaded for a fast startup; stream in the full volume level
+    if data.level != data.volume_level:
+        data.stream_volumes(data.volume_level)
+        stream_timer = QTimer()
+
+        def swap_streamed_volumes():
+            if data.streamed_volumes_ready():
+                stream_timer.stop()
+                data.swap_streamed_volumes()
+
+        stream_timer.timeout.connect(swap_streamed_volumes)
+        stream_timer.start(200)
+
     # render initial image
     # synthesis_button.update_view_synthesis_view()
 
@@ -1,7 +1,10 @@
+from .baked_grid import *
 from .cfgnode import CfgNode
+from .inference_graph import *
 from .load_blender import load_blender_data
 from .load_llff import load_llff_data
 from .models import *
 from .nerf_helpers import *
+from .occupancy_grid import *
 from .train_utils import *
 from .volume_rendering_utils import *
@@ -0,0 +1,198 @@
+import numpy as np
+import torch
+
+from .nerf_helpers import cumprod_exclusive, get_ray_bundle
+
+
+class BakedGrid(object):
+    r"""The outputs of a trained NeRF baked into a sparse voxel grid, to render views without the networks.
+
+    Only the occupied points of the grid are stored. `radiance` holds the raw outputs of the main model (rgb
+    logits and density, as the radiance field of `volume_render_radiance_field`); `mean` and `variance` hold the
+    mean and variance over the ensemble members of their colors (after the sigmoid) and densities (after the
+    relu). Like the volumes, the outputs are those of zeroed view directions, so the colors do not depend on the
+    view.
+
+    Args:
+        dims (tuple): Number of points along x, y and z.
+        origin (tuple): Position of point 0.
+        spacing (tuple): Distance between neighbouring points along x, y and z.
+        point_ids (np.ndarray): Flat ids of the stored points :math:`(K,)`, in vtk point order (x fastest).
+        radiance (np.ndarray): Radiance field of the stored points :math:`(K, 4)`.
+        mean (np.ndarray): Optional member mean of the stored points :math:`(K, 4)`.
+        variance (np.ndarray): Optional member variance of the stored points :math:`(K, 4)`.
+        white_background (bool): Whether the views are composited onto white, as the NeRF was trained.
+    """
+
+    def __init__(self, dims, origin, spacing, point_ids, radiance, mean=None, variance=None, white_background=False):
+        self.dims = tuple(int(n) for n in dims)
+        self.origin = tuple(float(x) for x in origin)
+        self.spacing = tuple(float(x) for x in spacing)
+        self.point_ids = np.asarray(point_ids, dtype=np.int64)
+        self.fields = {'radiance': radiance}
+        if mean is not None:
+            self.fields.update(mean=mean, variance=variance)
+        self.white_background = bool(white_background)
+
+        # dense copies of the fields to sample, made on first use (see sample)
+        self.dense_fields = {}
+
+        # the rays are clipped to the box around the stored points
+        nx, ny = self.dims[0], self.dims[1]
+        index = np.stack((self.point_ids % nx, (self.point_ids // nx) % ny, self.point_ids // (nx * ny)), axis=-1)
+        if len(index) == 0:
+            index = np.zeros((1, 3), dtype=np.int64)
+        self.bounds_min = torch.tensor(self.origin) + torch.tensor(self.spacing) * torch.from_numpy(index.min(axis=0)).float()
+        self.bounds_max = torch.tensor(self.origin) + torch.tensor(self.spacing) * torch.from_numpy(index.max(axis=0)).float()
+
+    def has_members(self):
+        return 'mean' in self.fields
+
+    def fraction_stored(self):
+        return len(self.point_ids) / float(np.prod(self.dims))
+
+    def save(self, file_name):
+        # compressed .npz, the fields in half precision
+        fields = {name: np.asarray(values, dtype=np.float16) for name, values in self.fields.items()}
+        np.savez_compressed(
+            file_name,
+            dims=np.array(self.dims),
+            origin=np.array(self.origin),
+            spacing=np.array(self.spacing),
+            point_ids=self.point_ids.astype(np.int32 if np.prod(self.dims) < 2 ** 31 else np.int64),
+            white_background=np.array(self.white_background),
+            **fields,
+        )
+
+    @classmethod
+    def load(cls, file_name):
+        with np.load(file_name) as baked:
+            fields = {name: baked[name].astype(np.float32) for name in ['radiance', 'mean', 'variance'] if name in baked}
+            return cls(
+                baked['dims'], baked['origin'], baked['spacing'], baked['point_ids'],
+                white_background=bool(baked['white_background']),
+                **fields,
+            )
+
+    def dense_field(self, name):
+        if name not in self.dense_fields:
+            values = torch.from_numpy(np.asarray(self.fields[name], dtype=np.float32))
+            nx, ny, nz = self.dims
+            # (1, C, nz, ny, nx) for grid_sample; the points that are not stored are empty
+            dense = torch.zeros((values.shape[1], nx * ny * nz))
+            dense[:, torch.from_numpy(self.point_ids)] = values.T
+            self.dense_fields[name] = dense.reshape(1, values.shape[1], nz, ny, nx)
+        return self.dense_fields[name]
+
+    def occupied_cells(self):
+        r"""Whether each cell of the grid :math:`(nz - 1, ny - 1, nx - 1)` has a stored corner point; the
+        samples in the other cells interpolate to zero and are skipped.
+        """
+        if 'cells' not in self.dense_fields:
+            nx, ny, nz = self.dims
+            stored = torch.zeros(nx * ny * nz)
+            stored[torch.from_numpy(self.point_ids)] = 1.0
+            cells = torch.nn.functional.max_pool3d(stored.reshape(1, 1, nz, ny, nx), kernel_size=2, stride=1)
+            self.dense_fields['cells'] = cells.reshape(cells.shape[2:]) > 0
+        return self.dense_fields['cells']
+
+    def cell_ids(self, pts):
+        # flat id of the cell of each point (..., 3) in occupied_cells, -1 outside the grid
+        cells = self.occupied_cells()
+        index = torch.floor((pts - torch.tensor(self.origin)) / torch.tensor(self.spacing)).long()
+        size = torch.tensor([cells.shape[2], cells.shape[1], cells.shape[0]])
+        inside = ((index >= 0) & (index < size)).all(dim=-1)
+        ids = index[..., 0] + size[0] * (index[..., 1] + size[1] * index[..., 2])
+        return torch.where(inside, ids, -1)
+
+    def sample(self, name, pts):
+        r"""Trilinear interpolation of a field at points :math:`(..., 3)`; zero outside the grid."""
+        scale = torch.tensor([(n - 1) * d for n, d in zip(self.dims, self.spacing)])
+        grid = 2.0 * (pts - torch.tensor(self.origin)) / scale - 1.0
+        values = torch.nn.functional.grid_sample(
+            self.dense_field(name), grid.reshape(1, 1, 1, -1, 3), mode='bilinear', padding_mode='zeros', align_corners=True
+        )
+        return values.reshape(values.shape[1], -1).T.reshape(pts.shape[:-1] + (values.shape[1],))
+
+    def render(self, pose, height, width, focal_length, num_samples=128, members=False, chunksize=16384,
+               early_termination=1e-3, segment_size=16):
+        r"""Render a camera-to-world `pose` by marching the grid with `num_samples` samples per ray, spread
+        over the part of the ray inside the stored points, and compositing them like
+        `volume_render_radiance_field`.
+
+        Like `run_network_terminated`, the rays are marched front to back in segments of `segment_size` samples
+        and stop once their transmittance drops below `early_termination` (0 marches every sample). Every
+        segment only looks at the rays that are still active, and only interpolates their samples in occupied
+        cells, so the cost follows the visible surfaces rather than the image size times `num_samples`.
+
+        Returns the rgb image :math:`(height, width, 3)`. With `members` (and member fields) also returns the
+        members' mean color composited with the same weights, and the per-pixel uncertainty: the member variance
+        of the colors, averaged over the channels and composited with the same weights :math:`(height, width)`.
+        """
+        with torch.no_grad():
+            ray_origins, ray_directions = get_ray_bundle(height, width, focal_length, pose[:3, :4].float().cpu())
+            ro, rd = ray_origins.reshape(-1, 3), ray_directions.reshape(-1, 3)
+
+            # entry and exit distance of the box around the stored points
+            safe_rd = torch.where(rd.abs() < 1e-10, torch.full_like(rd, 1e-10), rd)
+            t_min, t_max = (self.bounds_min - ro) / safe_rd, (self.bounds_max - ro) / safe_rd
+            near = torch.minimum(t_min, t_max).amax(dim=-1).clamp(min=0.0)
+            far = torch.maximum(t_min, t_max).amin(dim=-1)
+            hit = torch.nonzero(far > near).squeeze(-1)
+
+            rgb = torch.zeros((ro.shape[0], 3))
+            acc = torch.zeros(ro.shape[0])
+            mean = torch.zeros((ro.shape[0], 3)) if members else None
+            uncertainty = torch.zeros(ro.shape[0]) if members else None
+
+            cells = self.occupied_cells().flatten()
+            t_vals = torch.linspace(0.0, 1.0, num_samples)
+            for rays in torch.split(hit, chunksize):
+                # transmittance in front of the current segment
+                transmittance = torch.ones(len(rays))
+                active = torch.arange(len(rays))
+                for start in range(0, num_samples, segment_size):
+                    end = min(start + segment_size, num_samples)
+                    ray_ids = rays[active]
+                    z_vals = near[ray_ids, None] * (1.0 - t_vals[start:end]) + far[ray_ids, None] * t_vals[start:end]
+                    pts = ro[ray_ids, None, :] + rd[ray_ids, None, :] * z_vals[..., None]
+                    # the last sample stands for the empty space behind the grid (its distance is infinite)
+                    dists = (far[ray_ids] - near[ray_ids]) / (num_samples - 1) * rd[ray_ids].norm(p=2, dim=-1)
+
+                    cell_ids = self.cell_ids(pts)
+                    occupied = (cell_ids >= 0) & cells[cell_ids.clamp(min=0)]
+                    if end == num_samples:
+                        occupied[:, -1] = False
+                    # the empty samples have no weight, so only the occupied ones get a color
+                    radiance = self.sample('radiance', pts[occupied])
+                    sigma = torch.zeros(pts.shape[:2])
+                    sigma[occupied] = torch.nn.functional.relu(radiance[:, 3])
+                    colors = torch.zeros(pts.shape[:2] + (3,))
+                    colors[occupied] = torch.sigmoid(radiance[:, :3])
+
+                    alpha = 1.0 - torch.exp(-sigma * dists[:, None])
+                    weights = alpha * cumprod_exclusive(1.0 - alpha + 1e-10) * transmittance[active, None]
+                    rgb[ray_ids] += (weights[..., None] * colors).sum(dim=-2)
+                    acc[ray_ids] += weights.sum(dim=-1)
+                    if members:
+                        member_mean = torch.zeros(pts.shape[:2] + (4,))
+                        member_variance = torch.zeros(pts.shape[:2] + (4,))
+                        member_mean[occupied] = self.sample('mean', pts[occupied])
+                        member_variance[occupied] = self.sample('variance', pts[occupied])
+                        mean[ray_ids] += (weights[..., None] * member_mean[..., :3]).sum(dim=-2)
+                        uncertainty[ray_ids] += (weights * member_variance[..., :3].mean(dim=-1)).sum(dim=-1)
+
+                    transmittance[active] *= torch.prod(1.0 - alpha + 1e-10, dim=-1)
+                    active = active[transmittance[active] > early_termination]
+                    if len(active) == 0:
+                        break
+
+            if self.white_background:
+                rgb += 1.0 - acc[..., None]
+                if members:
+                    mean += 1.0 - acc[..., None]
+
+        rgb = rgb.reshape(height, width, 3)
+        if not members:
+            return rgb
+        return rgb, mean.reshape(height, width, 3), uncertainty.reshape(height, width)
@@ -0,0 +1,98 @@
+import torch
+
+from .models import EnsembleFlexibleNeRFModel
+
+INFERENCE_GRAPHS = ['None', 'trace', 'compile']
+
+
+def encoding_frequency_bands(num_encoding_functions, log_sampling=True):
+    # the frequency bands of positional_encoding
+    if log_sampling:
+        return 2.0 ** torch.linspace(0.0, num_encoding_functions - 1, num_encoding_functions)
+    return torch.linspace(2.0 ** 0.0, 2.0 ** (num_encoding_functions - 1), num_encoding_functions)
+
+
+def fused_positional_encoding(tensor, frequency_bands, include_input=True):
+    r"""`positional_encoding` with all frequency bands at once instead of a loop over them: the same values, in
+    the same order (sin and cos of the first band, then of the second, ...).
+    """
+    scaled = tensor[..., None, :] * frequency_bands[:, None]
+    encoding = torch.stack((torch.sin(scaled), torch.cos(scaled)), dim=-2).flatten(-3)
+    if include_input:
+        return torch.cat((tensor, encoding), dim=-1)
+    return encoding
+
+
+class EncodedNeRFModel(torch.nn.Module):
+    r"""A FlexibleNeRFModel or EnsembleFlexibleNeRFModel together with its positional encoding, for inference.
+
+    Takes the raw inputs instead of the encoded ones: positions and view directions :math:`(N, 6)` for
+    `inputs` 'rays' (as `embed_points` passes them with identity encodings), or positions :math:`(N, 3)` for
+    'points', with the zeroed direction encoding of `helpers.grid.encode_grid_points`.
+    """
+
+    def __init__(self, model, cfg_model, inputs='rays'):
+        super(EncodedNeRFModel, self).__init__()
+        if inputs not in ['rays', 'points']:
+            raise ValueError(f'Unknown inputs {inputs}; valid inputs: rays, points')
+
+        self.model = model
+        self.inputs = inputs
+        self.use_viewdirs = cfg_model.use_viewdirs
+        self.include_input_xyz = cfg_model.include_input_xyz
+        self.include_input_dir = cfg_model.include_input_dir
+        self.dim_dir = model.dim_dir
+        self.register_buffer('frequency_bands_xyz', encoding_frequency_bands(cfg_model.num_encoding_fn_xyz, cfg_model.log_sampling_xyz))
+        self.register_buffer('frequency_bands_dir', encoding_frequency_bands(cfg_model.num_encoding_fn_dir, cfg_model.log_sampling_dir))
+
+    def forward(self, x):
+        encoded = fused_positional_encoding(x[..., :3], self.frequency_bands_xyz, self.include_input_xyz)
+        if self.use_viewdirs and self.inputs == 'rays':
+            encoded_dir = fused_positional_encoding(x[..., 3:6], self.frequency_bands_dir, self.include_input_dir)
+            encoded = torch.cat((encoded, encoded_dir), dim=-1)
+        elif self.use_viewdirs:
+            encoded = torch.cat((encoded, encoded.new_zeros(encoded.shape[:-1] + (self.dim_dir,))), dim=-1)
+        return self.model(encoded)
+
+
+class InferenceGraph(object):
+    r"""The positional encoding and network of `model` as one graph, see `inference_graph`. Called like the
+    model, but on the raw inputs of `EncodedNeRFModel`. An ensemble stays an ensemble: `len()` is its number of
+    members and `ensemble` is True, so `run_network_secondary` evaluates it in one batched pass.
+    """
+
+    def __init__(self, graph, model, inputs):
+        self.graph = graph
+        self.inputs = inputs
+        self.ensemble = isinstance(model, EnsembleFlexibleNeRFModel)
+        self.num_models = len(model) if self.ensemble else 1
+
+    def __call__(self, x):
+        return self.graph(x)
+
+    def __len__(self):
+        return self.num_models
+
+
+def inference_graph(model, cfg_model, mode='trace', inputs='rays'):
+    r"""Export `model` with its positional encoding (see `EncodedNeRFModel`) for inference.
+
+    Args:
+        mode (str): 'trace' freezes a TorchScript trace: the layer loop and the skip connections are unrolled and
+            the weights are constants, so the graph has to be exported again after loading other weights.
+            'compile' uses torch.compile (with dynamic batch sizes), which needs a C++ compiler on CPU and
+            compiles on the first call.
+        inputs (str): 'rays' or 'points', see `EncodedNeRFModel`.
+    """
+    module = EncodedNeRFModel(model, cfg_model, inputs=inputs).eval()
+    device = next(model.parameters()).device
+    module.to(device)
+    if mode == 'trace':
+        example = torch.rand((1024, 6 if inputs == 'rays' else 3), device=device)
+        with torch.no_grad():
+            graph = torch.jit.freeze(torch.jit.trace(module, example, check_trace=False))
+    elif mode == 'compile':
+        graph = torch.compile(module, dynamic=True)
+    else:
+        raise ValueError(f'Unknown inference graph {mode}; valid graphs: {", ".join(INFERENCE_GRAPHS[1:])}')
+    return InferenceGraph(graph, model, inputs)
@@ -2,6 +2,43 @@
 Utils to compute metrics and track them across training.
 """
 
+import torch
+
+ENSEMBLE_DISAGREEMENT_METRICS = ("pairwise", "variance", "max_deviation")
+
+
+def ensemble_disagreement(values, metric="pairwise"):
+    r"""Per-point disagreement between ensemble members, vectorized over the member axis.
+
+    Args:
+        values (torch.Tensor): Member predictions of shape :math:`(M, N, C)`.
+        metric (str): "pairwise" for the mean pairwise euclidean distance between members
+            (equal to `np.mean(scipy.spatial.distance.pdist(values[:, i]))`), "variance" for the
+            variance across members averaged over the channels, or "max_deviation" for the
+            largest euclidean distance of a member to the member mean.
+
+    Returns:
+    (torch.Tensor): Disagreement of shape :math:`(N,)`.
+    """
+    if metric == "pairwise":
+        num_members = values.shape[0]
+        if num_members < 2:
+            # no pairs; a single member agrees with itself, as for the other metrics
+            return values.new_zeros(values.shape[1])
+        first, second = torch.triu_indices(num_members, num_members, offset=1)
+        distances = (values[first] - values[second]).norm(p=2, dim=-1)
+        return distances.mean(dim=0)
+    elif metric == "variance":
+        return values.var(dim=0, unbiased=False).mean(dim=-1)
+    elif metric == "max_deviation":
+        deviations = (values - values.mean(dim=0, keepdim=True)).norm(p=2, dim=-1)
+        return deviations.max(dim=0).values
+    raise ValueError(
+        "Unknown ensemble disagreement metric {}; valid metrics: {}".format(
+            metric, ENSEMBLE_DISAGREEMENT_METRICS
+        )
+    )
+
 
 class ScalarMetric(object):
     def __init__(self):
@@ -1,3 +1,5 @@
+import math
+
 import torch
 
 
@@ -267,3 +269,144 @@ class FlexibleNeRFModel(torch.nn.Module):
             return torch.cat((rgb, alpha), dim=-1)
         else:
             return self.fc_out(x)
+
+
+class BatchedLinear(torch.nn.Module):
+    r"""A stack of `num_models` independent linear layers, evaluated with one batched matmul.
+
+    Input of shape :math:`(N, in)` is shared by all models, input of shape :math:`(K, N, in)` is
+    evaluated per model. The output has shape :math:`(K, N, out)`.
+    """
+
+    def __init__(self, num_models, in_features, out_features):
+        super(BatchedLinear, self).__init__()
+        self.weight = torch.nn.Parameter(torch.empty(num_models, out_features, in_features))
+        self.bias = torch.nn.Parameter(torch.empty(num_models, out_features))
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        # Same initialization as torch.nn.Linear, per model.
+        bound = 1.0 / math.sqrt(self.weight.shape[-1])
+        torch.nn.init.uniform_(self.weight, -bound, bound)
+        torch.nn.init.uniform_(self.bias, -bound, bound)
+
+    def forward(self, x):
+        if x.dim() == 2:
+            x = x.expand(self.weight.shape[0], *x.shape)
+        # bmm + in-place bias is cheaper on CPU than baddbmm, which first copies the broadcast bias
+        return torch.bmm(x, self.weight.transpose(1, 2)).add_(self.bias.unsqueeze(1))
+
+
+class EnsembleFlexibleNeRFModel(torch.nn.Module):
+    r"""`num_models` FlexibleNeRFModels with the same architecture, evaluated together.
+
+    The weights of the members are stacked per layer, so every layer runs as a single batched
+    matmul over all members. Submodules carry the same names as in FlexibleNeRFModel, which makes
+    the stacked member state dicts (see `load_state_dict_list`) load directly.
+    """
+
+    def __init__(
+        self,
+        num_models,
+        num_layers=4,
+        hidden_size=128,
+        skip_connect_every=4,
+        num_encoding_fn_xyz=6,
+        num_encoding_fn_dir=4,
+        include_input_xyz=True,
+        include_input_dir=True,
+        use_viewdirs=True,
+        model_type='ensemble',
+    ):
+        super(EnsembleFlexibleNeRFModel, self).__init__()
+
+        include_input_xyz = 3 if include_input_xyz else 0
+        include_input_dir = 3 if include_input_dir else 0
+        self.num_models = num_models
+        self.dim_xyz = include_input_xyz + 2 * 3 * num_encoding_fn_xyz
+        self.dim_dir = include_input_dir + 2 * 3 * num_encoding_fn_dir
+        self.skip_connect_every = skip_connect_every
+        if not use_viewdirs:
+            self.dim_dir = 0
+
+        self.layer1 = BatchedLinear(num_models, self.dim_xyz, hidden_size)
+        self.layers_xyz = torch.nn.ModuleList()
+        self.num_layers = num_layers
+        for i in range(self.num_layers - 1):
+            if i % self.skip_connect_every == 0 and i > 0 and i != self.num_layers - 1:
+                self.layers_xyz.append(
+                    BatchedLinear(num_models, self.dim_xyz + hidden_size, hidden_size)
+                )
+            else:
+                self.layers_xyz.append(BatchedLinear(num_models, hidden_size, hidden_size))
+
+        self.use_viewdirs = use_viewdirs
+        self.model_type = model_type
+        if self.use_viewdirs:
+            self.layers_dir = torch.nn.ModuleList()
+            self.layers_dir.append(
+                BatchedLinear(num_models, self.dim_dir + hidden_size, hidden_size // 2)
+            )
+
+            self.fc_alpha = BatchedLinear(num_models, hidden_size, 1)
+            self.fc_rgb = BatchedLinear(num_models, hidden_size // 2, 3)
+            self.fc_feat = BatchedLinear(num_models, hidden_size, hidden_size)
+
+            if self.model_type == 'nn':
+                self.fc_uncertainty = BatchedLinear(num_models, hidden_size // 2, 1)
+        else:
+            self.fc_out = BatchedLinear(num_models, hidden_size, 4)
+
+        self.relu = torch.nn.functional.relu
+
+    def __len__(self):
+        return self.num_models
+
+    def load_state_dict_list(self, state_dicts, name="state_dicts"):
+        r"""Fill the ensemble from a list of FlexibleNeRFModel state dicts, one per member
+        (e.g. `checkpoint["model_fine_secondary_state_dict"]`, with that key as `name` for the error).
+        """
+        if len(state_dicts) != self.num_models:
+            raise ValueError(
+                "{} has {} state dicts for an ensemble of {} members".format(
+                    name, len(state_dicts), self.num_models
+                )
+            )
+        stacked = {
+            key: torch.stack([state_dict[key] for state_dict in state_dicts], dim=0)
+            for key in state_dicts[0]
+        }
+        return self.load_state_dict(stacked)
+
+    def forward(self, x):
+        # x: [N, D] shared by all members, or [K, N, D]. Returns [K, N, 4] (or [K, N, 5] for 'nn').
+        if x.dim() == 2:
+            x = x.expand(self.num_models, *x.shape)
+        if self.use_viewdirs:
+            xyz, view = x[..., : self.dim_xyz], x[..., self.dim_xyz :]
+        else:
+            xyz = x[..., : self.dim_xyz]
+        x = self.layer1(xyz)
+        for i in range(len(self.layers_xyz)):
+            if (
+                i % self.skip_connect_every == 0
+                and i > 0
+                and i != self.num_layers - 1
+            ):
+                x = torch.cat((x, xyz), dim=-1)
+            x = self.relu(self.layers_xyz[i](x))
+        if self.use_viewdirs:
+            feat = self.relu(self.fc_feat(x))
+            alpha = self.fc_alpha(x)
+            x = torch.cat((feat, view), dim=-1)
+            for l in self.layers_dir:
+                x = self.relu(l(x))
+            rgb = self.fc_rgb(x)
+
+            if self.model_type == 'nn':
+                delta = self.fc_uncertainty(x)
+                return torch.cat((rgb, alpha, delta), dim=-1)
+
+            return torch.cat((rgb, alpha), dim=-1)
+        else:
+            return self.fc_out(x)
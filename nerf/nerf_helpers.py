@@ -110,6 +110,40 @@ def get_ray_bundle(
     return ray_origins, ray_directions
 
 
+def get_ray_bundles(height: int, width: int, focal_length, tforms_cam2world: torch.Tensor):
+    r"""The ray bundles of several cameras at once, see `get_ray_bundle`.
+
+    Args:
+    height (int): Height of the images (number of pixels).
+    width (int): Width of the images (number of pixels).
+    focal_length (float or torch.Tensor): Focal length of all cameras, or one per camera (shape: :math:`(N,)`).
+    tforms_cam2world (torch.Tensor): Camera-to-world transforms (shape: :math:`(N, 4, 4)`).
+
+    Returns:
+    ray_origins (torch.Tensor): Ray origins of shape :math:`(N, height, width, 3)`.
+    ray_directions (torch.Tensor): Ray directions of shape :math:`(N, height, width, 3)`.
+    """
+    ii, jj = meshgrid_xy(
+        torch.arange(width, dtype=tforms_cam2world.dtype, device=tforms_cam2world.device),
+        torch.arange(height, dtype=tforms_cam2world.dtype, device=tforms_cam2world.device),
+    )
+    focal_length = torch.as_tensor(focal_length, dtype=tforms_cam2world.dtype, device=tforms_cam2world.device)
+    focal_length = focal_length.expand(tforms_cam2world.shape[:1])[:, None, None]
+    directions = torch.stack(
+        [
+            (ii - width * 0.5) / focal_length,
+            -(jj - height * 0.5) / focal_length,
+            -torch.ones_like(ii).expand(focal_length.shape[:1] + ii.shape),
+        ],
+        dim=-1,
+    )
+    ray_directions = torch.sum(
+        directions[..., None, :] * tforms_cam2world[:, None, None, :3, :3], dim=-1
+    )
+    ray_origins = tforms_cam2world[:, None, None, :3, -1].expand(ray_directions.shape)
+    return ray_origins, ray_directions
+
+
 def positional_encoding(
     tensor, num_encoding_functions=6, include_input=True, log_sampling=True
 ) -> torch.Tensor:
@@ -0,0 +1,58 @@
+import torch
+
+
+class OccupancyGrid(object):
+    r"""Which parts of the scene contain density, on a regular grid of points.
+
+    Every grid point stands for the box of one grid spacing around it. Samples in a box that is not occupied
+    (or outside the grid) are known to be empty, so they can skip the network (see `predict_and_render_radiance`).
+
+    Args:
+        occupied (torch.Tensor): Boolean grid of shape :math:`(nz, ny, nx)`, i.e. vtk point order flattened.
+        origin (tuple): Position of the first grid point.
+        spacing (tuple): Distance between grid points along x, y and z.
+    """
+
+    def __init__(self, occupied, origin, spacing):
+        self.occupied = occupied
+        self.origin = torch.as_tensor(origin, dtype=torch.float32, device=occupied.device)
+        self.spacing = torch.as_tensor(spacing, dtype=torch.float32, device=occupied.device)
+        self.dims = torch.tensor(occupied.shape[::-1], device=occupied.device)
+
+    @classmethod
+    def from_values(cls, values, dims, origin, spacing, threshold=0.01, dilation=1):
+        r"""Occupancy of the points where `values` (e.g. opacity or density, flat in vtk point order, x fastest)
+        is above `threshold`, grown by `dilation` points so that surfaces between grid points are kept.
+        """
+        values = torch.as_tensor(values).reshape(dims[2], dims[1], dims[0])
+        occupied = (values > threshold).float()
+        if dilation > 0:
+            occupied = torch.nn.functional.max_pool3d(
+                occupied[None, None], kernel_size=2 * dilation + 1, stride=1, padding=dilation
+            )[0, 0]
+        return cls(occupied > 0, origin, spacing)
+
+    @classmethod
+    def from_density_fn(cls, density_fn, dims, origin, spacing, threshold=0.01, dilation=1, chunksize=65536):
+        r"""Occupancy probed from `density_fn`, which maps points :math:`(N, 3)` to their density :math:`(N,)`."""
+        axes = [
+            origin[axis] + spacing[axis] * torch.arange(dims[axis], dtype=torch.float32)
+            for axis in range(3)
+        ]
+        z, y, x = torch.meshgrid(axes[2], axes[1], axes[0], indexing="ij")
+        pts = torch.stack((x, y, z), dim=-1).reshape(-1, 3)
+        density = torch.cat([density_fn(pts[i : i + chunksize]).cpu() for i in range(0, pts.shape[0], chunksize)])
+        return cls.from_values(density, dims, origin, spacing, threshold=threshold, dilation=dilation)
+
+    def to(self, device):
+        return OccupancyGrid(self.occupied.to(device), self.origin.tolist(), self.spacing.tolist())
+
+    def query(self, pts):
+        r"""Whether the points :math:`(..., 3)` are in an occupied box; returns a boolean tensor :math:`(...)`."""
+        index = torch.round((pts - self.origin) / self.spacing).long()
+        inside = ((index >= 0) & (index < self.dims)).all(dim=-1)
+        index = torch.minimum(torch.clamp(index, min=0), self.dims - 1)
+        return inside & self.occupied[index[..., 2], index[..., 1], index[..., 0]]
+
+    def fraction_occupied(self):
+        return self.occupied.float().mean().item()
@@ -1,30 +1,171 @@
+import contextlib
+
 import torch
 import numpy as np
 
-from .nerf_helpers import get_minibatches, ndc_rays
+from .nerf_helpers import get_minibatches, get_ray_bundles, ndc_rays
 from .nerf_helpers import sample_pdf_2 as sample_pdf
 from .volume_rendering_utils import volume_render_radiance_field
+from .models import EnsembleFlexibleNeRFModel
 
-def run_network(network_fn, pts, ray_batch, chunksize, embed_fn, embeddirs_fn):
-
-    pts_flat = pts.reshape((-1, pts.shape[-1]))
+def embed_points(pts, ray_batch, embed_fn, embeddirs_fn, occupied=None):
+    # the flattened samples, or only those where `occupied` (see run_network) is true
+    if occupied is None:
+        pts_flat = pts.reshape((-1, pts.shape[-1]))
+    else:
+        pts_flat = pts[occupied]
     embedded = embed_fn(pts_flat)
     if embeddirs_fn is not None:
         viewdirs = ray_batch[..., None, -3:]
         input_dirs = viewdirs.expand(pts.shape)
-        input_dirs_flat = input_dirs.reshape((-1, input_dirs.shape[-1]))
+        if occupied is None:
+            input_dirs_flat = input_dirs.reshape((-1, input_dirs.shape[-1]))
+        else:
+            input_dirs_flat = input_dirs[occupied]
         embedded_dirs = embeddirs_fn(input_dirs_flat)
         embedded = torch.cat((embedded, embedded_dirs), dim=-1)
+    return embedded
+
 
+PRECISIONS = ['fp32', 'bf16']
+
+
+def inference_autocast(precision='fp32', device_type='cpu'):
+    r"""Context to evaluate the networks in: unchanged for 'fp32', autocast to bfloat16 for 'bf16', which runs
+    the matrix multiplications in bf16 (fast on CPUs with AVX512-BF16 or AMX, emulated and slow elsewhere).
+    The network outputs are converted back to fp32 by `run_batches`, so the compositing stays in fp32.
+    """
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    if precision == 'bf16':
+        return torch.autocast(device_type, dtype=torch.bfloat16)
+    raise ValueError(f'Unknown precision {precision}; valid precisions: {", ".join(PRECISIONS)}')
+
+
+def run_batches(network_fn, embedded, chunksize, dim=0):
     batches = get_minibatches(embedded, chunksize=chunksize)
-    preds = [network_fn(batch) for batch in batches]
-    radiance_field = torch.cat(preds, dim=0)
+    if len(batches) == 0:
+        # no samples at all, e.g. none of them is occupied
+        return network_fn(embedded).float()
+    return torch.cat([network_fn(batch).float() for batch in batches], dim=dim)
+
+
+def scatter_occupied(radiance_field, occupied):
+    # radiance field of the occupied samples, [..., P, C], to all samples, [..., *occupied.shape, C]; the other
+    # samples get all zeros, so no density
+    full = radiance_field.new_zeros(radiance_field.shape[:-2] + occupied.shape + radiance_field.shape[-1:])
+    full[..., occupied, :] = radiance_field
+    return full
+
+
+def is_ensemble(network_fns):
+    # an EnsembleFlexibleNeRFModel, or the inference graph of one (see nerf.inference_graph)
+    return isinstance(network_fns, EnsembleFlexibleNeRFModel) or getattr(network_fns, 'ensemble', False)
+
+
+def run_members(network_fns, embedded, chunksize):
+    # radiance fields of all secondary models on the same embedded samples, (K, P, C)
+    if is_ensemble(network_fns):
+        return run_batches(network_fns, embedded, chunksize, dim=1)
+    return torch.stack([run_batches(network_fn, embedded, chunksize) for network_fn in network_fns], dim=0)
+
+
+def run_network_terminated(network_fn, pts, ray_batch, z_vals, chunksize, embed_fn, embeddirs_fn, occupied=None,
+                           early_termination=1e-3, segment_size=16, secondary=False):
+    r"""Evaluate the network front to back in depth segments of `segment_size` samples, and stop evaluating a ray
+    once its transmittance drops below `early_termination`; its later samples are empty. Every segment only
+    embeds and evaluates the samples of the rays that are still active, so the surfaces hide what is behind
+    them. With `secondary` the rays stay active as long as one of the secondary models still sees through.
+
+    Like the compositing, the transmittance follows `z_vals` (num_rays, num_samples); the radiance field noise is
+    not taken into account, so this is meant for rendering rather than training.
+    """
+    num_rays, num_samples = pts.shape[:2]
+    dists = torch.cat((z_vals[..., 1:] - z_vals[..., :-1], torch.full_like(z_vals[..., :1], 1e10)), dim=-1)
+    dists = dists * ray_batch[..., None, 3:6].norm(p=2, dim=-1)
+
+    radiance_field = None
+    active = torch.ones(num_rays, dtype=torch.bool, device=pts.device)
+    optical_depth = 0.0
+    for start in range(0, num_samples, segment_size):
+        end = min(start + segment_size, num_samples)
+        segment = torch.zeros((num_rays, num_samples), dtype=torch.bool, device=pts.device)
+        segment[active, start:end] = True
+        if occupied is not None:
+            segment &= occupied
+
+        embedded = embed_points(pts, ray_batch, embed_fn, embeddirs_fn, segment)
+        if secondary:
+            segment_field = run_members(network_fn, embedded, chunksize)
+        else:
+            segment_field = run_batches(network_fn, embedded, chunksize)
+        if radiance_field is None:
+            radiance_field = segment_field.new_zeros(
+                segment_field.shape[:-2] + (num_rays, num_samples, segment_field.shape[-1])
+            )
+        radiance_field[..., segment, :] = segment_field
+
+        sigma = torch.nn.functional.relu(radiance_field[..., start:end, 3])
+        optical_depth = optical_depth + (sigma * dists[:, start:end]).sum(dim=-1)
+        transmittance = torch.exp(-optical_depth)
+        active = transmittance > early_termination
+        if secondary:
+            active = active.any(dim=0)
+        if not active.any():
+            break
+    return radiance_field
+
+
+def run_network(network_fn, pts, ray_batch, chunksize, embed_fn, embeddirs_fn, embedded=None, occupied=None,
+                z_vals=None, early_termination=0.0):
+    r"""Evaluate the network on the samples `pts` (num_rays, num_samples, 3). With an `occupied` mask
+    (num_rays, num_samples), e.g. from an OccupancyGrid, only the occupied samples go through the
+    network and the others are empty. With an `early_termination` threshold the rays stop behind
+    opaque surfaces, see `run_network_terminated`.
+    """
+    if early_termination > 0:
+        return run_network_terminated(network_fn, pts, ray_batch, z_vals, chunksize, embed_fn, embeddirs_fn,
+                                      occupied=occupied, early_termination=early_termination)
+    if embedded is None:
+        embedded = embed_points(pts, ray_batch, embed_fn, embeddirs_fn, occupied)
+
+    radiance_field = run_batches(network_fn, embedded, chunksize)
+    if occupied is not None:
+        return scatter_occupied(radiance_field, occupied)
     radiance_field = radiance_field.reshape(
         list(pts.shape[:-1]) + [radiance_field.shape[-1]]
     )
     return radiance_field
 
 
+def run_network_secondary(network_fns, pts, ray_batch, chunksize, embed_fn, embeddirs_fn, occupied=None,
+                          z_vals=None, early_termination=0.0):
+    r"""Evaluate all secondary models on the same samples. Returns their radiance fields stacked
+    along a leading member axis, :math:`(K, *pts.shape[:-1], C)`.
+
+    `network_fns` is either a list of models, or an EnsembleFlexibleNeRFModel (or its inference graph) that
+    evaluates all members in one batched pass per chunk. `occupied` and `early_termination` are applied as in `run_network`.
+    """
+    if early_termination > 0:
+        return run_network_terminated(network_fns, pts, ray_batch, z_vals, chunksize, embed_fn, embeddirs_fn,
+                                      occupied=occupied, early_termination=early_termination, secondary=True)
+    embedded = embed_points(pts, ray_batch, embed_fn, embeddirs_fn, occupied)
+    if is_ensemble(network_fns):
+        radiance_field = run_batches(network_fns, embedded, chunksize, dim=1)
+        if occupied is not None:
+            return scatter_occupied(radiance_field, occupied)
+        return radiance_field.reshape(
+            [len(network_fns)] + list(pts.shape[:-1]) + [radiance_field.shape[-1]]
+        )
+    return torch.stack(
+        [
+            run_network(network_fn, pts, ray_batch, chunksize, embed_fn, embeddirs_fn, embedded=embedded, occupied=occupied)
+            for network_fn in network_fns
+        ],
+        dim=0,
+    )
+
+
 def predict_and_render_radiance(
     ray_batch,
     model_coarse,
@@ -35,8 +176,12 @@ def predict_and_render_radiance(
     mode="train",
     encode_position_fn=None,
     encode_direction_fn=None,
+    occupancy_grid=None,
+    early_termination=0.0,
 ):
     # TESTED
+    # with an `occupancy_grid` (see OccupancyGrid) the samples in empty space skip the networks, with an
+    # `early_termination` threshold the samples behind opaque surfaces (see run_network_terminated)
     num_rays = ray_batch.shape[0]
     ro, rd = ray_batch[..., :3], ray_batch[..., 3:6]
     bounds = ray_batch[..., 6:8].view((-1, 1, 2))
@@ -67,6 +212,9 @@ def predict_and_render_radiance(
         z_vals = lower + (upper - lower) * t_rand
     # pts -> (num_rays, N_samples, 3)
     pts = ro[..., None, :] + rd[..., None, :] * z_vals[..., :, None]
+    occupied = occupancy_grid.query(pts) if occupancy_grid is not None else None
+    # both levels stop early: the coarse weights behind the point where a ray stops add up to less than the
+    # threshold, so the fine samples drawn from them barely move
 
     radiance_field = run_network(
         model_coarse,
@@ -75,6 +223,9 @@ def predict_and_render_radiance(
         getattr(options.nerf, mode).chunksize,
         encode_position_fn,
         encode_direction_fn,
+        occupied=occupied,
+        z_vals=z_vals,
+        early_termination=early_termination,
     )
 
     (
@@ -92,15 +243,18 @@ def predict_and_render_radiance(
     )
 
     rgb_coarse_secondary_list = []
-    len_coarse_model_secondary_list = len(coarse_model_secondary_list)
-    for i in range(len_coarse_model_secondary_list):
-        radiance_field_coarse_secondary = run_network(
-            coarse_model_secondary_list[i],
+    if len(coarse_model_secondary_list) > 0:
+        # All secondary models share the samples, so they are evaluated and composited together.
+        radiance_field_coarse_secondary = run_network_secondary(
+            coarse_model_secondary_list,
             pts,
             ray_batch,
             getattr(options.nerf, mode).chunksize,
             encode_position_fn,
             encode_direction_fn,
+            occupied=occupied,
+            z_vals=z_vals,
+            early_termination=early_termination,
         )
 
         (
@@ -116,7 +270,7 @@ def predict_and_render_radiance(
             radiance_field_noise_std=getattr(options.nerf, mode).radiance_field_noise_std,
             white_background=getattr(options.nerf, mode).white_background,
         )
-        rgb_coarse_secondary_list.append(rgb_coarse_secondary)
+        rgb_coarse_secondary_list = list(rgb_coarse_secondary.unbind(0))
 
 
     rgb_fine_secondary_list = []
@@ -136,6 +290,7 @@ def predict_and_render_radiance(
         z_vals, _ = torch.sort(torch.cat((z_vals, z_samples), dim=-1), dim=-1)
         # pts -> (N_rays, N_samples + N_importance, 3)
         pts = ro[..., None, :] + rd[..., None, :] * z_vals[..., :, None]
+        occupied = occupancy_grid.query(pts) if occupancy_grid is not None else None
 
         radiance_field = run_network(
             model_fine,
@@ -144,6 +299,9 @@ def predict_and_render_radiance(
             getattr(options.nerf, mode).chunksize,
             encode_position_fn,
             encode_direction_fn,
+            occupied=occupied,
+            z_vals=z_vals,
+            early_termination=early_termination,
         )
         rgb_fine, disp_fine, acc_fine, _, _ = volume_render_radiance_field(
             radiance_field,
@@ -156,15 +314,17 @@ def predict_and_render_radiance(
         )
 
 
-        len_fine_model_secondary_list = len(fine_model_secondary_list)
-        for i in range(len_fine_model_secondary_list):
-            radiance_field_fine_secondary = run_network(
-                fine_model_secondary_list[i],
+        if len(fine_model_secondary_list) > 0:
+            radiance_field_fine_secondary = run_network_secondary(
+                fine_model_secondary_list,
                 pts,
                 ray_batch,
                 getattr(options.nerf, mode).chunksize,
                 encode_position_fn,
                 encode_direction_fn,
+                occupied=occupied,
+                z_vals=z_vals,
+                early_termination=early_termination,
             )
 
             rgb_fine_secondary, disp_fine_secondary, acc_fine_secondary, _, _ = volume_render_radiance_field(
@@ -177,12 +337,36 @@ def predict_and_render_radiance(
                 white_background=getattr(options.nerf, mode).white_background,
             )
 
-            rgb_fine_secondary_list.append(rgb_fine_secondary)
+            rgb_fine_secondary_list = list(rgb_fine_secondary.unbind(0))
 
 
     return rgb_coarse, disp_coarse, acc_coarse, rgb_fine, disp_fine, acc_fine, rgb_coarse_secondary_list, rgb_fine_secondary_list
 
 
+def build_rays(height, width, focal_length, ray_origins, ray_directions, options):
+    # the flat ray batch of predict_and_render_radiance: origins, directions, near and far bounds and, with
+    # use_viewdirs, the normalized view directions
+    viewdirs = None
+    if options.nerf.use_viewdirs:
+        # Provide ray directions as input
+        viewdirs = ray_directions
+        viewdirs = viewdirs / viewdirs.norm(p=2, dim=-1).unsqueeze(-1)
+        viewdirs = viewdirs.reshape((-1, 3))
+    if options.dataset.no_ndc is False:
+        ro, rd = ndc_rays(height, width, focal_length, 1.0, ray_origins, ray_directions)
+        ro = ro.reshape((-1, 3))
+        rd = rd.reshape((-1, 3))
+    else:
+        ro = ray_origins.reshape((-1, 3))
+        rd = ray_directions.reshape((-1, 3))
+    near = options.dataset.near * torch.ones_like(rd[..., :1])
+    far = options.dataset.far * torch.ones_like(rd[..., :1])
+    rays = torch.cat((ro, rd, near, far), dim=-1)
+    if options.nerf.use_viewdirs:
+        rays = torch.cat((rays, viewdirs), dim=-1)
+    return rays
+
+
 def run_one_iter_of_nerf(
     height,
     width,
@@ -198,13 +382,14 @@ def run_one_iter_of_nerf(
     encode_position_fn=None,
     encode_direction_fn=None,
     model_type='ensemble',
+    chunk_callback=None,
+    occupancy_grid=None,
+    early_termination=0.0,
 ):
-    viewdirs = None
-    if options.nerf.use_viewdirs:
-        # Provide ray directions as input
-        viewdirs = ray_directions
-        viewdirs = viewdirs / viewdirs.norm(p=2, dim=-1).unsqueeze(-1)
-        viewdirs = viewdirs.view((-1, 3))
+    r"""Render the rays chunk by chunk. `chunk_callback`, if given, is called before every chunk, e.g. to
+    abort a render that is no longer needed by raising an exception. `occupancy_grid` and `early_termination`
+    are passed on to `predict_and_render_radiance`.
+    """
     # Cache shapes now, for later restoration.
     restore_shapes = [
         ray_directions.shape,
@@ -213,33 +398,28 @@ def run_one_iter_of_nerf(
     ]
     if model_fine:
         restore_shapes += restore_shapes
-    if options.dataset.no_ndc is False:
-        ro, rd = ndc_rays(height, width, focal_length, 1.0, ray_origins, ray_directions)
-        ro = ro.view((-1, 3))
-        rd = rd.view((-1, 3))
-    else:
-        ro = ray_origins.view((-1, 3))
-        rd = ray_directions.view((-1, 3))
-    near = options.dataset.near * torch.ones_like(rd[..., :1])
-    far = options.dataset.far * torch.ones_like(rd[..., :1])
-    rays = torch.cat((ro, rd, near, far), dim=-1)
-    if options.nerf.use_viewdirs:
-        rays = torch.cat((rays, viewdirs), dim=-1)
+    rays = build_rays(height, width, focal_length, ray_origins, ray_directions, options)
 
     batches = get_minibatches(rays, chunksize=getattr(options.nerf, mode).chunksize)
-    pred = [
-        predict_and_render_radiance(
-            batch,
-            model_coarse,
-            model_fine,
-            coarse_model_secondary_list,
-            fine_model_secondary_list,
-            options,
-            encode_position_fn=encode_position_fn,
-            encode_direction_fn=encode_direction_fn,
+    pred = []
+    for batch in batches:
+        if chunk_callback is not None:
+            chunk_callback()
+        pred.append(
+            predict_and_render_radiance(
+                batch,
+                model_coarse,
+                model_fine,
+                coarse_model_secondary_list,
+                fine_model_secondary_list,
+                options,
+                mode=mode,
+                encode_position_fn=encode_position_fn,
+                encode_direction_fn=encode_direction_fn,
+                occupancy_grid=occupancy_grid,
+                early_termination=early_termination,
+            )
         )
-        for batch in batches
-    ]
     synthesized_images_ = list(zip(*pred))
     
     synthesized_images = [
@@ -285,18 +465,15 @@ def run_one_iter_of_nerf(
         ]
 
         if model_type == 'ensemble':
-            restore_shapes_secondary = []
-            for i in range(len(synthesized_images_coarse_secondary)):
-                restore_shapes_secondary.append(restore_shapes[0])
-
+            # the coarse and fine secondary lists can differ in length, e.g. when only one level has secondary models
             synthesized_images_coarse_secondary_valid = [
-                image.view(shape) if image is not None else None
-                for (image, shape) in zip(synthesized_images_coarse_secondary, restore_shapes_secondary)
+                image.view(restore_shapes[0]) if image is not None else None
+                for image in synthesized_images_coarse_secondary
             ]
 
             synthesized_images_fine_secondary_valid = [
-                image.view(shape) if image is not None else None
-                for (image, shape) in zip(synthesized_images_fine_secondary, restore_shapes_secondary)
+                image.view(restore_shapes[0]) if image is not None else None
+                for image in synthesized_images_fine_secondary
             ]
 
         # Returns rgb_coarse, disp_coarse, acc_coarse, rgb_fine, disp_fine, acc_fine
@@ -316,3 +493,62 @@ def run_one_iter_of_nerf(
         synthesized_images.append(synthesized_images_fine_secondary)
 
     return tuple(synthesized_images)
+
+
+def run_poses_of_nerf(
+    height,
+    width,
+    focal_lengths,
+    tforms_cam2world,
+    model_coarse,
+    model_fine,
+    options,
+    mode="validation",
+    encode_position_fn=None,
+    encode_direction_fn=None,
+    chunk_callback=None,
+    occupancy_grid=None,
+    early_termination=0.0,
+    out=None,
+):
+    r"""Render the rgb images of N cameras at once. The rays of all cameras are packed into full chunks, so
+    only the very last chunk is partial, and the images are written into `out` :math:`(N, height, width, 3)`,
+    which is allocated if not given.
+
+    `focal_lengths` is one focal length for all cameras or one per camera, `tforms_cam2world` the
+    camera-to-world transforms :math:`(N, 4, 4)`. The images are those of the fine model if there are fine
+    samples, else those of the coarse model; the other arguments are as in `run_one_iter_of_nerf`.
+    """
+    num_poses = tforms_cam2world.shape[0]
+    focal_lengths = torch.as_tensor(focal_lengths, dtype=tforms_cam2world.dtype).expand(num_poses)
+    ray_origins, ray_directions = get_ray_bundles(height, width, focal_lengths, tforms_cam2world)
+    rays = torch.cat(
+        [
+            build_rays(height, width, focal_lengths[i].item(), ray_origins[i], ray_directions[i], options)
+            for i in range(num_poses)
+        ],
+        dim=0,
+    )
+
+    if out is None:
+        out = rays.new_empty((num_poses, height, width, 3))
+    out_flat = out.view((-1, 3))
+    chunksize = getattr(options.nerf, mode).chunksize
+    for start in range(0, rays.shape[0], chunksize):
+        if chunk_callback is not None:
+            chunk_callback()
+        rgb_coarse, _, _, rgb_fine, _, _, _, _ = predict_and_render_radiance(
+            rays[start : start + chunksize],
+            model_coarse,
+            model_fine,
+            [],
+            [],
+            options,
+            mode=mode,
+            encode_position_fn=encode_position_fn,
+            encode_direction_fn=encode_direction_fn,
+            occupancy_grid=occupancy_grid,
+            early_termination=early_termination,
+        )
+        out_flat[start : start + chunksize] = rgb_fine if rgb_fine is not None else rgb_coarse
+    return out
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+Accuracy and speed of lower-precision inference (see nerf.inference_autocast) against fp32: the PSNR of rendered
+views and the error of the opacity and uncertainty volumes, for the checkpoint of a viewer config.
+"""
+
+import argparse
+import time
+import yaml
+import numpy as np
+import torch
+
+import eval_nerf
+import volume_generator
+from helpers.data import Data
+from nerf import CfgNode, img2mse, mse2psnr
+
+
+def orbit_poses(num_views, vector_magnitude=4.0):
+    # camera-to-world poses around the object, as the viewer camera would render them
+    poses = []
+    for angle in np.linspace(0, 2 * np.pi, num_views, endpoint=False):
+        rotation_matrix = np.eye(4)
+        rotation_matrix[:3, :3] = [[np.cos(angle), 0, np.sin(angle)], [0, 1, 0], [-np.sin(angle), 0, np.cos(angle)]]
+        poses.append(eval_nerf.render_pose(vector_magnitude, rotation_matrix))
+    return torch.stack(poses)
+
+
+def render_report(data, precision, num_views=8, image_size=200):
+    session = eval_nerf.render_session(data)
+    poses = orbit_poses(num_views)
+    # the focal length of the viewer camera at its initial distance, see synthesis_button.camera_view
+    focal_length = 1200 * image_size / 800
+
+    images, times = {}, {}
+    for render_precision in ['fp32', precision]:
+        session.precision = render_precision
+        start = time.time()
+        images[render_precision] = session.render_poses(poses, image_size, image_size, focal_length).clamp(0, 1)
+        times[render_precision] = time.time() - start
+    session.precision = data.precision
+
+    psnr = [mse2psnr(img2mse(image, reference).item()) for image, reference in zip(images[precision], images['fp32'])]
+    return {'psnr_min': min(psnr), 'psnr_mean': float(np.mean(psnr)), 'time_fp32': times['fp32'], 'time': times[precision]}
+
+
+def volume_report(data, precision, xyzNumPoint=64):
+    cfg_dict, model_fine, fine_model_secondary_list = volume_generator.load_volume_models(data.data_name, data.dataset_config, data.model_type, data.iterations)
+    cfg = CfgNode(cfg_dict)
+    dims, origin, spacing = volume_generator.volume_grid(model_fine, cfg, xyzNumPoint)
+
+    outputs, times = {}, {}
+    for grid_precision in ['fp32', precision]:
+        start = time.time()
+        outputs[grid_precision] = volume_generator.evaluate_grid(model_fine, fine_model_secondary_list, cfg, data.model_type, dims, origin, spacing, progress=False, precision=grid_precision)
+        times[grid_precision] = time.time() - start
+
+    # errors of the volumes as they are written: the opacity, and the uncertainties relative to their fp32 range
+    errors = {}
+    opacity_error = np.abs(np.exp(-outputs[precision]['sigma']) - np.exp(-outputs['fp32']['sigma']))
+    errors['opacity'] = (float(opacity_error.max()), float(opacity_error.mean()))
+    for name in volume_generator.output_names(data.model_type)[1:]:
+        reference = outputs['fp32'][name]
+        value_range = max(float(reference.max() - reference.min()), 1e-10)
+        error = np.abs(outputs[precision][name] - reference) / value_range
+        errors[name] = (float(error.max()), float(error.mean()))
+    return {'errors': errors, 'time_fp32': times['fp32'], 'time': times[precision]}
+
+
+def precision_report(data, precision='bf16', num_views=8, image_size=200, xyzNumPoint=64):
+    r"""Compare `precision` to fp32 on the checkpoint of `data`: the PSNR of `num_views` rendered views (with
+    fp32 as the reference) and the max / mean error of the volumes at `xyzNumPoint` points per dimension.
+    """
+    render = render_report(data, precision, num_views=num_views, image_size=image_size)
+    volume = volume_report(data, precision, xyzNumPoint=xyzNumPoint)
+
+    print('----------------------------------------')
+    print(f'{precision} against fp32, {data.data_path}, iteration {data.iterations}')
+    print(f'Views ({num_views} x {image_size}x{image_size}): PSNR min {render["psnr_min"]:.2f} dB, mean {render["psnr_mean"]:.2f} dB')
+    print(f'Render time: fp32 {render["time_fp32"]:.2f}s, {precision} {render["time"]:.2f}s')
+    for name, (error_max, error_mean) in volume['errors'].items():
+        print(f'Volume {name} error: max {error_max:.2e}, mean {error_mean:.2e}')
+    print(f'Volume time ({xyzNumPoint}^3): fp32 {volume["time_fp32"]:.2f}s, {precision} {volume["time"]:.2f}s')
+    return {'render': render, 'volume': volume}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--config", type=str, required=True, help="Path to (.yml) config file."
+    )
+    parser.add_argument(
+        "--precision", type=str, default='bf16', help="Precision to compare against fp32."
+    )
+    parser.add_argument(
+        "--views", type=int, default=8, help="Number of rendered views."
+    )
+    parser.add_argument(
+        "--image_size", type=int, default=200, help="Width and height of the rendered views."
+    )
+    parser.add_argument(
+        "--resolution", type=int, default=64, help="Points per dimension of the compared volumes."
+    )
+
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config_args = yaml.load(f, Loader=yaml.FullLoader)
+
+    precision_report(Data(config_args, prepare_data=True), precision=args.precision, num_views=args.views, image_size=args.image_size, xyzNumPoint=args.resolution)
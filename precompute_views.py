@@ -6,7 +6,8 @@ import time
 
 from helpers.data import Data
 from helpers.camera import CustomCamera
-from components.renderers.synthesis_button import infer_nerf
+from components.renderers.synthesis_button import camera_view
+import eval_nerf
 
 from helpers.preprocess import setup_isosurface, setup_renderer, get_orientation, set_orientation
 
@@ -45,6 +46,9 @@ orig_orientation = get_orientation(camera)
 
 start_time = time.time()
 
+# the views are rendered together, with the rays of several views packed into every chunk
+views = []
+save_file_names = []
 for index, row in angle_df.iterrows():
     set_orientation(iso_renderer, orig_orientation)
 
@@ -57,7 +61,10 @@ for index, row in angle_df.iterrows():
     camera.Elevation(row['elevation'])
     iso_renderer.ResetCamera()
     camera.OrthogonalizeViewUp()
-    infer_nerf(save_file_name, camera, data)
+    views.append(camera_view(camera))
+    save_file_names.append(save_file_name)
+
+eval_nerf.get_render_images(views, data, save_file_names)
 
 end_time = time.time()
 print('Total time for precomputing views:', end_time - start_time)
\ No newline at end of file
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+import torch
+
+from nerf import BakedGrid
+
+DIMS, ORIGIN, SPACING = (6, 5, 4), (-1.0, -1.0, -1.0), (0.4, 0.5, 0.6)
+
+
+def grid_point(i, j, k):
+    return [o + n * d for o, n, d in zip(ORIGIN, (i, j, k), SPACING)]
+
+
+def make_grid(point_ids=None, members=True, white_background=True):
+    # random fields at every other point of the grid by default
+    rng = np.random.default_rng(0)
+    if point_ids is None:
+        point_ids = np.arange(0, int(np.prod(DIMS)), 2)
+    fields = {name: rng.normal(size=(len(point_ids), 4)).astype(np.float32) for name in ['radiance', 'mean', 'variance']}
+    if not members:
+        del fields['mean'], fields['variance']
+    return BakedGrid(DIMS, ORIGIN, SPACING, point_ids, white_background=white_background, **fields)
+
+
+@pytest.mark.parametrize("members", [True, False])
+def test_save_and_load(tmp_path, members):
+    grid = make_grid(members=members)
+    file_name = str(tmp_path / "baked.npz")
+    grid.save(file_name)
+
+    # the fields are stored in half precision
+    with np.load(file_name) as baked:
+        assert baked['radiance'].dtype == np.float16
+        assert ('mean' in baked) == members
+
+    loaded = BakedGrid.load(file_name)
+    assert loaded.dims == grid.dims and loaded.origin == grid.origin and loaded.spacing == grid.spacing
+    assert loaded.white_background and loaded.has_members() == members
+    assert np.array_equal(loaded.point_ids, grid.point_ids)
+    assert loaded.fraction_stored() == pytest.approx(0.5)
+    for name, values in grid.fields.items():
+        assert loaded.fields[name].dtype == np.float32
+        assert np.allclose(loaded.fields[name], values, rtol=1e-3, atol=1e-3)
+
+
+def test_sampling():
+    grid = make_grid()
+    radiance = grid.fields['radiance']
+    # point ids 0 and 2 are stored, 1 (between them along x) is not
+    pts = torch.tensor([grid_point(0, 0, 0), grid_point(2, 0, 0), grid_point(1, 0, 0), grid_point(0.5, 0, 0)])
+    values = grid.sample('radiance', pts).numpy()
+    assert np.allclose(values[0], radiance[0], atol=1e-6)
+    assert np.allclose(values[1], radiance[1], atol=1e-6)
+    assert np.allclose(values[2], 0, atol=1e-6)
+    assert np.allclose(values[3], radiance[0] / 2, atol=1e-6)
+
+    # zero and no cell outside the grid
+    outside = torch.tensor([grid_point(-3, 0, 0), grid_point(0, 0, 10)])
+    assert np.all(grid.sample('radiance', outside).numpy() == 0)
+    assert torch.equal(grid.cell_ids(outside), torch.tensor([-1, -1]))
+    assert grid.cell_ids(torch.tensor([grid_point(1.5, 0.5, 0.5)])).item() == 1
+    assert grid.occupied_cells().shape == (DIMS[2] - 1, DIMS[1] - 1, DIMS[0] - 1)
+
+
+def pose_looking_down_z(distance=4.0):
+    # camera on the z axis looking at the origin
+    pose = torch.eye(4)
+    pose[2, 3] = distance
+    return pose
+
+
+def test_render_opaque_and_empty_grids():
+    # every point stored, dense and red
+    radiance = np.tile(np.array([[10.0, -10.0, -10.0, 1000.0]], dtype=np.float32), (int(np.prod(DIMS)), 1))
+    opaque = BakedGrid(DIMS, ORIGIN, SPACING, np.arange(int(np.prod(DIMS))), radiance, white_background=True)
+    rgb = opaque.render(pose_looking_down_z(), 8, 8, 4.0, num_samples=32)
+    # the rays through the middle of the image hit the grid
+    assert torch.allclose(rgb[3:5, 3:5], torch.tensor([1.0, 0.0, 0.0]), atol=1e-3)
+    # stopping the rays early only drops what is behind the surface
+    assert torch.allclose(opaque.render(pose_looking_down_z(), 8, 8, 4.0, num_samples=32, early_termination=0.0), rgb, atol=1e-3)
+
+    empty = make_grid(point_ids=np.zeros(0, dtype=np.int64), members=False)
+    assert torch.equal(empty.render(pose_looking_down_z(), 8, 8, 4.0), torch.ones(8, 8, 3))
+
+
+def test_render_members():
+    grid = make_grid()
+    rgb, mean, uncertainty = grid.render(pose_looking_down_z(), 6, 6, 4.0, num_samples=16, members=True)
+    assert rgb.shape == mean.shape == (6, 6, 3)
+    assert uncertainty.shape == (6, 6)
+    assert torch.equal(grid.render(pose_looking_down_z(), 6, 6, 4.0, num_samples=16), rgb)
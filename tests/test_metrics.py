@@ -0,0 +1,18 @@
+import pytest
+import torch
+
+from nerf.metrics import ENSEMBLE_DISAGREEMENT_METRICS, ensemble_disagreement
+
+
+@pytest.mark.parametrize("metric", ENSEMBLE_DISAGREEMENT_METRICS)
+def test_single_member_has_no_disagreement(metric):
+    values = torch.rand(1, 5, 3)
+    disagreement = ensemble_disagreement(values, metric)
+    assert disagreement.shape == (5,)
+    assert torch.equal(disagreement, torch.zeros(5))
+
+
+def test_pairwise_matches_mean_pairwise_distance():
+    values = torch.rand(4, 6, 3)
+    expected = torch.stack([torch.pdist(values[:, i]).mean() for i in range(values.shape[1])])
+    assert torch.allclose(ensemble_disagreement(values, "pairwise"), expected, atol=1e-6)
@@ -0,0 +1,40 @@
+import pytest
+import torch
+
+from nerf.models import EnsembleFlexibleNeRFModel, FlexibleNeRFModel
+
+ARCHITECTURE = dict(num_layers=5, hidden_size=16, skip_connect_every=2, num_encoding_fn_xyz=4, num_encoding_fn_dir=2)
+
+
+def make_members(num_models, model_type, use_viewdirs):
+    torch.manual_seed(0)
+    members = [FlexibleNeRFModel(**ARCHITECTURE, use_viewdirs=use_viewdirs, model_type=model_type) for _ in range(num_models)]
+    ensemble = EnsembleFlexibleNeRFModel(num_models, **ARCHITECTURE, use_viewdirs=use_viewdirs, model_type=model_type)
+    ensemble.load_state_dict_list([member.state_dict() for member in members])
+    return members, ensemble
+
+
+@pytest.mark.parametrize("model_type", ["ensemble", "nn"])
+@pytest.mark.parametrize("use_viewdirs", [True, False])
+def test_batched_members_match_separate_members(model_type, use_viewdirs):
+    members, ensemble = make_members(3, model_type, use_viewdirs)
+    dim = members[0].dim_xyz + (members[0].dim_dir if use_viewdirs else 0)
+
+    with torch.no_grad():
+        # one input shared by all members, as in the renderer and volume_generator
+        x = torch.randn(64, dim)
+        expected = torch.stack([member(x) for member in members], dim=0)
+        outputs = ensemble(x)
+        assert outputs.shape == expected.shape
+        assert torch.allclose(outputs, expected, atol=1e-5)
+
+        # an input per member
+        x = torch.randn(len(members), 64, dim)
+        expected = torch.stack([member(x[k]) for k, member in enumerate(members)], dim=0)
+        assert torch.allclose(ensemble(x), expected, atol=1e-5)
+
+
+def test_wrong_number_of_state_dicts_names_the_key():
+    members, ensemble = make_members(2, "ensemble", True)
+    with pytest.raises(ValueError, match="model_fine_secondary_state_dict has 1 state dicts"):
+        ensemble.load_state_dict_list([members[0].state_dict()], name="model_fine_secondary_state_dict")
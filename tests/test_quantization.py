@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from helpers.grid import quantize_unit_interval
+from helpers.vtk import read_volume_fields, stored_value, volume_metadata, volume_quantization, volume_to_numpy, volume_values
+from volume_generator import write_volumes
+
+
+def unit_values(dims):
+    # values in [0, 1] with exact zeros, the end points and values far below the quantization step
+    rng = np.random.default_rng(0)
+    values = rng.random(int(np.prod(dims)), dtype=np.float32)
+    values[:10] = 0.0
+    values[10:20] = np.float32(1e-7) * np.arange(1, 11, dtype=np.float32)
+    values[20] = 1.0
+    return values
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+def test_quantize_unit_interval(dtype):
+    values = unit_values((100,))
+    # chunks smaller than the array, so the last one is partial
+    quantized, scale = quantize_unit_interval(values, dtype, chunk_size=30)
+    assert quantized.dtype == dtype
+    assert scale == 1.0 / np.iinfo(dtype).max
+
+    dequantized = quantized * scale
+    assert np.all(np.abs(dequantized - values) <= scale)
+    # only values below half a step round up instead of to the nearest step
+    assert np.all(np.abs(dequantized - values)[values >= scale / 2] <= scale / 2 + 1e-7)
+    assert np.array_equal(quantized == 0, values == 0)
+    assert quantized[20] == np.iinfo(dtype).max
+
+
+@pytest.mark.parametrize("quantize", ["uint8", "uint16"])
+def test_quantized_volumes_round_trip(tmp_path, quantize):
+    dims, origin, spacing = (6, 5, 4), (-1.0, -1.0, -1.0), (0.5, 0.5, 0.5)
+    volumes = {"opacity": unit_values(dims), "uncertainty": unit_values(dims)[::-1].copy()}
+    metadata = {"uncertainty": {"normalization_min": 0.5, "normalization_max": 2.0}}
+    file_prefix = str(tmp_path / "volume")
+    write_volumes(volumes, file_prefix, dims, origin, spacing, metadata=metadata, quantize=quantize)
+
+    fields = read_volume_fields(file_prefix + ".vti")
+    for name, values in volumes.items():
+        volume, _ = fields[name]
+        # opacity is always stored as uint16
+        dtype = np.uint16 if name == "opacity" else np.dtype(quantize).type
+        assert volume_to_numpy(volume).dtype == dtype
+
+        scale, offset = volume_quantization(volume)
+        assert scale == pytest.approx(1.0 / np.iinfo(dtype).max) and offset == 0.0
+        read_values = volume_values(volume)
+        assert read_values.dtype == np.float32
+        assert np.all(np.abs(read_values - values) <= scale + 1e-7)
+        assert np.array_equal(read_values == 0, values == 0)
+        assert stored_value(1.0, volume) == pytest.approx(np.iinfo(dtype).max)
+
+    # the other metadata is kept next to the quantization
+    uncertainty, _ = fields["uncertainty"]
+    assert volume_metadata(uncertainty)["normalization_min"] == 0.5
+    assert volume_metadata(uncertainty)["normalization_max"] == 2.0
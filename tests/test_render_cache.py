@@ -0,0 +1,90 @@
+import os
+import time
+
+import numpy as np
+
+from helpers.render_cache import RenderCache, render_cache_key
+
+SETTINGS = {'checkpoint': 'checkpoint9.ckpt', 'size': [8, 8], 'num_coarse': 16}
+
+
+def pose(angle=0.0, distance=4.0):
+    # camera-to-world pose rotated by `angle` degrees about the y axis, at `distance` from the origin
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    return np.array([
+        [c, 0.0, s, distance * s],
+        [0.0, 1.0, 0.0, 0.0],
+        [-s, 0.0, c, distance * c],
+        [0.0, 0.0, 0.0, 1.0],
+    ])
+
+
+def view(value):
+    return {'image': np.full((8, 8, 3), value, dtype=np.float32), 'depth': np.full((8, 8), value, dtype=np.float64)}
+
+
+def test_nearby_poses_share_a_key():
+    key = render_cache_key(pose(), 10.0, SETTINGS)
+    # well below the 1 degree, 0.05 and 1 pixel steps
+    assert render_cache_key(pose(angle=0.1, distance=4.005), 10.2, SETTINGS) == key
+    assert render_cache_key(pose(angle=5.0), 10.0, SETTINGS) != key
+    assert render_cache_key(pose(distance=4.5), 10.0, SETTINGS) != key
+    assert render_cache_key(pose(), 12.0, SETTINGS) != key
+    assert render_cache_key(pose(), 10.0, {**SETTINGS, 'num_coarse': 32}) != key
+    # coarser steps merge the distant poses too
+    assert render_cache_key(pose(angle=5.0, distance=4.5), 10.0, SETTINGS, angle_step=30.0, distance_step=2.0) \
+        == render_cache_key(pose(), 10.0, SETTINGS, angle_step=30.0, distance_step=2.0)
+
+
+def test_hits_and_misses():
+    cache = RenderCache()
+    cache.put(render_cache_key(pose(), 10.0, SETTINGS), view(1.0))
+    hit = cache.get(render_cache_key(pose(angle=0.1), 10.0, SETTINGS))
+    assert hit is not None and np.all(hit['image'] == 1.0)
+    assert cache.get(render_cache_key(pose(angle=20.0), 10.0, SETTINGS)) is None
+
+    cache.clear()
+    assert cache.get(render_cache_key(pose(), 10.0, SETTINGS)) is None
+
+
+def test_memory_evicts_least_recently_used():
+    cache = RenderCache(max_entries=2)
+    cache.put('a', view(1.0))
+    cache.put('b', view(2.0))
+    # a is used again, so b is the least recently used view when c comes in
+    assert cache.get('a') is not None
+    cache.put('c', view(3.0))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert list(cache.entries) == ['a', 'c']
+
+
+def test_disk_round_trip(tmp_path):
+    cache_dir = str(tmp_path / 'views')
+    RenderCache(cache_dir=cache_dir).put('a', view(0.25))
+
+    # a later session finds the view on disk, with its arrays unchanged, and keeps it in memory
+    cache = RenderCache(cache_dir=cache_dir)
+    cached = cache.get('a')
+    assert set(cached) == {'image', 'depth'}
+    for name, array in view(0.25).items():
+        assert cached[name].dtype == array.dtype and np.array_equal(cached[name], array)
+    assert 'a' in cache.entries
+    assert os.listdir(cache_dir) == ['a.npz']
+
+
+def test_disk_evicts_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path / 'views')
+    cache = RenderCache(cache_dir=cache_dir)
+    cache.put('a', view(1.0))
+    file_size = os.path.getsize(cache.file_name('a'))
+    cache.put('b', view(2.0))
+    now = time.time()
+    os.utime(cache.file_name('a'), (now - 200, now - 200))
+    os.utime(cache.file_name('b'), (now - 100, now - 100))
+
+    # a hit on disk makes a the most recently used file, so b goes once a third view does not fit
+    cache = RenderCache(cache_dir=cache_dir, max_disk_bytes=2 * file_size)
+    assert cache.get('a') is not None
+    cache.put('c', view(3.0))
+    assert sorted(os.listdir(cache_dir)) == ['a.npz', 'c.npz']
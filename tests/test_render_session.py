@@ -0,0 +1,96 @@
+import types
+
+import numpy as np
+import torch
+import yaml
+
+import eval_nerf
+from nerf import BakedGrid, CfgNode, models
+
+
+def make_scene(data_path, iteration=10):
+    # a small random nn checkpoint with the chair config, as the viewer finds it under its data path
+    with open('datasets/chair/nn/full/config.yml', 'r') as f:
+        cfg_dict = yaml.load(f, Loader=yaml.FullLoader)
+    for level in ('coarse', 'fine'):
+        cfg_dict['models'][level].update(num_layers=2, hidden_size=16)
+    cfg_dict['nerf']['validation'].update(num_coarse=16, num_fine=16)
+    data_path.mkdir(parents=True, exist_ok=True)
+    with open(data_path / 'config.yml', 'w') as f:
+        yaml.dump(cfg_dict, f)
+
+    cfg = CfgNode(cfg_dict)
+    torch.manual_seed(0)
+    checkpoint = {}
+    for level in ('coarse', 'fine'):
+        cfg_model = getattr(cfg.models, level)
+        model = models.FlexibleNeRFModel(
+            num_layers=cfg_model.num_layers,
+            hidden_size=cfg_model.hidden_size,
+            skip_connect_every=cfg_model.skip_connect_every,
+            num_encoding_fn_xyz=cfg_model.num_encoding_fn_xyz,
+            num_encoding_fn_dir=cfg_model.num_encoding_fn_dir,
+            model_type='nn',
+        )
+        checkpoint[f'model_{level}_state_dict'] = model.state_dict()
+    torch.save(checkpoint, data_path / f'checkpoint{iteration - 1}.ckpt')
+
+    return types.SimpleNamespace(
+        data_path=str(data_path),
+        model_type='nn',
+        iterations=iteration,
+        early_termination=0.0,
+        precision='fp32',
+        inference_graph='None',
+        empty_space_skipping='None',
+        opacity_volume=None,
+    )
+
+
+def render(session):
+    pose = eval_nerf.render_pose(4.0, torch.eye(4).numpy())
+    return session.render(pose, 8, 8, 12.0)
+
+
+def test_empty_space_skipping_turned_off_on_a_cached_session(tmp_path):
+    eval_nerf.render_sessions.clear()
+    data = make_scene(tmp_path / 'scene')
+    reference = render(eval_nerf.render_session(data))
+
+    data.empty_space_skipping = 'probe'
+    session = eval_nerf.render_session(data)
+    assert session.occupancy_grid is not None
+    render(session)
+
+    data.empty_space_skipping = 'None'
+    assert eval_nerf.render_session(data) is session
+    assert session.occupancy_grid is None
+    assert session.occupancy_grid_key is None
+    assert torch.equal(render(session), reference)
+    eval_nerf.render_sessions.clear()
+
+
+def test_baked_view_uses_the_scene_dataset_type(tmp_path, monkeypatch):
+    data = make_scene(tmp_path / 'scene')
+    # a scene that is not a blender one, so the type is read from its config
+    config_file = tmp_path / 'scene' / 'config.yml'
+    cfg_dict = yaml.load(config_file.read_text(), Loader=yaml.FullLoader)
+    cfg_dict['dataset']['type'] = 'LLFF'
+    config_file.write_text(yaml.dump(cfg_dict))
+    baked_file = str(tmp_path / 'scene' / 'baked.npz')
+    BakedGrid((4, 4, 4), (-1.0, -1.0, -1.0), (0.5, 0.5, 0.5), np.arange(64), np.ones((64, 4), dtype=np.float32)).save(baked_file)
+    data.baked_grid_file_name = lambda: baked_file
+    data.baked_image_size, data.baked_num_samples = 8, 16
+
+    # the dataset type the image is cast with
+    dataset_types = []
+    original_cast_to_image = eval_nerf.cast_to_image
+    def cast_to_image(tensor, dataset_type):
+        dataset_types.append(dataset_type)
+        return original_cast_to_image(tensor, dataset_type)
+    monkeypatch.setattr(eval_nerf, 'cast_to_image', cast_to_image)
+
+    (image,) = eval_nerf.render_baked_passes(4.0, np.eye(4), 12.0, data)
+    assert image.shape == (8, 8, 3) and image.dtype == np.uint8
+    assert dataset_types == [eval_nerf.scene_dataset_type(data)] == ['llff']
+    eval_nerf.baked_grids.clear()
@@ -0,0 +1,165 @@
+import math
+
+import pytest
+import torch
+import yaml
+
+from nerf import CfgNode, get_embedding_function, get_ray_bundle, get_ray_bundles, models
+from nerf.train_utils import (predict_and_render_radiance, run_network, run_network_secondary, run_one_iter_of_nerf,
+                              run_poses_of_nerf)
+from nerf.volume_rendering_utils import volume_render_radiance_field
+
+
+class SlabField(torch.nn.Module):
+    r"""Radiance field on the sample positions: empty up to z = 0 and `density` behind it, but only for x > 0,
+    so the rays with x < 0 never saturate. Counts the samples it evaluates.
+    """
+    def __init__(self, density):
+        super().__init__()
+        self.density = density
+        self.num_samples = 0
+
+    def forward(self, x):
+        self.num_samples += x.shape[0]
+        sigma = self.density * ((x[:, 2] > 0) & (x[:, 0] > 0)).float()
+        return torch.cat((x, sigma[:, None], torch.zeros_like(sigma[:, None])), dim=-1)
+
+
+def identity(x):
+    return x
+
+
+def make_rays(num_rays=8, num_samples=64):
+    # rays along +z from z = -1, half of them with x < 0
+    ro = torch.stack((torch.linspace(-0.5, 0.5, num_rays), torch.zeros(num_rays), -torch.ones(num_rays)), dim=-1)
+    rd = torch.tensor([0.0, 0.0, 1.0]).expand(num_rays, 3)
+    near, far = torch.zeros(num_rays, 1), 2 * torch.ones(num_rays, 1)
+    ray_batch = torch.cat((ro, rd, near, far, rd), dim=-1)
+    z_vals = torch.linspace(0.0, 2.0, num_samples).expand(num_rays, num_samples)
+    pts = ro[..., None, :] + rd[..., None, :] * z_vals[..., :, None]
+    return ray_batch, z_vals, pts, ro[:, 0] > 0
+
+
+def test_terminated_rays_match_dense_evaluation():
+    ray_batch, z_vals, pts, opaque = make_rays()
+    network_fn = SlabField(50.0)
+    dense = run_network(network_fn, pts, ray_batch, 1024, identity, None)
+    num_dense_samples, network_fn.num_samples = network_fn.num_samples, 0
+    terminated = run_network(network_fn, pts, ray_batch, 1024, identity, None, z_vals=z_vals, early_termination=1e-3)
+
+    # the rays that never saturate are evaluated exactly as before
+    assert torch.equal(terminated[~opaque], dense[~opaque])
+    # the others stop in the segment of samples 32 to 47 that reaches the surface at z = 0
+    assert network_fn.num_samples < num_dense_samples
+    assert torch.all(terminated[opaque, 48:] == 0)
+
+    rgb, _, acc, _, _ = volume_render_radiance_field(dense, z_vals, ray_batch[:, 3:6])
+    rgb_terminated, _, acc_terminated, _, _ = volume_render_radiance_field(terminated, z_vals, ray_batch[:, 3:6])
+    assert torch.allclose(rgb_terminated, rgb, atol=1e-3)
+    assert torch.allclose(acc_terminated, acc, atol=1e-3)
+
+
+@pytest.mark.parametrize("densities", [(50.0, 50.0), (50.0, 0.0)])
+def test_terminated_secondary_models(densities):
+    ray_batch, z_vals, pts, opaque = make_rays()
+    network_fns = [SlabField(density) for density in densities]
+    dense = run_network_secondary(network_fns, pts, ray_batch, 1024, identity, None)
+    terminated = run_network_secondary(network_fns, pts, ray_batch, 1024, identity, None, z_vals=z_vals, early_termination=1e-3)
+    assert terminated.shape == dense.shape
+
+    if 0.0 in densities:
+        # a ray keeps going while any member still sees through
+        assert torch.equal(terminated, dense)
+    else:
+        assert torch.equal(terminated[:, ~opaque], dense[:, ~opaque])
+        assert torch.all(terminated[:, opaque, 48:] == 0)
+        rgb = volume_render_radiance_field(dense, z_vals, ray_batch[:, 3:6])[0]
+        rgb_terminated = volume_render_radiance_field(terminated, z_vals, ray_batch[:, 3:6])[0]
+        assert torch.allclose(rgb_terminated, rgb, atol=1e-3)
+
+
+def test_coarse_and_fine_rays_terminate():
+    ray_batch, _, _, _ = make_rays()
+    options = CfgNode({"nerf": {"validation": {
+        "num_coarse": 64, "num_fine": 64, "lindisp": False, "perturb": 0.0, "chunksize": 1024,
+        "radiance_field_noise_std": 0.0, "white_background": False,
+    }}})
+
+    def render(early_termination):
+        model_coarse, model_fine = SlabField(50.0), SlabField(50.0)
+        outputs = predict_and_render_radiance(ray_batch, model_coarse, model_fine, [], [], options, mode="validation",
+                                              encode_position_fn=identity, early_termination=early_termination)
+        return outputs, model_coarse.num_samples, model_fine.num_samples
+
+    dense, num_coarse, num_fine = render(0.0)
+    terminated, num_coarse_terminated, num_fine_terminated = render(1e-3)
+    assert num_coarse_terminated < num_coarse
+    assert num_fine_terminated < num_fine
+    # rgb, disparity and accumulation of both levels; the disparity of the empty rays is nan in both
+    for output, output_terminated in zip(dense[:6], terminated[:6]):
+        assert torch.allclose(output_terminated, output, atol=1e-3, equal_nan=True)
+
+
+def orbit_pose(angle, distance=4.0):
+    # camera-to-world pose on a circle around the y axis, looking at the origin
+    c, s = math.cos(angle), math.sin(angle)
+    return torch.tensor([
+        [c, 0.0, s, distance * s],
+        [0.0, 1.0, 0.0, 0.0],
+        [-s, 0.0, c, distance * c],
+        [0.0, 0.0, 0.0, 1.0],
+    ])
+
+
+def test_packed_poses_match_one_render_per_pose():
+    # small random nn models with the chair config; the chunks hold 7 rays, so most of them mix two poses
+    with open('datasets/chair/nn/full/config.yml', 'r') as f:
+        cfg = CfgNode(yaml.load(f, Loader=yaml.FullLoader))
+    cfg.nerf.validation.update(num_coarse=16, num_fine=16, chunksize=7)
+    torch.manual_seed(0)
+    model_coarse, model_fine = [
+        models.FlexibleNeRFModel(
+            num_layers=2,
+            hidden_size=16,
+            skip_connect_every=cfg_model.skip_connect_every,
+            num_encoding_fn_xyz=cfg_model.num_encoding_fn_xyz,
+            num_encoding_fn_dir=cfg_model.num_encoding_fn_dir,
+            include_input_xyz=cfg_model.include_input_xyz,
+            include_input_dir=cfg_model.include_input_dir,
+            use_viewdirs=cfg_model.use_viewdirs,
+            model_type='nn',
+        )
+        for cfg_model in (cfg.models.coarse, cfg.models.fine)
+    ]
+    encode_position_fn = get_embedding_function(
+        num_encoding_functions=cfg.models.coarse.num_encoding_fn_xyz,
+        include_input=cfg.models.coarse.include_input_xyz,
+        log_sampling=cfg.models.coarse.log_sampling_xyz,
+    )
+    encode_direction_fn = get_embedding_function(
+        num_encoding_functions=cfg.models.coarse.num_encoding_fn_dir,
+        include_input=cfg.models.coarse.include_input_dir,
+        log_sampling=cfg.models.coarse.log_sampling_dir,
+    )
+
+    height, width = 5, 6
+    poses = torch.stack([orbit_pose(angle) for angle in (0.0, 0.5, 2.0)])
+    focal_lengths = torch.tensor([6.0, 8.0, 10.0])
+
+    with torch.no_grad():
+        ray_origins, ray_directions = get_ray_bundles(height, width, focal_lengths, poses)
+        images = run_poses_of_nerf(height, width, focal_lengths, poses, model_coarse, model_fine, cfg,
+                                   encode_position_fn=encode_position_fn, encode_direction_fn=encode_direction_fn)
+        assert images.shape == (3, height, width, 3)
+
+        for i in range(poses.shape[0]):
+            focal_length = focal_lengths[i].item()
+            pose_origins, pose_directions = get_ray_bundle(height, width, focal_length, poses[i])
+            assert torch.allclose(ray_origins[i], pose_origins)
+            assert torch.allclose(ray_directions[i], pose_directions, atol=1e-6)
+
+            outputs = run_one_iter_of_nerf(height, width, focal_length, model_coarse, model_fine, [], [],
+                                           pose_origins, pose_directions, cfg, mode="validation",
+                                           encode_position_fn=encode_position_fn,
+                                           encode_direction_fn=encode_direction_fn, model_type='nn')
+            assert torch.allclose(images[i], outputs[3], atol=1e-5)
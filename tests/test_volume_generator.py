@@ -0,0 +1,122 @@
+import json
+
+import numpy as np
+import pytest
+import torch
+import yaml
+
+import volume_generator
+from helpers.grid import block_batches, grid_num_points, normalize_min_max, occupied_blocks
+from nerf import CfgNode, models
+from volume_generator import evaluate_grid, evaluate_grid_out_of_core, finalize_out_of_core, load_models, occupancy_mask
+
+
+def make_models(tmp_path, model_type):
+    # small random fine models with the chair config, loaded from a checkpoint as volume_generator does
+    with open(f'datasets/chair/{model_type}/full/config.yml', 'r') as f:
+        cfg_dict = yaml.load(f, Loader=yaml.FullLoader)
+    cfg_dict['models']['fine'].update(num_layers=2, hidden_size=16)
+    if model_type == 'ensemble':
+        cfg_dict['models_secondary']['fine'].update(num_layers=2, hidden_size=16)
+        cfg_dict['experiment']['num_models_secondary'] = 2
+    cfg = CfgNode(cfg_dict)
+
+    torch.manual_seed(0)
+    def fine_model(cfg_model):
+        return models.FlexibleNeRFModel(
+            num_layers=cfg_model.num_layers,
+            hidden_size=cfg_model.hidden_size,
+            skip_connect_every=cfg_model.skip_connect_every,
+            num_encoding_fn_xyz=cfg_model.num_encoding_fn_xyz,
+            num_encoding_fn_dir=cfg_model.num_encoding_fn_dir,
+            model_type=model_type,
+        )
+    checkpoint = {'model_fine_state_dict': fine_model(cfg.models.fine).state_dict()}
+    if model_type == 'ensemble':
+        checkpoint['model_fine_secondary_state_dict'] = [fine_model(cfg.models_secondary.fine).state_dict() for _ in range(2)]
+    checkpoint_file = str(tmp_path / 'checkpoint.ckpt')
+    torch.save(checkpoint, checkpoint_file)
+
+    model_fine, fine_model_secondary_list = load_models(cfg, model_type, checkpoint_file)
+    return cfg, model_fine, fine_model_secondary_list
+
+
+def point_blocks(dims, block_size):
+    # block index (z, y, x) of every grid point, in vtk point order
+    k, j, i = np.meshgrid(*(np.arange(n) // block_size for n in dims[::-1]), indexing='ij')
+    return k.ravel(), j.ravel(), i.ravel()
+
+
+@pytest.mark.parametrize('model_type', ['nn', 'ensemble'])
+def test_adaptive_grid_not_divided_by_blocks(tmp_path, model_type):
+    cfg, model_fine, fine_model_secondary_list = make_models(tmp_path, model_type)
+    dims, origin, spacing = (30, 30, 30), (-1.0, -1.0, -1.0), (2.0 / 29, 2.0 / 29, 2.0 / 29)
+    block_size = 8
+
+    # 30 points per axis: 4 blocks, the last one only 6 points deep
+    assert occupancy_mask(model_fine, cfg, dims, origin, spacing, block_size).shape == (4, 4, 4)
+
+    # geometry at two probe corners: the first block and the partial block in the far corner
+    probe_sigma = np.zeros(5 ** 3, dtype=np.float32)
+    probe_sigma[0] = probe_sigma[-1] = 10.0
+    block_mask = occupied_blocks(probe_sigma, (4, 4, 4), dilation=0)
+    assert block_mask.sum() == 2 and block_mask[0, 0, 0] and block_mask[3, 3, 3]
+
+    # every point of the occupied blocks is yielded exactly once
+    batches = list(block_batches(block_mask, dims, block_size, batch_size=100))
+    point_ids = torch.cat(batches).numpy()
+    assert len(np.unique(point_ids)) == len(point_ids) == 8 ** 3 + 6 ** 3
+
+    dense = evaluate_grid(model_fine, fine_model_secondary_list, cfg, model_type, dims, origin, spacing, batch_size=100, progress=False)
+    adaptive = evaluate_grid(model_fine, fine_model_secondary_list, cfg, model_type, dims, origin, spacing, batches=batches, progress=False)
+
+    occupied = block_mask.numpy()[point_blocks(dims, block_size)]
+    assert np.array_equal(np.flatnonzero(occupied), np.sort(point_ids))
+    assert occupied.shape == (grid_num_points(dims),)
+    for name in dense:
+        assert np.allclose(adaptive[name][occupied], dense[name][occupied], atol=1e-6)
+        assert np.all(adaptive[name][~occupied] == 0)
+        # the random models put density everywhere, so the skipped points are really left out
+        assert np.any(dense[name][~occupied] != 0)
+
+
+@pytest.mark.parametrize('model_type', ['nn', 'ensemble'])
+def test_out_of_core_resumes_after_interruption(tmp_path, monkeypatch, model_type):
+    cfg, model_fine, fine_model_secondary_list = make_models(tmp_path, model_type)
+    # 3 slabs of 8, 8 and 4 z-layers
+    dims, origin, spacing = (12, 10, 20), (-1.0, -1.0, -1.0), (0.1, 0.1, 0.1)
+    work_dir, run = str(tmp_path / 'work'), {'model_type': model_type, 'dims': list(dims)}
+    args = (model_fine, fine_model_secondary_list, cfg, model_type, dims, origin, spacing, work_dir, run)
+
+    # interrupt the run while it evaluates the third slab
+    slabs_evaluated = []
+    def interrupted_evaluate_grid(*args, **kwargs):
+        if len(slabs_evaluated) == 2:
+            raise KeyboardInterrupt
+        slabs_evaluated.append(len(slabs_evaluated))
+        return evaluate_grid(*args, **kwargs)
+    monkeypatch.setattr(volume_generator, 'evaluate_grid', interrupted_evaluate_grid)
+    with pytest.raises(KeyboardInterrupt):
+        evaluate_grid_out_of_core(*args, batch_size=64, slab_depth=8)
+    with open(tmp_path / 'work' / 'progress.json', 'r') as f:
+        assert json.load(f)['finished_slabs'] == 2
+
+    # the resumed run only evaluates the last slab
+    resumed_slabs = []
+    def counted_evaluate_grid(*args, **kwargs):
+        resumed_slabs.append(len(resumed_slabs))
+        return evaluate_grid(*args, **kwargs)
+    monkeypatch.setattr(volume_generator, 'evaluate_grid', counted_evaluate_grid)
+    outputs, outputs_min, outputs_max = evaluate_grid_out_of_core(*args, batch_size=64, slab_depth=8)
+    assert len(resumed_slabs) == 1
+
+    dense = evaluate_grid(model_fine, fine_model_secondary_list, cfg, model_type, dims, origin, spacing, batch_size=64, progress=False)
+    for name in dense:
+        assert np.allclose(outputs[name], dense[name], atol=1e-6)
+        assert outputs_min[name] == pytest.approx(float(np.min(dense[name])))
+        assert outputs_max[name] == pytest.approx(float(np.max(dense[name])))
+
+    volumes = finalize_out_of_core(outputs, outputs_min, outputs_max, work_dir, chunk_size=dims[0] * dims[1] * 8)
+    assert np.allclose(volumes['opacity'], 1.0 - np.exp(-dense['sigma']), atol=1e-6)
+    for name in list(dense)[1:]:
+        assert np.allclose(volumes[name], normalize_min_max(dense[name].copy()), atol=1e-5)
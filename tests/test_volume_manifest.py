@@ -0,0 +1,51 @@
+import glob
+import os
+import textwrap
+
+import pytest
+import yaml
+
+import volume_generator
+from volume_generator import job_option_defaults, job_options, load_volume_manifest, volume_options, volume_output_files
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_manifest(tmp_path, manifest):
+    manifest_file = tmp_path / "volumes.yml"
+    manifest_file.write_text(manifest if isinstance(manifest, str) else yaml.safe_dump(manifest))
+    return str(manifest_file)
+
+
+def test_docstring_manifest(tmp_path, monkeypatch):
+    # the example ends the docstring of load_volume_manifest
+    example = textwrap.dedent(load_volume_manifest.__doc__.rsplit("\n\n", 1)[1])
+    monkeypatch.chdir(REPO_DIR)
+    jobs = load_volume_manifest(write_manifest(tmp_path, example))
+
+    num_configs = len(glob.glob("datasets/*/*/*.yml"))
+    assert num_configs > 0
+    assert len(jobs) == num_configs + 3
+
+    for job in jobs:
+        options = volume_options(job_options(job), defaults=job_option_defaults(job))
+        assert options["xyzNumPoint"] == (256 if job is jobs[num_configs] else 128)
+        assert len(volume_output_files(job)) > 0
+
+    # pyramid_levels is a default of the volume jobs only
+    assert all(job["pyramid_levels"] == 2 for job in jobs[: num_configs + 1])
+    series_job, bake_job = jobs[num_configs + 1 :]
+    assert job_option_defaults(series_job) is volume_generator.VOLUME_SERIES_OPTIONS
+    assert job_option_defaults(bake_job) is volume_generator.BAKE_OPTIONS
+    assert "pyramid_levels" not in series_job and "pyramid_levels" not in bake_job
+
+
+def test_unknown_default_is_reported(tmp_path):
+    manifest = {
+        "defaults": {"pyramid_levels": 1, "pyramid_level": 1},
+        "jobs": [{"scene": "chair", "dataset": "full", "model_type": "nn", "iteration": 10, "bake": True}],
+    }
+    (job,) = load_volume_manifest(write_manifest(tmp_path, manifest))
+    assert "pyramid_levels" not in job
+    with pytest.raises(ValueError, match="pyramid_level;"):
+        volume_options(job_options(job), defaults=job_option_defaults(job))
@@ -9,6 +9,10 @@ import torch
 import argparse
 import sys
 import os
+import shutil
+import multiprocessing
+import json
+import glob
 import time
 from datetime import datetime
 import pdb
@@ -87,27 +91,35 @@ import math
 import yaml
 #import simplejson
 
-from scipy.spatial.distance import pdist, squareform
+from nerf import (CfgNode, models, helpers, inference_autocast, inference_graph, InferenceGraph, OccupancyGrid, BakedGrid)
+from nerf.metrics import ensemble_disagreement
+from helpers.grid import (grid_spacing, fit_grid_bounds, isotropic_grid, grid_num_points, grid_points, encode_grid_points, encoded_grid, grid_batches, normalize_min_max, quantize_unit_interval, occupied_blocks, block_batches, downsample_grid, downsample_volume)
+from helpers.vtk import volume_from_numpy, volume_from_fields, write_volume_to_vtk_file, write_volume_to_vti_file, write_volume_series_file
 
-from nerf import (CfgNode, models, helpers)
+# storage types of quantized uncertainty volumes, see write_volumes
+QUANTIZED_TYPES = {'uint8': np.uint8, 'uint16': np.uint16}
 
-def volume_generator(scene, dataset, model_type, iteration, xyzNumPoint=128):
-    xyzMin = -1.5
-    xyzMax = 1.5
-    batch_size = 2048
+def checkpoint_path(scene, dataset, model_type, iteration):
+    return f'datasets/{scene}/{model_type}/{dataset}/checkpoint{iteration-1}.ckpt'
+
+def volume_file_prefix(scene, dataset, model_type, iteration):
+    return f'datasets/{scene}/{model_type}/{dataset}/{scene}_{dataset}_{iteration}'
 
+def load_volume_models(scene, dataset, model_type, iteration):
+    # config and models of a checkpoint, as passed to volume_generator(models=...)
     config = f'datasets/{scene}/{model_type}/{dataset}/config.yml'
-    load_checkpoint = f'datasets/{scene}/{model_type}/{dataset}/checkpoint{iteration-1}.ckpt'
 
     # Read config file.
-    cfg = None
     with open(config, "r") as f:
         cfg_dict = yaml.load(f, Loader=yaml.FullLoader)
-        cfg = CfgNode(cfg_dict)
 
     # clear memory in GPU CUDA
     torch.cuda.empty_cache()
 
+    model_fine, fine_model_secondary_list = load_models(CfgNode(cfg_dict), model_type, checkpoint_path(scene, dataset, model_type, iteration))
+    return cfg_dict, model_fine, fine_model_secondary_list
+
+def load_models(cfg, model_type, load_checkpoint):
     model_fine = models.FlexibleNeRFModel(
         cfg.models.fine.num_layers,
         cfg.models.fine.hidden_size,
@@ -117,204 +129,821 @@ def volume_generator(scene, dataset, model_type, iteration, xyzNumPoint=128):
         model_type=model_type,
     )
 
+    # the secondary models share one architecture, so they are stacked and evaluated together
     fine_model_secondary_list = []
     if model_type == 'ensemble':
-        for i in range(cfg.experiment.num_models_secondary):
-            model_fine_secondary = models.FlexibleNeRFModel(
-                cfg.models_secondary.fine.num_layers,
-                cfg.models_secondary.fine.hidden_size,
-                cfg.models_secondary.fine.skip_connect_every,
-                cfg.models_secondary.fine.num_encoding_fn_xyz,
-                cfg.models_secondary.fine.num_encoding_fn_dir,
-                model_type=model_type,
-            )
-            fine_model_secondary_list.append(model_fine_secondary)
+        fine_model_secondary_list = models.EnsembleFlexibleNeRFModel(
+            cfg.experiment.num_models_secondary,
+            cfg.models_secondary.fine.num_layers,
+            cfg.models_secondary.fine.hidden_size,
+            cfg.models_secondary.fine.skip_connect_every,
+            cfg.models_secondary.fine.num_encoding_fn_xyz,
+            cfg.models_secondary.fine.num_encoding_fn_dir,
+            model_type=model_type,
+        )
+
+    load_checkpoint_weights(model_fine, fine_model_secondary_list, model_type, load_checkpoint)
+    
+    model_fine.eval()
+    if model_type == 'ensemble':
+        fine_model_secondary_list.eval()
 
+    return model_fine, fine_model_secondary_list
+
+def load_checkpoint_weights(model_fine, fine_model_secondary_list, model_type, load_checkpoint):
+    # load a checkpoint into models that were already built, e.g. the next checkpoint of a series
     if os.path.exists(load_checkpoint):
         checkpoint = torch.load(load_checkpoint, weights_only=True)
         model_fine.load_state_dict(checkpoint["model_fine_state_dict"])
-        
-        for i, fine_model_secondary in enumerate(fine_model_secondary_list):
-            fine_model_secondary.load_state_dict(checkpoint["model_fine_secondary_state_dict"][i])
+
+        if model_type == 'ensemble':
+            fine_model_secondary_list.load_state_dict_list(checkpoint["model_fine_secondary_state_dict"], name="model_fine_secondary_state_dict")
     else:
         sys.exit("Please enter the path of the checkpoint file.")
-    
-    model_fine.eval()
+
+def inference_graph_models(model_fine, fine_model_secondary_list, cfg, mode):
+    # the models as graphs that encode the grid points themselves, see nerf.inference_graph
+    model_fine = inference_graph(model_fine, cfg.models.fine, mode=mode, inputs='points')
+    if len(fine_model_secondary_list) > 0:
+        fine_model_secondary_list = inference_graph(fine_model_secondary_list, cfg.models.fine, mode=mode, inputs='points')
+    return model_fine, fine_model_secondary_list
+
+def output_names(model_type):
     if model_type == 'ensemble':
-        for i in range(cfg.experiment.num_models_secondary):
-            fine_model_secondary_list[i].eval()
-    
-    include_input_xyz = 3 if cfg.models.fine.include_input_xyz else 0
-    include_input_dir = 3 if cfg.models.fine.include_input_dir else 0
-    dim_xyz = include_input_xyz + 2 * 3 * cfg.models.fine.num_encoding_fn_xyz
-    dim_dir = include_input_dir + 2 * 3 * cfg.models.fine.num_encoding_fn_dir
-    if not cfg.models.fine.use_viewdirs:
-        dim_dir = 0
+        return ['sigma', 'uncertainty_color', 'uncertainty_density']
+    return ['sigma', 'uncertainty']
+
+def evaluate_density(model_fine, cfg, dims, origin, spacing, batch_size=2048):
+    # density of the main model only, e.g. to probe where the object is
+    npoints = grid_num_points(dims)
+    sigma = np.zeros(npoints, dtype=np.float32)
+    with torch.no_grad():
+        for indices in grid_batches(npoints, batch_size):
+            xyz_tensor = grid_points(indices, dims, origin, spacing)
+            output = model_fine(encode_grid_points(xyz_tensor, cfg.models.fine))
+            sigma[indices.numpy()] = torch.nn.functional.relu(output[:, 3]).numpy()
+    return sigma
+
+def evaluate_grid(model_fine, fine_model_secondary_list, cfg, model_type, dims, origin, spacing, batch_size=2048, uncertainty_metric='pairwise', batches=None, num_batches=None, outputs=None, offset=0, progress=True, encoding=None, precision='fp32'):
+    r"""Stream the grid through the models in fixed-size batches.
+
+    The network outputs are written straight into preallocated float32 arrays, indexed by vtk point id:
+    `sigma` for the main model, `uncertainty` for the nn model and `uncertainty_color` / `uncertainty_density`
+    for the ensemble. The ensemble uncertainties are reduced over the members (main model and secondary models)
+    batch by batch, see `nerf.metrics.ensemble_disagreement`.
+
+    `batches` yields the point ids to evaluate (default: the whole grid); points that are never yielded keep
+    zero density and zero uncertainty. `outputs` can hold arrays to write into instead, e.g. memory-mapped ones
+    or the arrays of one slab, whose first element is point id `offset`. With an `encoding` (see
+    `helpers.grid.EncodedGrid`) the network inputs are read from it instead of being encoded batch by batch.
+    The networks run in `precision` (see `nerf.inference_autocast`), the uncertainties are reduced in fp32.
+    Models exported with `inference_graph_models` are passed the grid points, which they encode themselves.
+    """
+    npoints = grid_num_points(dims)
+    if batches is None:
+        batches = grid_batches(npoints, batch_size)
+        num_batches = int(np.ceil(npoints / batch_size))
+
+    if outputs is None:
+        outputs = {name: np.zeros(npoints, dtype=np.float32) for name in output_names(model_type)}
+
+    with torch.no_grad(), inference_autocast(precision):
+        for indices in tqdm(batches, total=num_batches, disable=not progress):
+            point_ids = indices.numpy() - offset
+
+            if isinstance(model_fine, InferenceGraph):
+                tensor_input = grid_points(indices, dims, origin, spacing)
+            elif encoding is not None:
+                tensor_input = encoding.batch(indices)
+            else:
+                xyz_tensor = grid_points(indices, dims, origin, spacing)
+                tensor_input = encode_grid_points(xyz_tensor, cfg.models.fine)
+
+            output = model_fine(tensor_input).float() # [R, G, B, sigma] ###
+            sigma = torch.nn.functional.relu(output[:, 3])
+            outputs['sigma'][point_ids] = sigma.numpy()
+
+            if model_type == 'ensemble':
+                member_colors = [torch.sigmoid(output[:, :3])]
+                member_sigmas = [sigma[:, None]]
+
+                if len(fine_model_secondary_list) > 0:
+                    outputs_secondary = fine_model_secondary_list(tensor_input).float()       # [K, R, [R, G, B, sigma]]
+                    member_colors += list(torch.sigmoid(outputs_secondary[..., :3]))
+                    member_sigmas += list(torch.nn.functional.relu(outputs_secondary[..., 3:4]))
+
+                member_colors = torch.stack(member_colors, dim=0)    # [M, R, 3]
+                member_sigmas = torch.stack(member_sigmas, dim=0)    # [M, R, 1]
+                outputs['uncertainty_color'][point_ids] = ensemble_disagreement(member_colors, uncertainty_metric).numpy()
+                outputs['uncertainty_density'][point_ids] = ensemble_disagreement(member_sigmas, uncertainty_metric).numpy()
+            else:
+                outputs['uncertainty'][point_ids] = torch.nn.functional.relu(output[:, 4]).numpy()
+
+    return outputs
+
+def slab_batches(slab, dims, slab_depth, batch_size, block_mask=None):
+    r"""First and last + 1 point id of a z-slab and the batches that evaluate it. With a `block_mask` (adaptive
+    mode) the slab is one z-slab of blocks and only its occupied blocks are evaluated.
+    """
+    slab_points = dims[0] * dims[1] * slab_depth
+    start, stop = slab * slab_points, min((slab + 1) * slab_points, grid_num_points(dims))
+    if block_mask is None:
+        return start, stop, grid_batches(stop, batch_size, start=start)
+    return start, stop, block_batches(block_mask, dims, slab_depth, batch_size, block_rows=[slab])
+
+# state of a slab worker process, set up once by init_slab_worker
+slab_worker = {}
+
+def init_slab_worker(cfg_dict, model_type, load_checkpoint, num_threads, grid):
+    torch.set_num_threads(num_threads)
+    cfg = CfgNode(cfg_dict)
+    model_fine, fine_model_secondary_list = load_models(cfg, model_type, load_checkpoint)
+    if grid['inference_graph'] != 'None':
+        model_fine, fine_model_secondary_list = inference_graph_models(model_fine, fine_model_secondary_list, cfg, grid['inference_graph'])
+    slab_worker.update(grid, cfg=cfg, model_type=model_type, model_fine=model_fine, fine_model_secondary_list=fine_model_secondary_list)
+    # a memory-mapped grid encoding is opened, not encoded again, as the parent wrote it already
+    encoding = None
+    if grid['encoding_cache_dir'] is not None:
+        encoding = encoded_grid(grid['dims'], grid['origin'], grid['spacing'], cfg.models.fine, cache_dir=grid['encoding_cache_dir'])
+    slab_worker['encoding'] = encoding
+
+def evaluate_slab(slab):
+    w = slab_worker
+    start, stop, batches = slab_batches(slab, w['dims'], w['slab_depth'], w['batch_size'], w['block_mask'])
+    outputs = {name: np.zeros(stop - start, dtype=np.float32) for name in output_names(w['model_type'])}
+    evaluate_grid(w['model_fine'], w['fine_model_secondary_list'], w['cfg'], w['model_type'], w['dims'], w['origin'], w['spacing'], batch_size=w['batch_size'], uncertainty_metric=w['uncertainty_metric'], batches=batches, outputs=outputs, offset=start, progress=False, encoding=w['encoding'], precision=w['precision'])
+    return slab, outputs
+
+def slab_pool(num_workers, cfg_dict, model_type, load_checkpoint, grid, threads_per_worker=None):
+    r"""Process pool whose workers each load the models once and evaluate z-slabs with `evaluate_slab`.
+
+    Every worker runs torch with `threads_per_worker` threads (default: the cores divided over the workers), as
+    a few processes with few threads each scale better on small batches than one process with many threads.
+    `grid` holds the keyword arguments of the slabs: dims, origin, spacing, slab_depth, block_mask, batch_size,
+    uncertainty_metric, encoding_cache_dir, precision and inference_graph.
+    """
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+    # spawn instead of fork: a forked copy of torch's thread pool can deadlock
+    context = multiprocessing.get_context('spawn')
+    return context.Pool(num_workers, initializer=init_slab_worker, initargs=(cfg_dict, model_type, load_checkpoint, threads_per_worker, grid))
+
+def evaluate_grid_parallel(pool, model_type, dims, slab_depth, block_mask=None):
+    r"""Like `evaluate_grid`, but the z-slabs are evaluated by the workers of `pool` (see `slab_pool`) and
+    gathered into the output arrays as they finish.
+    """
+    npoints = grid_num_points(dims)
+    num_slabs = int(np.ceil(dims[2] / slab_depth))
+    slab_points = dims[0] * dims[1] * slab_depth
+
+    slabs = range(num_slabs)
+    if block_mask is not None:
+        slabs = [slab for slab in slabs if block_mask[slab].any()]
+
+    outputs = {name: np.zeros(npoints, dtype=np.float32) for name in output_names(model_type)}
+    for slab, slab_outputs in tqdm(pool.imap_unordered(evaluate_slab, slabs), total=len(slabs)):
+        start = slab * slab_points
+        for name, array in slab_outputs.items():
+            outputs[name][start : start + array.shape[0]] = array
+    return outputs
+
+def load_progress(work_dir, run):
+    # progress of an earlier run with the same settings, if there is one
+    progress_file = os.path.join(work_dir, 'progress.json')
+    if not os.path.exists(progress_file):
+        return None
+    with open(progress_file, "r") as f:
+        progress = json.load(f)
+    return progress if progress['run'] == run else None
+
+def save_progress(work_dir, progress):
+    # replace the file in one step, so an interrupted run never leaves a half-written progress file behind
+    progress_file = os.path.join(work_dir, 'progress.json')
+    with open(progress_file + '.tmp', "w") as f:
+        json.dump(progress, f)
+    os.replace(progress_file + '.tmp', progress_file)
+
+def open_work_array(work_dir, name, npoints, mode):
+    return np.lib.format.open_memmap(os.path.join(work_dir, f'{name}.npy'), mode=mode, dtype=np.float32, shape=(npoints,))
+
+def evaluate_grid_out_of_core(model_fine, fine_model_secondary_list, cfg, model_type, dims, origin, spacing, work_dir, run, batch_size=2048, uncertainty_metric='pairwise', slab_depth=8, block_mask=None, pool=None, encoding=None, precision='fp32'):
+    r"""Like `evaluate_grid`, but writes into memory-mapped arrays in `work_dir`, one z-slab of `slab_depth`
+    points at a time.
+
+    After every slab the arrays are flushed and the progress (number of finished slabs, running min/max of every
+    output) is recorded in `work_dir/progress.json`. A run with the same `run` settings resumes at the first
+    unfinished slab. In adaptive mode (`block_mask` given) a slab is one z-slab of blocks, so `slab_depth` has to
+    be the block size. With a `pool` (see `slab_pool`) the slabs are evaluated by its workers, in order.
+
+    Returns the memory-mapped outputs and the min / max of every output over the whole grid.
+    """
+    npoints = grid_num_points(dims)
+    num_slabs = int(np.ceil(dims[2] / slab_depth))
+    names = output_names(model_type)
+
+    os.makedirs(work_dir, exist_ok=True)
+    progress = load_progress(work_dir, run)
+    if progress is None:
+        outputs = {name: open_work_array(work_dir, name, npoints, 'w+') for name in names}
+        progress = {'run': run, 'finished_slabs': 0, 'min': {name: None for name in names}, 'max': {name: None for name in names}}
+        save_progress(work_dir, progress)
+    else:
+        outputs = {name: open_work_array(work_dir, name, npoints, 'r+') for name in names}
+        print("Resuming at slab: ", progress['finished_slabs'], "/", num_slabs)
+
+    slabs = range(progress['finished_slabs'], num_slabs)
+    if pool is not None:
+        slab_results = pool.imap(evaluate_slab, slabs)
+    for slab in tqdm(slabs, initial=progress['finished_slabs'], total=num_slabs):
+        start, stop, batches = slab_batches(slab, dims, slab_depth, batch_size, block_mask)
+        if pool is None:
+            evaluate_grid(model_fine, fine_model_secondary_list, cfg, model_type, dims, origin, spacing, batch_size=batch_size, uncertainty_metric=uncertainty_metric, batches=batches, outputs=outputs, progress=False, encoding=encoding, precision=precision)
+        else:
+            _, slab_outputs = next(slab_results)
+            for name, array in slab_outputs.items():
+                outputs[name][start:stop] = array
+
+        # the slab is final once it is on disk; only then it counts towards min / max and the progress
+        for name, array in outputs.items():
+            array.flush()
+            slab_min, slab_max = float(np.min(array[start:stop])), float(np.max(array[start:stop]))
+            if progress['min'][name] is not None:
+                slab_min, slab_max = min(slab_min, progress['min'][name]), max(slab_max, progress['max'][name])
+            progress['min'][name], progress['max'][name] = slab_min, slab_max
+        progress['finished_slabs'] = slab + 1
+        save_progress(work_dir, progress)
+
+    return outputs, progress['min'], progress['max']
+
+def finalize_out_of_core(outputs, outputs_min, outputs_max, work_dir, chunk_size):
+    r"""Opacity and normalized uncertainties of memory-mapped outputs, computed chunk by chunk into new
+    memory-mapped arrays, so the raw outputs stay intact if this gets interrupted.
+    """
+    volumes = {}
+    for name, raw in outputs.items():
+        volume_name = 'opacity' if name == 'sigma' else name
+        volume = open_work_array(work_dir, f'{volume_name}_volume', raw.shape[0], 'w+')
+        for start in range(0, raw.shape[0], chunk_size):
+            chunk = volume[start : start + chunk_size]
+            if name == 'sigma':
+                np.exp(-raw[start : start + chunk_size], out=chunk)
+                np.subtract(1.0, chunk, out=chunk)
+            else:
+                chunk[:] = raw[start : start + chunk_size]
+                normalize_min_max(chunk, outputs_min[name], outputs_max[name])
+        volume.flush()
+        volumes[volume_name] = volume
+    return volumes
+
+def write_volumes(volumes, file_prefix, dims, origin, spacing, suffix='', volume_format='vti', compression='zlib', metadata=None, quantize=None):
+    r"""Write the volumes as fields of one binary .vti file `{file_prefix}{suffix}.vti` (`compression` 'zlib',
+    'lz4', 'lzma' or None), or as a legacy .vtk file per volume, `{file_prefix}_{name}{suffix}.vtk`.
+
+    `metadata` maps volume names to numbers stored with them in the .vti file, as `{name}:{key}`. With `quantize`
+    ('uint8' or 'uint16') the uncertainties are stored as that type and opacity as uint16, together with the
+    scale and offset back to their values; sigma stays float32.
+    """
+    metadata = {name: dict(values) for name, values in (metadata or {}).items()}
+    if quantize is not None:
+        if quantize not in QUANTIZED_TYPES:
+            raise ValueError(f'Unknown quantization {quantize}; valid quantizations: {", ".join(QUANTIZED_TYPES)}')
+        if volume_format != 'vti':
+            raise ValueError('Quantized volumes can only be stored as vti')
+        volumes = dict(volumes)
+        for name in volumes:
+            if name == 'sigma':
+                continue
+            dtype = np.uint16 if name == 'opacity' else QUANTIZED_TYPES[quantize]
+            volumes[name], scale = quantize_unit_interval(volumes[name], dtype)
+            metadata.setdefault(name, {}).update(quantization_scale=scale, quantization_offset=0.0)
+
+    if volume_format == 'vti':
+        volume = volume_from_fields(volumes, dims, origin, spacing)
+        file_metadata = {f'{name}:{key}': value for name, values in metadata.items() for key, value in values.items()}
+        write_volume_to_vti_file(volume, f'{file_prefix}{suffix}.vti', compression=compression, metadata=file_metadata)
+    elif volume_format == 'vtk':
+        for name, scalars in volumes.items():
+            volume = volume_from_numpy(scalars, dims, origin, spacing)
+            write_volume_to_vtk_file(volume, f'{file_prefix}_{name}{suffix}.vtk')
+    else:
+        raise ValueError(f'Unknown volume format {volume_format}; valid formats: vti, vtk')
+
+def write_volume_pyramid(volumes, file_prefix, dims, origin, spacing, num_levels, uncertainty_reduction='max', resolution=None, **write_args):
+    r"""Write `num_levels` coarser versions of the volumes, each at half the resolution of the previous one.
+
+    Opacity (and sigma) is reduced with max, so thin structures survive at coarse levels; the uncertainties with
+    `uncertainty_reduction`. Level files get the resolution as suffix, e.g. `chair_full_100000_64.vti`: `resolution`
+    (default: the points along x) halved for every level. `write_args` are passed on to `write_volumes`.
+    """
+    resolution = dims[0] if resolution is None else resolution
+    for level in range(num_levels):
+        coarse_volumes = {}
+        for name, scalars in volumes.items():
+            reduction = 'max' if name in ('opacity', 'sigma') else uncertainty_reduction
+            coarse_volumes[name] = downsample_volume(scalars, dims, reduction)
+        volumes = coarse_volumes
+        dims, origin, spacing = downsample_grid(dims, origin, spacing)
+        write_volumes(volumes, file_prefix, dims, origin, spacing, suffix=f'_{resolution >> (level + 1)}', **write_args)
+
+def volume_grid(model_fine, cfg, xyzNumPoint, fit_bounds=False, probe_resolution=32, occupancy_threshold=0.01, bounds_margin=0.05, batch_size=2048):
+    # dims, origin and spacing of the cubic scene grid, or of a grid with as many points fitted to the object
+    xyzMin = -1.5
+    xyzMax = 1.5
+
+    dims = (xyzNumPoint, xyzNumPoint, xyzNumPoint)
+    origin = (xyzMin, xyzMin, xyzMin)
+    spacing = grid_spacing(origin, (xyzMax, xyzMax, xyzMax), dims)
+
+    if fit_bounds:
+        # probe the density over the whole scene, then spend the same number of points on a box around the object
+        probe_dims = (probe_resolution, probe_resolution, probe_resolution)
+        probe_spacing = grid_spacing(origin, (xyzMax, xyzMax, xyzMax), probe_dims)
+        probe_sigma = evaluate_density(model_fine, cfg, probe_dims, origin, probe_spacing, batch_size=batch_size)
+        bounds = fit_grid_bounds(probe_sigma, probe_dims, origin, probe_spacing, threshold=occupancy_threshold, margin=bounds_margin)
+        if bounds is not None:
+            dims, origin, spacing = isotropic_grid(*bounds, grid_num_points(dims))
+        print("Grid points: ", dims, "spacing: ", spacing[0])
+    return dims, origin, spacing
+
+def occupancy_mask(model_fine, cfg, dims, origin, spacing, block_size, occupancy_threshold=0.01, dilation=1, batch_size=2048):
+    # probe the density at the block corners; adaptive mode only evaluates the fine grid inside occupied blocks
+    num_blocks = tuple(int(np.ceil(n / block_size)) for n in dims)
+    probe_dims = tuple(n + 1 for n in num_blocks)
+    probe_spacing = tuple(block_size * d for d in spacing)
+    probe_sigma = evaluate_density(model_fine, cfg, probe_dims, origin, probe_spacing, batch_size=batch_size)
+    block_mask = occupied_blocks(probe_sigma, num_blocks, threshold=occupancy_threshold, dilation=dilation)
+    print("Occupied blocks: ", int(block_mask.sum()), "/", block_mask.numel())
+    return block_mask
+
+# options of volume_generator with their defaults; a manifest job (see load_volume_manifest) sets them next to
+# the keys of its checkpoint
+VOLUME_OPTIONS = {
+    # grid, see volume_grid
+    'xyzNumPoint': 128,
+    'fit_bounds': False,
+    'probe_resolution': 32,
+    'bounds_margin': 0.05,
+    # outputs
+    'uncertainty_metric': 'pairwise',
+    'write_sigma': False,
+    # only the occupied blocks, see occupancy_mask
+    'adaptive': False,
+    'block_size': 8,
+    'occupancy_threshold': 0.01,
+    'dilation': 1,
+    # evaluation, see evaluate_grid_out_of_core, slab_pool and encoded_grid
+    'out_of_core': False,
+    'slab_depth': 8,
+    'num_workers': 0,
+    'threads_per_worker': None,
+    'cache_encoding': False,
+    'encoding_cache_dir': None,
+    'precision': 'fp32',
+    'inference_graph': 'None',
+    # storage, see write_volumes and write_volume_pyramid
+    'volume_format': 'vti',
+    'compression': 'zlib',
+    'quantize': None,
+    'pyramid_levels': 0,
+    'uncertainty_reduction': 'max',
+}
+
+# options of volume_series: one multi-field .vti file per time step, quantized and with a shared grid encoding
+VOLUME_SERIES_OPTIONS = {
+    **{name: VOLUME_OPTIONS[name] for name in ['xyzNumPoint', 'fit_bounds', 'probe_resolution', 'bounds_margin', 'uncertainty_metric', 'write_sigma', 'adaptive', 'block_size', 'occupancy_threshold', 'dilation', 'precision', 'inference_graph', 'compression']},
+    'cache_encoding': True,
+    'quantize': 'uint8',
+}
+
+# options of bake_grid
+BAKE_OPTIONS = {
+    **{name: VOLUME_OPTIONS[name] for name in ['xyzNumPoint', 'probe_resolution', 'bounds_margin', 'occupancy_threshold', 'dilation', 'precision']},
+    'fit_bounds': True,
+    'members': True,
+}
+
+def volume_options(options=None, defaults=VOLUME_OPTIONS):
+    # `defaults` updated with `options`, which may only set options `defaults` has
+    options = dict(options or {})
+    unknown = [name for name in options if name not in defaults]
+    if len(unknown) > 0:
+        raise ValueError(f'Unknown volume options {", ".join(unknown)}; valid options: {", ".join(defaults)}')
+    return {**defaults, **options}
+
+def volume_generator(scene, dataset, model_type, iteration, options=None, models=None):
+    r"""Evaluate a checkpoint on a grid and write its opacity and uncertainty volumes (and pyramid levels).
+
+    `options` override `VOLUME_OPTIONS`. `models` are the config and models of the checkpoint if they are loaded
+    already (see `load_volume_models`).
+    """
+    batch_size = 2048
+    options = volume_options(options)
+    # changed below for adaptive grids and inference graphs
+    slab_depth, cache_encoding = options['slab_depth'], options['cache_encoding']
+
+    load_checkpoint = checkpoint_path(scene, dataset, model_type, iteration)
+
+    # models can be shared by jobs of the same checkpoint, see run_volume_jobs
+    if models is None:
+        models = load_volume_models(scene, dataset, model_type, iteration)
+    cfg_dict, model_fine, fine_model_secondary_list = models
+    cfg = CfgNode(cfg_dict)
 
     print('----------------------------------------')
     print("Scene: ", scene)
     print("Dataset: ", dataset)
     print("Iteration: ", iteration)
-    print("Points per dimension: ", xyzNumPoint)
+    print("Points per dimension: ", options['xyzNumPoint'])
+
+    dims, origin, spacing = volume_grid(model_fine, cfg, options['xyzNumPoint'], fit_bounds=options['fit_bounds'], probe_resolution=options['probe_resolution'], occupancy_threshold=options['occupancy_threshold'], bounds_margin=options['bounds_margin'], batch_size=batch_size)
+
+    batches, num_batches, block_mask = None, None, None
+    if options['adaptive']:
+        block_mask = occupancy_mask(model_fine, cfg, dims, origin, spacing, options['block_size'], occupancy_threshold=options['occupancy_threshold'], dilation=options['dilation'], batch_size=batch_size)
+        batches = block_batches(block_mask, dims, options['block_size'], batch_size)
+        num_batches = int(np.ceil(int(block_mask.sum()) * options['block_size'] ** 3 / batch_size))
+        # slabs (out-of-core and parallel mode) are z-slabs of blocks
+        slab_depth = options['block_size']
+
+    # with an inference graph (see inference_graph_models) the models encode the grid points themselves
+    if options['inference_graph'] != 'None':
+        cache_encoding = False
+        if options['num_workers'] == 0:
+            model_fine, fine_model_secondary_list = inference_graph_models(model_fine, fine_model_secondary_list, cfg, options['inference_graph'])
+
+    # the encoded grid is shared by all jobs on the same grid, in memory or memory-mapped in encoding_cache_dir
+    encoding = None
+    if cache_encoding and (options['num_workers'] == 0 or options['encoding_cache_dir'] is not None):
+        encoding = encoded_grid(dims, origin, spacing, cfg.models.fine, cache_dir=options['encoding_cache_dir'], batch_size=batch_size)
+
+    pool = None
+    if options['num_workers'] > 0:
+        grid = {'dims': dims, 'origin': origin, 'spacing': spacing, 'slab_depth': slab_depth, 'block_mask': block_mask, 'batch_size': batch_size, 'uncertainty_metric': options['uncertainty_metric'], 'encoding_cache_dir': options['encoding_cache_dir'] if cache_encoding else None, 'precision': options['precision'], 'inference_graph': options['inference_graph']}
+        pool = slab_pool(options['num_workers'], cfg_dict, model_type, load_checkpoint, grid, threads_per_worker=options['threads_per_worker'])
+
+    file_prefix = volume_file_prefix(scene, dataset, model_type, iteration)
+
+    if options['out_of_core']:
+        # results live in memory-mapped arrays next to the volumes until they are written
+        work_dir = file_prefix + '_work'
+        run = {
+            'checkpoint': load_checkpoint,
+            'checkpoint_mtime': os.path.getmtime(load_checkpoint),
+            'model_type': model_type,
+            'uncertainty_metric': options['uncertainty_metric'],
+            'dims': list(dims),
+            'origin': list(origin),
+            'spacing': list(spacing),
+            'adaptive': options['adaptive'],
+            'occupancy_threshold': options['occupancy_threshold'],
+            'dilation': options['dilation'],
+            'slab_depth': slab_depth,
+            'precision': options['precision'],
+        }
+        outputs, outputs_min, outputs_max = evaluate_grid_out_of_core(model_fine, fine_model_secondary_list, cfg, model_type, dims, origin, spacing, work_dir, run, batch_size=batch_size, uncertainty_metric=options['uncertainty_metric'], slab_depth=slab_depth, block_mask=block_mask, pool=pool, encoding=encoding, precision=options['precision'])
+        volumes = finalize_out_of_core(outputs, outputs_min, outputs_max, work_dir, chunk_size=dims[0] * dims[1] * slab_depth)
+        ranges = {name: (outputs_min[name], outputs_max[name]) for name in volumes if name != 'opacity'}
+    else:
+        if pool is not None:
+            outputs = evaluate_grid_parallel(pool, model_type, dims, slab_depth, block_mask=block_mask)
+        else:
+            outputs = evaluate_grid(model_fine, fine_model_secondary_list, cfg, model_type, dims, origin, spacing, batch_size=batch_size, uncertainty_metric=options['uncertainty_metric'], batches=batches, num_batches=num_batches, encoding=encoding, precision=options['precision'])
 
-    dxyz = abs(xyzMax - xyzMin) / (xyzNumPoint - 1)
+        final_alpha = 1.0 - np.exp(-outputs['sigma'])
+        volumes = {'opacity': final_alpha}
 
-    voxelVol = vtkStructuredPoints()
-    #voxelVol = vtkImageData()
-    voxelVol.SetDimensions(xyzNumPoint, xyzNumPoint, xyzNumPoint)
-    voxelVol.SetOrigin(-(abs(xyzMax-xyzMin)/2), -(abs(xyzMax-xyzMin)/2), -(abs(xyzMax-xyzMin)/2))
-    # voxelVol.SetOrigin(-(abs(xyzMax-xyzMin)/2), -(abs(xyzMax-xyzMin)/2), 0.0)   # <===
-    # voxelVol.SetOrigin(-(abs(xyzMax-xyzMin)/2), -(abs(xyzMax-xyzMin)/2), -0.5)   # <===
-    voxelVol.SetSpacing(dxyz, dxyz, dxyz)
+        ranges = {}
+        for name in output_names(model_type)[1:]:
+            ranges[name] = (float(np.min(outputs[name])), float(np.max(outputs[name])))
+            volumes[name] = normalize_min_max(outputs[name], *ranges[name])
 
-    #arrayColor = vtkDoubleArray()
-    arrayColor = vtkFloatArray()
-    arrayColor.SetNumberOfComponents(3) # this is 3 for a vector
-    arrayColor.SetNumberOfTuples(voxelVol.GetNumberOfPoints())
+    if pool is not None:
+        pool.close()
+        pool.join()
 
-    #arrayDensity = vtkDoubleArray()
-    arrayDensity = vtkFloatArray()
-    arrayDensity.SetNumberOfComponents(1) # this is 3 for a vector
-    arrayDensity.SetNumberOfTuples(voxelVol.GetNumberOfPoints())
+    if options['write_sigma']:
+        volumes['sigma'] = outputs['sigma']
 
-    
-    tensor_input = torch.zeros(batch_size, dim_xyz+dim_dir)
-    npoints = voxelVol.GetNumberOfPoints()
-    
-    with torch.no_grad():
-        num_iterations = int(np.ceil(npoints / batch_size))
-        
-        output_point_color = []
-        output_point_density = []
-        output_point_uncertainty = []
-        for i in tqdm(range(num_iterations)):
-            indices = np.arange(i*batch_size, min((i+1)*batch_size, npoints))
-            # print(f'{np.max(indices)}/{npoints}')
-            
-            xyzs = []
-            for index in indices:
-                x, y, z = voxelVol.GetPoint(index)
-                xyzs.append([x,y,z])
-            xyz_tensor = torch.Tensor(xyzs)
-            encode_pos = helpers.embedding_encoding(xyz_tensor, num_encoding_functions=cfg.models.fine.num_encoding_fn_xyz)
-
-            tensor_input = torch.zeros(len(indices), dim_xyz+dim_dir)
-            tensor_input[..., : dim_xyz] = encode_pos
-
-            if cfg.models.fine.use_viewdirs:
-                encode_dir = helpers.embedding_encoding(xyz_tensor, num_encoding_functions=cfg.models.fine.num_encoding_fn_dir)
-                # tensor_input[..., dim_xyz :] = encode_dir
-                encode_dir_zeros = torch.zeros_like(encode_dir)
-                tensor_input[..., dim_xyz :] = encode_dir_zeros
-            
-            output = model_fine(tensor_input) # [R, G, B, sigma] ###
-            
-            if model_type == 'ensemble':
-                outputs_secondary = []
-                for k in range(cfg.experiment.num_models_secondary):
-                    output_secondary = fine_model_secondary_list[k](tensor_input)       # [R, G, B, sigma]
-                    outputs_secondary.append(output_secondary)
-
-            for j in range(output.shape[0]):
-                point_colors = []
-                point_densities = []
-
-                sigma = torch.nn.functional.relu(output[j, 3])
-                arrayDensity.SetValue(indices[j], sigma.cpu())
-                color = torch.sigmoid(output[j, :3])
-
-                point_colors.append(color)
-                point_densities.append([sigma])
-
-                if model_type == 'ensemble':
-                    for k in range(len(outputs_secondary)):
-                        output_secondary = outputs_secondary[k]
-                        color = torch.sigmoid(output_secondary[j, :3])
-                        point_colors.append(color)    # Append the RGB color from the secondary models into the list
-                        sigma = torch.nn.functional.relu(output_secondary[j,3])
-                        point_densities.append([sigma])    # Append the density from the secondary models into the list
-                else:
-                    uncertainty = torch.nn.functional.relu(output[j, 4])
-                    output_point_uncertainty.append(uncertainty)
+    # the uncertainties are stored normalized, the metadata keeps the range they were normalized from
+    metadata = {name: {'normalization_min': value_min, 'normalization_max': value_max} for name, (value_min, value_max) in ranges.items()}
+    write_args = {'volume_format': options['volume_format'], 'compression': options['compression'], 'metadata': metadata, 'quantize': options['quantize']}
+    write_volumes(volumes, file_prefix, dims, origin, spacing, **write_args)
+    write_volume_pyramid(volumes, file_prefix, dims, origin, spacing, options['pyramid_levels'], uncertainty_reduction=options['uncertainty_reduction'], resolution=options['xyzNumPoint'], **write_args)
 
-                output_point_color.append(point_colors)
-                output_point_density.append(point_densities)
+    if options['out_of_core']:
+        shutil.rmtree(work_dir)
 
-        output_point_color = np.array(output_point_color)
-        output_point_density = np.array(output_point_density)
-        
-        if model_type == 'ensemble':
-            uncertainties_color = []
-            uncertainties_density = []
-            for i in range(output_point_color.shape[0]):
-                point_colors = output_point_color[i]
-                point_densities = output_point_density[i]
-
-                avg_distance_color = np.mean(pdist(point_colors, metric='euclidean'))
-                uncertainties_color.append(avg_distance_color)
-
-                avg_distance_density = np.mean(pdist(point_densities, metric='euclidean'))
-                uncertainties_density.append(avg_distance_density)
-        
-        final_sigma = torch.Tensor(output_point_density[:,0])
-        final_alpha = 1.0 - torch.exp(-final_sigma)
-        alpha = numpy_support.numpy_to_vtk(num_array=final_alpha.numpy(), deep=True)
-
-        voxelVolOpacity = vtkStructuredPoints()
-        voxelVolOpacity.DeepCopy(voxelVol)
-        voxelVolOpacity.GetPointData().SetScalars(alpha)
-
-        store_path = f'datasets/{scene}/{model_type}/{dataset}/'
-
-        writerOpacity = vtkStructuredPointsWriter()
-        writerOpacity.WriteExtentOn()
-        writerOpacity.SetFileName(store_path + "{}_{}_{}_opacity.vtk".format(scene, dataset, iteration))
-        writerOpacity.SetInputData(voxelVolOpacity)
-        writerOpacity.Write()
+def series_file_name(scene, dataset, model_type):
+    return f'datasets/{scene}/{model_type}/{dataset}/{scene}_{dataset}_series.pvd'
 
-        if model_type == 'ensemble':
-            # ### === Generate VTK file for RGB color uncertainty === ###
-            uncertaintyColor_np = np.array(uncertainties_color)
+def series_step_prefix(scene, dataset, model_type, iteration):
+    # the time steps live next to the index, apart from the volumes volume_generator writes
+    return f'datasets/{scene}/{model_type}/{dataset}/{scene}_{dataset}_series/{scene}_{dataset}_{iteration}'
 
-            uncertaintyColor_np_normalize = (uncertaintyColor_np - np.min(uncertaintyColor_np)) / (np.max(uncertaintyColor_np) - np.min(uncertaintyColor_np))
-            arrayUncertaintyColor_vtk = numpy_support.numpy_to_vtk(num_array=uncertaintyColor_np_normalize, deep=True)
+def volume_series(scene, dataset, model_type, iterations, options=None):
+    r"""Volumes of a list of training iterations as a time series, for the viewer to step through.
 
-            voxelVolUncertaintyColor = vtkStructuredPoints()
-            voxelVolUncertaintyColor.DeepCopy(voxelVol)
-            voxelVolUncertaintyColor.GetPointData().SetScalars(arrayUncertaintyColor_vtk)
+    Everything that does not depend on the weights is set up once: the models, the grid, the encoded grid inputs
+    and the output arrays. The grid (with `fit_bounds`) and the occupied blocks (with `adaptive`) are those of
+    the last iteration, the trained object. Every checkpoint is then loaded into the same models and evaluated
+    into the same arrays. `options` override `VOLUME_SERIES_OPTIONS`.
 
-            writerUncertaintyColor = vtkStructuredPointsWriter()
-            writerUncertaintyColor.WriteExtentOn()
-            writerUncertaintyColor.SetFileName(store_path + "{}_{}_{}_uncertainty_color.vtk".format(scene, dataset, iteration))
-            writerUncertaintyColor.SetInputData(voxelVolUncertaintyColor)
-            writerUncertaintyColor.Write()
+    Every time step is a multi-field .vti file, quantized with `quantize` by default (see `write_volumes`), and
+    `series_file_name` is a ParaView collection (.pvd) that indexes them by iteration.
+    """
+    batch_size = 2048
+    options = volume_options(options, defaults=VOLUME_SERIES_OPTIONS)
+    iterations = sorted(iterations)
 
-            ### === Generate VTK file for density uncertainty === ###
-            uncertaintyDesnity_np = np.array(uncertainties_density)
+    cfg_dict, model_fine, fine_model_secondary_list = load_volume_models(scene, dataset, model_type, iterations[-1])
+    cfg = CfgNode(cfg_dict)
 
-            uncertaintyDesnity_np_normalize = (uncertaintyDesnity_np - np.min(uncertaintyDesnity_np)) / (np.max(uncertaintyDesnity_np) - np.min(uncertaintyDesnity_np))
-            arrayUncertaintyDensity_vtk = numpy_support.numpy_to_vtk(num_array=uncertaintyDesnity_np_normalize, deep=True)
+    print('----------------------------------------')
+    print("Scene: ", scene)
+    print("Dataset: ", dataset)
+    print("Iterations: ", ', '.join(str(iteration) for iteration in iterations))
+    print("Points per dimension: ", options['xyzNumPoint'])
+
+    dims, origin, spacing = volume_grid(model_fine, cfg, options['xyzNumPoint'], fit_bounds=options['fit_bounds'], probe_resolution=options['probe_resolution'], occupancy_threshold=options['occupancy_threshold'], bounds_margin=options['bounds_margin'], batch_size=batch_size)
+    npoints = grid_num_points(dims)
+
+    block_mask, num_batches = None, None
+    if options['adaptive']:
+        block_mask = occupancy_mask(model_fine, cfg, dims, origin, spacing, options['block_size'], occupancy_threshold=options['occupancy_threshold'], dilation=options['dilation'], batch_size=batch_size)
+        num_batches = int(np.ceil(int(block_mask.sum()) * options['block_size'] ** 3 / batch_size))
+
+    encoding = encoded_grid(dims, origin, spacing, cfg.models.fine, batch_size=batch_size) if options['cache_encoding'] and options['inference_graph'] == 'None' else None
+
+    # points outside the occupied blocks are never written, so they keep zero density and uncertainty at every
+    # step; the volumes are normalized in arrays of their own to keep it that way
+    outputs = {name: np.zeros(npoints, dtype=np.float32) for name in output_names(model_type)}
+    volumes = {'opacity': np.empty(npoints, dtype=np.float32)}
+    volumes.update({name: np.empty(npoints, dtype=np.float32) for name in output_names(model_type)[1:]})
+
+    steps = []
+    for iteration in iterations:
+        print("Iteration: ", iteration)
+        load_checkpoint_weights(model_fine, fine_model_secondary_list, model_type, checkpoint_path(scene, dataset, model_type, iteration))
+
+        # the weights are part of the graphs, which are exported again for every checkpoint
+        graph_models = (model_fine, fine_model_secondary_list)
+        if options['inference_graph'] != 'None':
+            graph_models = inference_graph_models(model_fine, fine_model_secondary_list, cfg, options['inference_graph'])
+
+        batches = block_batches(block_mask, dims, options['block_size'], batch_size) if options['adaptive'] else None
+        evaluate_grid(*graph_models, cfg, model_type, dims, origin, spacing, batch_size=batch_size, uncertainty_metric=options['uncertainty_metric'], batches=batches, num_batches=num_batches, outputs=outputs, encoding=encoding, precision=options['precision'])
+
+        np.exp(-outputs['sigma'], out=volumes['opacity'])
+        np.subtract(1.0, volumes['opacity'], out=volumes['opacity'])
+
+        metadata = {}
+        for name in output_names(model_type)[1:]:
+            value_min, value_max = float(np.min(outputs[name])), float(np.max(outputs[name]))
+            np.copyto(volumes[name], outputs[name])
+            normalize_min_max(volumes[name], value_min, value_max)
+            metadata[name] = {'normalization_min': value_min, 'normalization_max': value_max}
+
+        step_volumes = {**volumes, 'sigma': outputs['sigma']} if options['write_sigma'] else volumes
+        step_prefix = series_step_prefix(scene, dataset, model_type, iteration)
+        os.makedirs(os.path.dirname(step_prefix), exist_ok=True)
+        write_volumes(step_volumes, step_prefix, dims, origin, spacing, compression=options['compression'], metadata=metadata, quantize=options['quantize'])
+        steps.append((iteration, f'{step_prefix}.vti'))
+
+        # the index is rewritten after every step, so a series that is still being generated can be opened
+        write_volume_series_file(series_file_name(scene, dataset, model_type), steps)
+
+def baked_grid_file_name(scene, dataset, model_type, iteration):
+    return f'{volume_file_prefix(scene, dataset, model_type, iteration)}_baked.npz'
+
+def bake_grid(scene, dataset, model_type, iteration, options=None, models=None):
+    r"""Bake the fine model of a checkpoint into a sparse voxel grid (see `nerf.BakedGrid`) that the viewer
+    renders views from without the networks.
+
+    The density of the main model is evaluated on the whole grid first; the full outputs are only evaluated and
+    stored at the points above `occupancy_threshold`, grown by `dilation` points. With `members` the grid also
+    stores the mean and variance of the ensemble members (the main model and the secondary models). `options`
+    override `BAKE_OPTIONS`.
+    """
+    batch_size = 2048
+    options = volume_options(options, defaults=BAKE_OPTIONS)
 
-            voxelVolUncertaintyDensity = vtkStructuredPoints()
-            voxelVolUncertaintyDensity.DeepCopy(voxelVol)
-            voxelVolUncertaintyDensity.GetPointData().SetScalars(arrayUncertaintyDensity_vtk)
+    if models is None:
+        models = load_volume_models(scene, dataset, model_type, iteration)
+    cfg_dict, model_fine, fine_model_secondary_list = models
+    cfg = CfgNode(cfg_dict)
+    members = options['members'] and model_type == 'ensemble'
 
-            writerUncertaintyDensity = vtkStructuredPointsWriter()
-            writerUncertaintyDensity.WriteExtentOn()
-            writerUncertaintyDensity.SetFileName(store_path + "{}_{}_{}_uncertainty_density.vtk".format(scene, dataset, iteration))
-            writerUncertaintyDensity.SetInputData(voxelVolUncertaintyDensity)
-            writerUncertaintyDensity.Write()
+    print('----------------------------------------')
+    print("Baking scene: ", scene)
+    print("Dataset: ", dataset)
+    print("Iteration: ", iteration)
+    print("Points per dimension: ", options['xyzNumPoint'])
+
+    dims, origin, spacing = volume_grid(model_fine, cfg, options['xyzNumPoint'], fit_bounds=options['fit_bounds'], probe_resolution=options['probe_resolution'], occupancy_threshold=options['occupancy_threshold'], bounds_margin=options['bounds_margin'], batch_size=batch_size)
+    sigma = evaluate_density(model_fine, cfg, dims, origin, spacing, batch_size=batch_size)
+    occupied = OccupancyGrid.from_values(sigma, dims, origin, spacing, threshold=options['occupancy_threshold'], dilation=options['dilation']).occupied
+    point_ids = torch.nonzero(occupied.flatten()).squeeze(-1)
+    print("Stored points: ", len(point_ids), "/", grid_num_points(dims))
+
+    radiance = np.zeros((len(point_ids), 4), dtype=np.float32)
+    mean = np.zeros((len(point_ids), 4), dtype=np.float32) if members else None
+    variance = np.zeros((len(point_ids), 4), dtype=np.float32) if members else None
+    with torch.no_grad(), inference_autocast(options['precision']):
+        for start in tqdm(range(0, len(point_ids), batch_size)):
+            indices = point_ids[start : start + batch_size]
+            tensor_input = encode_grid_points(grid_points(indices, dims, origin, spacing), cfg.models.fine)
+
+            output = model_fine(tensor_input).float()
+            radiance[start : start + len(indices)] = output[:, :4].numpy()
+
+            if members:
+                member_outputs = [output]
+                if len(fine_model_secondary_list) > 0:
+                    member_outputs += list(fine_model_secondary_list(tensor_input).float())
+                member_outputs = torch.stack([torch.cat((torch.sigmoid(member[:, :3]), torch.nn.functional.relu(member[:, 3:4])), dim=-1) for member in member_outputs], dim=0)
+                mean[start : start + len(indices)] = member_outputs.mean(dim=0).numpy()
+                variance[start : start + len(indices)] = member_outputs.var(dim=0, unbiased=False).numpy()
+
+    baked_grid = BakedGrid(dims, origin, spacing, point_ids.numpy(), radiance, mean=mean, variance=variance, white_background=cfg.nerf.validation.white_background)
+    baked_grid.save(baked_grid_file_name(scene, dataset, model_type, iteration))
+
+# keys of a manifest job that name its checkpoint and kind, the others are options (see job_options)
+JOB_KEYS = ['scene', 'dataset', 'model_type', 'iteration', 'iterations', 'bake']
+
+def job_options(job):
+    return {key: value for key, value in job.items() if key not in JOB_KEYS}
+
+def job_option_defaults(job):
+    # the options a job of this kind takes, see run_volume_jobs
+    if 'iterations' in job:
+        return VOLUME_SERIES_OPTIONS
+    if job.get('bake', False):
+        return BAKE_OPTIONS
+    return VOLUME_OPTIONS
+
+def volume_output_files(job):
+    # files volume_generator writes for a job, volume_series for a job with a list of `iterations` or bake_grid
+    # for a job with `bake`
+    if job.get('bake', False):
+        return [baked_grid_file_name(job['scene'], job['dataset'], job['model_type'], job['iteration'])]
+    if 'iterations' in job:
+        step_files = [f'{series_step_prefix(job["scene"], job["dataset"], job["model_type"], iteration)}.vti' for iteration in job['iterations']]
+        return step_files + [series_file_name(job['scene'], job['dataset'], job['model_type'])]
+
+    file_prefix = volume_file_prefix(job['scene'], job['dataset'], job['model_type'], job['iteration'])
+    options = volume_options(job_options(job))
+    resolution = options['xyzNumPoint']
+    suffixes = [''] + [f'_{resolution >> (level + 1)}' for level in range(options['pyramid_levels'])]
+    if options['volume_format'] == 'vti':
+        return [f'{file_prefix}{suffix}.vti' for suffix in suffixes]
+
+    names = ['opacity'] + output_names(job['model_type'])[1:] + (['sigma'] if options['write_sigma'] else [])
+    return [f'{file_prefix}_{name}{suffix}.vtk' for name in names for suffix in suffixes]
+
+def volume_job_checkpoints(job):
+    iterations = job['iterations'] if 'iterations' in job else [job['iteration']]
+    return [checkpoint_path(job['scene'], job['dataset'], job['model_type'], iteration) for iteration in iterations]
+
+def volume_job_prefix(job):
+    if job.get('bake', False):
+        return baked_grid_file_name(job['scene'], job['dataset'], job['model_type'], job['iteration'])
+    if 'iterations' in job:
+        return series_file_name(job['scene'], job['dataset'], job['model_type'])
+    return volume_file_prefix(job['scene'], job['dataset'], job['model_type'], job['iteration'])
+
+def volume_job_is_stale(job):
+    # a job has to run if any of its files is missing or older than the (newest) checkpoint
+    checkpoint_mtime = max(os.path.getmtime(checkpoint) for checkpoint in volume_job_checkpoints(job))
+    return any(not os.path.exists(file_name) or os.path.getmtime(file_name) < checkpoint_mtime for file_name in volume_output_files(job))
+
+def load_volume_manifest(manifest_file):
+    r"""Jobs of a manifest, as dicts of the keys of their checkpoint (`JOB_KEYS`) and their options.
+
+    A manifest is a .yml file with a list of `jobs` and optional `defaults` for all of them. A job either names
+    its checkpoint (`scene`, `dataset`, `model_type`, `iteration`) or has `configs`, a glob of viewer config
+    files (e.g. `datasets/*/*/*.yml`) that adds a job per config. Any other key is an option of
+    `volume_generator` (see `VOLUME_OPTIONS`).
+    A job with a list of `iterations` instead of an `iteration` is passed to `volume_series`, a job with `bake`
+    to `bake_grid`. `defaults` only go to the jobs whose kind has the option (`job_option_defaults`):
+
+        defaults:
+          xyzNumPoint: 128
+          pyramid_levels: 2
+        jobs:
+          - configs: datasets/*/*/*.yml
+          - {scene: chair, dataset: full, model_type: ensemble, iteration: 200000, xyzNumPoint: 256}
+          - {scene: chair, dataset: full, model_type: ensemble, iterations: [50000, 100000, 150000, 200000]}
+          - {scene: chair, dataset: full, model_type: ensemble, iteration: 200000, bake: true}
+    """
+    with open(manifest_file, "r") as f:
+        manifest = yaml.load(f, Loader=yaml.FullLoader)
+
+    defaults = manifest.get('defaults') or {}
+    # options of any kind of job; the ones of other kinds are left out of the defaults of a job, anything else
+    # (e.g. a misspelled option) is kept so that it is reported
+    all_options = {**VOLUME_OPTIONS, **VOLUME_SERIES_OPTIONS, **BAKE_OPTIONS}
+    jobs = []
+    for entry in manifest['jobs']:
+        option_defaults = job_option_defaults({**defaults, **entry})
+        entry = {**{key: value for key, value in defaults.items() if key in option_defaults or key not in all_options}, **entry}
+        if 'configs' not in entry:
+            jobs.append(entry)
+            continue
+
+        for config_file in sorted(glob.glob(entry.pop('configs'))):
+            with open(config_file, "r") as f:
+                config_args = yaml.load(f, Loader=yaml.FullLoader)
+            jobs.append({
+                'scene': config_args['dataset'],
+                'dataset': config_args['dataset_config'],
+                'model_type': config_args['model_type'],
+                'iteration': config_args['iterations'],
+                **entry,
+            })
+    return jobs
+
+def run_volume_jobs(jobs):
+    r"""Run jobs of one checkpoint one after the other, on models that are loaded once.
+
+    Returns the file prefix and the error message (None on success) of every job.
+    """
+    results = []
+    models = None
+    for job in jobs:
+        file_prefix = volume_job_prefix(job)
+        try:
+            if 'iterations' in job:
+                volume_series(job['scene'], job['dataset'], job['model_type'], job['iterations'], options=job_options(job))
+            else:
+                if models is None:
+                    models = load_volume_models(job['scene'], job['dataset'], job['model_type'], job['iteration'])
+                if job.get('bake', False):
+                    bake_grid(job['scene'], job['dataset'], job['model_type'], job['iteration'], options=job_options(job), models=models)
+                else:
+                    volume_generator(job['scene'], job['dataset'], job['model_type'], job['iteration'], options=job_options(job), models=models)
+            results.append((file_prefix, None))
+        except (Exception, SystemExit) as error:
+            results.append((file_prefix, str(error)))
+    return results
+
+def init_volume_job_worker(num_threads):
+    torch.set_num_threads(num_threads)
+
+def run_volume_manifest(manifest_file, num_workers=None, force=False):
+    r"""Run the stale jobs of a manifest (see `load_volume_manifest`), or all of them with `force`.
+
+    Jobs of the same checkpoint share their models and run in the same worker; the checkpoints are spread over
+    `num_workers` processes (default: one per core), which divide the cores between them. A series is a group of
+    its own.
+    """
+    groups = {}
+    for job in load_volume_manifest(manifest_file):
+        checkpoints = volume_job_checkpoints(job)
+        key = volume_job_prefix(job) if 'iterations' in job else checkpoints[0]
+        missing = [checkpoint for checkpoint in checkpoints if not os.path.exists(checkpoint)]
+        if len(missing) > 0:
+            print("Missing checkpoint, skipping: ", ', '.join(missing))
+        elif force or volume_job_is_stale(job):
+            groups.setdefault(key, []).append(job)
         else:
-            output_point_uncertainty = np.array(output_point_uncertainty)
-            output_point_uncertainty_normalize = (output_point_uncertainty - np.min(output_point_uncertainty)) / (np.max(output_point_uncertainty) - np.min(output_point_uncertainty))
-            uncertainty = numpy_support.numpy_to_vtk(num_array=output_point_uncertainty_normalize, deep=True)
-
-            voxel_vol_uncertainty = vtkStructuredPoints()
-            voxel_vol_uncertainty.DeepCopy(voxelVol)
-            voxel_vol_uncertainty.GetPointData().SetScalars(uncertainty)
-
-            writer_uncertainty = vtkStructuredPointsWriter()
-            writer_uncertainty.WriteExtentOn()
-            writer_uncertainty.SetFileName(store_path + "{}_{}_{}_uncertainty.vtk".format(scene, dataset, iteration))
-            writer_uncertainty.SetInputData(voxel_vol_uncertainty)
-            writer_uncertainty.Write()
+            print("Up to date: ", volume_job_prefix(job))
+
+    if len(groups) == 0:
+        return []
+
+    num_cores = os.cpu_count() or 1
+    num_workers = min(num_workers or num_cores, len(groups))
+    if num_workers == 1:
+        group_results = map(run_volume_jobs, groups.values())
+    else:
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(num_workers, initializer=init_volume_job_worker, initargs=(max(1, num_cores // num_workers),))
+        group_results = pool.imap_unordered(run_volume_jobs, groups.values())
+
+    results = [result for results in group_results for result in results]
+    if num_workers > 1:
+        pool.close()
+        pool.join()
+
+    print('----------------------------------------')
+    for file_prefix, error in results:
+        print("Failed: " if error else "Done: ", file_prefix, error or '')
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--manifest", type=str, required=True, help="Path to (.yml) manifest of volume jobs."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Number of processes the checkpoints are spread over."
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Also regenerate volumes that are newer than their checkpoint."
+    )
+
+    args = parser.parse_args()
+
+    results = run_volume_manifest(args.manifest, num_workers=args.workers, force=args.force)
+    if any(error for _, error in results):
+        sys.exit(1)